@@ -1,23 +1,37 @@
+import asyncio
+
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from abc import abstractmethod, ABC
 
-from pydantic import BaseModel, Field, model_validator, ConfigDict
+from pydantic import BaseModel, Field, PrivateAttr, model_validator, ConfigDict
 from typing_extensions import Self
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 # internal packages
-from app.logger import logger
-from app.schema import AgentState, Memory, Message, ROLE_TYPE
-from app.llm import LLM
+from app.logger import logger, log_event
+from app.checkpoint import CheckpointStore
+from app.schema import AgentState, Memory, Message, Role, RunBudget, RunContext, RunResult, StopReason, ToolCall, ROLE_TYPE
+from app.llm import LLM, LLMTimeoutError
+from app.tracing import TRACER, SpanKind
 from app.prompts.default import SYSTEM_INSTRUCTIONS, NEXT_STEP
 
+# Run contexts active in the current task, by agent. Never mutated in place, so
+# concurrent runs (each one in its own task) never see each other's context.
+_active_runs: ContextVar[Dict[int, RunContext]] = ContextVar("active_runs", default={})
+
 class BaseAgent(ABC, BaseModel):
     """Abstract class for Agents.
 
     Abstract class that manages the base functionalities of an agent, such as: memory managament,
-    state transition and step-by-step execution
+    state transition and step-by-step execution.
+
+    The agent holds only its definition (model, prompts, settings). Memory, state and
+    step counter belong to the RunContext of each `run()` call, so a single agent can
+    serve many concurrent runs. Outside of a run they refer to the last finished run,
+    or to an idle context holding the prompts.
     """
-    model_config = ConfigDict(arbitrary_types_allowed=True) # allow non pydantic classes 
+    model_config = ConfigDict(arbitrary_types_allowed=True, populate_by_name=True) # allow non pydantic classes 
     
     # Main attributes:
     name: str = Field(..., description="Unique and descriptive name for the agent")
@@ -29,12 +43,19 @@ class BaseAgent(ABC, BaseModel):
 
     # Artifacts
     model: LLM = Field(..., description="LLM object used for completion")
-    memory: Memory = Field(None, description="Agent memory")
-    state: AgentState = Field(default=AgentState.IDLE, description="Current agent state")
+    memory_template: Memory = Field(None, alias="memory", description="Memory settings, copied empty for every run")
 
     # Execution specifications
     max_steps: int = Field(default=10, description="Max execution steps allowed for the agent")
-    current_step: int = Field(default=0, description="Current step in execution")
+
+    # Durability
+    checkpoints: Optional[CheckpointStore] = Field(default=None, description="Checkpoints every step of the runs, so they can be resumed")
+
+    # Limits
+    budget: RunBudget = Field(default_factory=RunBudget, description="Default deadline, token and cost limits of the runs")
+
+    _idle_context: RunContext = PrivateAttr(default=None) # context used outside of any run
+    _running: Dict[str, RunContext] = PrivateAttr(default_factory=dict) # contexts of the runs in progress, by run id
 
     @model_validator(mode="after")
     def initialize_agent(self) -> Self:
@@ -46,15 +67,49 @@ class BaseAgent(ABC, BaseModel):
             self.system_instructions = SYSTEM_INSTRUCTIONS
         if not self.next_step_instructions:
             self.next_step_instructions = NEXT_STEP
-        if not self.memory:
-            self.memory = Memory()
+        if self.memory_template is None:
+            self.memory_template = Memory()
         
-        # Load instructions prompts to the agent
-        self.update_memory("system", self.system_instructions)
-        self.update_memory("system", self.next_step_instructions)
+        self._idle_context = self.new_context()
         
         return self
 
+    def new_context(self) -> RunContext:
+        """Creates the context of a new run, with instructions prompts loaded to its memory"""
+        memory = self.memory_template.empty_copy()
+        memory.add_message(Message.system_message(self.system_instructions))
+        memory.add_message(Message.system_message(self.next_step_instructions))
+
+        return RunContext(memory=memory)
+
+    @property
+    def context(self) -> RunContext:
+        """Context of the run being executed in the current task"""
+        return _active_runs.get().get(id(self), self._idle_context)
+
+    @property
+    def memory(self) -> Memory:
+        """Memory of the current run"""
+        return self.context.memory
+
+    @property
+    def state(self) -> AgentState:
+        """State of the current run"""
+        return self.context.state
+
+    @state.setter
+    def state(self, state: AgentState) -> None:
+        self.context.state = state
+
+    @property
+    def current_step(self) -> int:
+        """Step of the current run"""
+        return self.context.current_step
+
+    @current_step.setter
+    def current_step(self, step: int) -> None:
+        self.context.current_step = step
+
     def update_memory(self, role: str, content: str, tool_call_id: Optional[str] = None) -> None:
         """Add message to the agent memory
 
@@ -63,38 +118,18 @@ class BaseAgent(ABC, BaseModel):
             content: Message text content
             tool_call_id: Needed when the role is Tool
         """
-        message_map = {
-            "system": Message.system_message,
-            "assistant": Message.assistant_message,
-            "user": Message.user_message,
-            "tool": Message.tool_message
-        }
-
-        if role not in message_map:
+        if role not in ROLE_TYPE:
             raise ValueError(f"Role '{role}' not allowed. Allowed types are: {', '.join(role for role in ROLE_TYPE)}")
         
-        elif role == "tool":
+        if role == "tool":
             message = Message.tool_message(tool_call_id, content)
-            self.memory.add_message(message)
-
-        elif role == "assistant":
-            # check if this is a tool call
-            if isinstance(content, list):
-                message = Message(
-                    role="assistant",
-                    content="None",
-                    tool_calls=content  # list of tool call dicts
-                )
-            else:
-                message = Message.assistant_message(content)
-            
-            self.memory.add_message(message)
-
-
+        elif role == "assistant" and isinstance(content, list):
+            # tool call message, content holds the list of tool call dicts
+            message = Message(role=Role.ASSISTANT, content="None", tool_calls=content)
         else:
-            message_method = message_map[role]
-            message = message_method(content)
-            self.memory.add_message(message)
+            message = Message(role=role, content=content)
+
+        self.memory.add_message(message)
     
     @asynccontextmanager
     async def state_context(self, new_state: AgentState):
@@ -125,45 +160,233 @@ class BaseAgent(ABC, BaseModel):
         """
         raise NotImplementedError
 
-    async def run(self, request: str) -> str:
+    async def run(self, request: str, budget: Optional[RunBudget] = None) -> RunResult:
         """Run the agent based on a request.
         
+        Every call runs in its own RunContext, so several runs can proceed
+        concurrently on the same agent. The run, its steps, LLM calls and tool
+        calls are traced as spans (see app.tracing).
+
+        A run reaching its deadline or budget, whose LLM call times out, or
+        cancelled with `cancel`, stops early and returns its partial result,
+        with the reason in `stop_reason`. When streaming, the LLM timeout bounds
+        the wait for the response and for every chunk.
+
         request (str): Text request from user, other agents or tool
+        budget (RunBudget): (Optional) Limits of this run, the agent budget when None
+
+        Returns:
+            RunResult with the result of every step, the final answer and the run metrics
+        """
+        context = self.new_context()
+        context.budget = budget or self.budget
+        if self.checkpoints is not None:
+            context.checkpoint = self.checkpoints.create(context.run_id, self.name, request)
+            context.memory.start_journal()
+
+        return await self._execute(context, request)
+
+    async def resume(self, run_id: str) -> RunResult:
+        """Resumes a checkpointed run, after a crash or a restart.
+
+        The run context is rebuilt from the checkpoint log without any LLM or tool
+        call: memory, step results, step counter, tool call ledger and loop
+        detection state are restored, and tool calls requested before the
+        interruption are executed before reflecting again.
+
+        Args:
+            run_id: Identifier of the run, as returned in its RunResult
+
+        Returns:
+            RunResult of the whole run. Metrics only cover the resumed part. A
+            finished run is returned as is, with its stop reason
+
+        Raises:
+            ValueError: If checkpointing is disabled or the run has no checkpoint
+        """
+        if self.checkpoints is None:
+            raise ValueError(f"Agent '{self.name}' has no checkpoint store, runs cannot be resumed")
+
+        checkpoint = self.checkpoints.load(run_id)
+        context = self.new_context()
+        context.run_id = run_id
+        context.budget = self.budget
+        for payload in checkpoint.messages:
+            context.memory.add_message(Message(**payload))
+        context.results = checkpoint.results
+        # Pending tool calls were checkpointed in the middle of their step, which is executed again
+        context.current_step = checkpoint.current_step - 1 if checkpoint.tool_calls else checkpoint.current_step
+        context.tool_calls = [ToolCall(**tool_call) for tool_call in checkpoint.tool_calls]
+        context.ledger = dict(checkpoint.ledger)
+        context.call_history = [tuple(calls) for calls in checkpoint.call_history]
+        context.stalled_steps = checkpoint.stalled_steps
+        logger.info(f"Resuming run '{run_id}' of '{self.name}' from step {checkpoint.current_step} ({len(checkpoint.messages)} messages restored)")
+
+        if checkpoint.finished:
+            context.stop_reason = checkpoint.stop_reason # an unfinished run continues, whatever stopped it
+            self._idle_context = context
+            return self._result(context)
+
+        context.checkpoint = self.checkpoints.reopen(checkpoint)
+        context.memory.start_journal()
+        return await self._execute(context, None)
+
+    async def _execute(self, context: RunContext, request: Optional[str]) -> RunResult:
+        """Executes the steps of a run within its context, until it finishes or is stopped"""
+        token = _active_runs.set({**_active_runs.get(), id(self): context})
+        self._running[context.run_id] = context
+        timeout = context.budget.timeout
+        deadline = asyncio.get_running_loop().call_later(timeout, self.stop, context, StopReason.DEADLINE) if timeout is not None else None
+        try:
+            with TRACER.span("agent.run", SpanKind.RUN, trace_id=context.run_id, agent=self.name) as span:
+                context.metrics = span.metrics
+                # Steps run in their own task: stopping the run cancels its in-flight calls, not the caller
+                context.task = asyncio.ensure_future(self._run_steps(request))
+                try:
+                    await context.task
+                except asyncio.CancelledError:
+                    if context.stop_reason is None or asyncio.current_task().cancelling():
+                        raise
+                    self._abort(context)
+                except LLMTimeoutError as e:
+                    context.stop_reason = StopReason.LLM_TIMEOUT
+                    log_event("agent.stopped", level="WARNING", agent=self.name, run_id=context.run_id, step=context.current_step, reason=context.stop_reason.value,
+                              error=e, message=f"Stopping run '{context.run_id}' of '{self.name}' at step {context.current_step}: {e}")
+                    self._abort(context)
+                if context.stop_reason is not None:
+                    span.set(stop_reason=context.stop_reason.value)
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+            _active_runs.reset(token)
+            self._running.pop(context.run_id, None)
+            context.task = None
+            if context.checkpoint is not None:
+                context.checkpoint.close()
+            self._idle_context = context # keep the last run available for inspection
+
+        return self._result(context)
+
+    def stop(self, context: RunContext, reason: StopReason) -> bool:
+        """Stops a run in progress, cancelling its in-flight LLM and tool calls.
+
+        Args:
+            context: Context of the run
+            reason: Why the run is stopped
+
+        Returns:
+            True if the run was in progress
         """
-        if self.state != AgentState.IDLE:
-            raise ValueError(f"Agent '{self.name}' cannot be started in state {self.state}")
+        if context.task is None or context.task.done() or context.stop_reason is not None:
+            return False
 
-        results: list[str] = []
+        context.stop_reason = reason
+        log_event("agent.stopped", level="WARNING", agent=self.name, run_id=context.run_id, step=context.current_step, reason=reason.value,
+                  message=f"Stopping run '{context.run_id}' of '{self.name}' at step {context.current_step}: {reason.value}")
+        context.task.cancel()
+        return True
 
+    def cancel(self, run_id: Optional[str] = None) -> int:
+        """Cancels a run of the agent, or all of its runs in progress.
+
+        Cancelled runs return their partial result with the CANCELLED stop reason.
+
+        Args:
+            run_id: (Optional) Identifier of the run, every run when None
+
+        Returns:
+            Number of cancelled runs
+        """
+        contexts = list(self._running.values()) if run_id is None else [self._running[run_id]] if run_id in self._running else []
+        return sum(self.stop(context, StopReason.CANCELLED) for context in contexts)
+
+    def _abort(self, context: RunContext) -> None:
+        """Cleans up a stopped run: pending tool executions are cancelled and its state checkpointed"""
+        for task in context.tool_tasks.values():
+            task.cancel()
+        context.tool_tasks.clear()
+        self.save_checkpoint() # tool calls interrupted by the stop are executed again on resume
+
+    def exceeded_budget(self) -> Optional[StopReason]:
+        """Token or cost budget of the current run already spent, if any"""
+        budget, metrics = self.context.budget, self.context.metrics
+        if budget.max_tokens is not None and metrics.total_tokens >= budget.max_tokens:
+            return StopReason.TOKEN_BUDGET
+        if budget.max_cost is not None and metrics.cost >= budget.max_cost:
+            return StopReason.COST_BUDGET
+        return None
+
+    @staticmethod
+    def _result(context: RunContext) -> RunResult:
+        last = context.memory.last
+        answer = last.content if last else None
+        if context.stop_reason is not None and (last is None or last.role != Role.ASSISTANT or last.tool_calls):
+            answer = None # stopped before answering
+        return RunResult(run_id=context.run_id, results=context.results, answer=answer, metrics=context.metrics, stop_reason=context.stop_reason)
+
+    def save_checkpoint(self) -> None:
+        """Appends what changed since the previous checkpoint to the run log, if enabled"""
+        log = self.context.checkpoint
+        if log is None:
+            return
+
+        results = self.context.results[log.saved_results:]
+        ledger = dict(list(self.context.ledger.items())[log.saved_ledger:])
+        history = self.context.call_history[log.saved_history:]
+        log.append({
+            "type": "step",
+            "step": self.current_step,
+            "state": self.state.value,
+            "messages": self.memory.drain_journal(),
+            "results": results,
+            "tool_calls": [tool_call.model_dump() for tool_call in self.context.tool_calls],
+            "ledger": ledger,
+            "call_history": history,
+            "stalled_steps": self.context.stalled_steps,
+            "stop_reason": self.context.stop_reason.value if self.context.stop_reason is not None else None,
+        })
+        log.saved_results += len(results)
+        log.saved_ledger += len(ledger)
+        log.saved_history += len(history)
+
+    async def _run_steps(self, request: str) -> None:
+        """Executes steps until the task is completed or max steps are reached"""
         async with self.state_context(AgentState.RUNNING):
             while self.current_step < self.max_steps and self.state != AgentState.FINISHED:
+                exceeded = self.exceeded_budget()
+                if exceeded is not None:
+                    self.context.stop_reason = exceeded
+                    log_event("agent.stopped", level="WARNING", agent=self.name, run_id=self.context.run_id, step=self.current_step, reason=self.context.stop_reason.value,
+                              message=f"['{self.name}' STATUS: {self.state.value}] Agent '{self.name}' process terminated. Budget exhausted: {self.context.stop_reason.value}")
+                    break
+
                 self.current_step += 1
                 logger.info(f"['{self.name}' STATUS: {self.state.value}] Initiating step {self.current_step}/{self.max_steps} for agent '{self.name}'")
                 if request:
                     self.update_memory("user", request) # Add the user request to the agent memory
                 
-                step_result = await self.step()
+                with TRACER.span("agent.step", SpanKind.STEP, agent=self.name, step=self.current_step):
+                    step_result = await self.step()
                 logger.info(f"['{self.name}' STATUS: {self.state.value}] Appending result from step {self.current_step}")
-                results.append(step_result)
+                self.context.results.append(step_result)
 
                 if step_result == "Reflecting completed: no more needed actions":
-                    logger.info(f"{self.name} completed the task")
-
-                    print("\n#### ANSWER ####\n")
-                    print(self.messages[-1].content)
-                    print("\n#### ------ ####\n")
+                    log_event("agent.answer", agent=self.name, run_id=self.context.run_id, step=self.current_step, answer=self.memory.last.content,
+                              message=f"{self.name} completed the task, answer:\n{self.memory.last.content}")
                     self.state = AgentState.FINISHED
 
+                self.save_checkpoint()
+
                 # Clean initial request
                 request = None
             
-            if self.current_step >= self.max_steps:
+            if self.current_step >= self.max_steps and self.state != AgentState.FINISHED:
+                self.context.stop_reason = StopReason.MAX_STEPS
                 self.state = AgentState.FINISHED
+                self.save_checkpoint()
                 logger.info(f"['{self.name}' STATUS: {self.state.value}] Agent '{self.name}' process terminated. Max steps reached.")
-        
-        return results if results else "No steps executed"
     
     @property
     def messages(self) -> List[Message]:
         """Retrieve a list of Messages from agents memory"""
-        return self.memory.messages
\ No newline at end of file
+        return self.memory.messages
@@ -0,0 +1,71 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+def cyclic_nodes(dependencies: Dict[str, List[str]]) -> Set[str]:
+    """Finds the nodes of a dependency graph that can never run.
+
+    Uses Kahn's algorithm: nodes never reaching zero pending dependencies are in
+    a cycle, or depend on one.
+
+    Args:
+        dependencies: Nodes the key depends on, for every node of the graph
+
+    Returns:
+        The nodes in or behind a dependency cycle
+    """
+    pending = {node: len(deps) for node, deps in dependencies.items()}
+    dependents: Dict[str, List[str]] = {node: [] for node in dependencies}
+    for node, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].append(node)
+
+    ready = [node for node, count in pending.items() if count == 0]
+    while ready:
+        for dependent in dependents[ready.pop()]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+
+    return {node for node, count in pending.items() if count > 0}
+
+async def run_dag(dependencies: Dict[str, List[str]],
+                  run: Callable[[str], Awaitable[Any]],
+                  max_parallel: Optional[int] = None) -> Dict[str, Any]:
+    """Runs every node of an acyclic graph as soon as its dependencies finished.
+
+    Independent nodes run concurrently. Nodes waiting for their dependencies do
+    not count towards `max_parallel`.
+
+    Args:
+        dependencies: Nodes the key depends on, for every node of the graph
+        run: Coroutine function running a node, it must not raise
+        max_parallel: (Optional) Max nodes running at the same time, unbounded when None
+
+    Returns:
+        The result of every node, in the order of `dependencies`
+
+    Raises:
+        ValueError: If the graph has a dependency cycle
+    """
+    cyclic = cyclic_nodes(dependencies)
+    if cyclic:
+        raise ValueError(f"Dependency cycle between {', '.join(sorted(cyclic))}")
+
+    semaphore = asyncio.Semaphore(max_parallel) if max_parallel else None
+    futures: Dict[str, asyncio.Future] = {}
+
+    async def run_node(node: str) -> Any:
+        if dependencies[node]:
+            await asyncio.wait([futures[dep] for dep in dependencies[node]])
+        if semaphore is None:
+            return await run(node)
+        async with semaphore:
+            return await run(node)
+
+    # Dependencies are awaited through their future: every node is scheduled before any runs
+    for node in dependencies:
+        futures[node] = asyncio.ensure_future(run_node(node))
+    results = await asyncio.gather(*futures.values())
+
+    return dict(zip(futures, results))
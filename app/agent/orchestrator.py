@@ -0,0 +1,195 @@
+import re
+
+from typing import Optional, List, Dict, Tuple
+from pydantic import Field, model_validator
+from typing_extensions import Self
+
+from app.logger import logger, log_event
+from app.agent.base import BaseAgent
+from app.agent.toolcall import ToolAgent
+from app.agent.dag import cyclic_nodes, run_dag
+from app.tools.base import Tool
+from app.schema import Memory, ToolCall, StreamEventType
+from app.llm import LLM
+from app.prompts.orchestrator import SYSTEM_INSTRUCTIONS, NEXT_STEP
+
+def compact(text: Optional[str], max_chars: int) -> str:
+    """Shortens a result passed between agents, keeping its beginning"""
+    text = (text or "").strip()
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [truncated {len(text) - max_chars} chars]"
+
+def agent_tool(agent: BaseAgent, summary_max_chars: int = 1500) -> Tool:
+    """Exposes an agent as a tool delegating tasks to it.
+
+    Each call runs the agent on the task in its own run, so one agent can work
+    on several tasks at the same time. Only the final answer, compacted, is
+    returned: the sub-agent transcript never reaches the caller. A run stopped
+    before answering returns why it stopped. The sub-run metrics are added to
+    the calling run (see `Tracer.end_span`), counting against its budget.
+
+    Args:
+        agent: Agent receiving the tasks
+        summary_max_chars: Max size of the returned answer
+
+    Returns:
+        A Tool named after the agent
+    """
+    async def delegate(task: str, task_id: str, depends_on: List[str]) -> str:
+        """Delegates a task to the agent and returns its answer.
+
+        Args:
+            task: Self-contained description of the task
+            task_id: Short unique identifier of the task, used by other tasks to depend on it
+            depends_on: Identifiers of the tasks whose results are needed first, empty when independent
+        """
+        result = await agent.run(task)
+        if not result.answer and result.stop_reason is not None:
+            return f"Error: the '{agent.name}' agent stopped before answering ({result.stop_reason.value})"
+        return compact(result.answer, summary_max_chars)
+
+    name = re.sub(r"[^a-zA-Z0-9_-]", "_", agent.name)
+    description = f"Delegates a task to the '{agent.name}' agent"
+    if agent.description:
+        description = f"{description}: {agent.description}"
+
+    return Tool(delegate, name=name, description=description)
+
+class OrchestratorAgent(ToolAgent):
+    """Agent coordinating sub-agents, exposed to its model as tools.
+
+    The tasks requested in one reflection form a DAG: each task names the tasks
+    it depends on (`depends_on`) and starts as soon as they finish, receiving
+    their compacted results. Independent tasks run concurrently, at most
+    `max_parallel` at a time, so a multi-part request takes about as long as
+    its slowest branch. Sub-agents built with the same LLM settings share the
+    provider connection pool (see app.clients).
+
+    Example:
+        >>> researcher = ToolAgent(name="researcher", description="Searches the web", model=llm, toolbox=[search_duckduckgo])
+        >>> calculator = ToolAgent(name="calculator", description="Does math", model=llm, toolbox=[multiply, divide])
+        >>> mars = OrchestratorAgent(name="MARS", model=llm, agents=[researcher, calculator])
+        >>> result = await mars.run("How tall is the Eiffel tower in feet, divided by 3?")
+    """
+    # Prompts
+    system_instructions: str = SYSTEM_INSTRUCTIONS
+    next_step_instructions: str = NEXT_STEP
+
+    # Artifacts
+    model: LLM = Field(default_factory=LLM)
+    memory_template: Memory = Field(default_factory=Memory, alias="memory")
+
+    # Orchestration specific attributes
+    agents: List[BaseAgent] = Field(default_factory=list, description="Sub-agents available to the orchestrator, added to the toolbox")
+    max_parallel: int = Field(default=4, description="Max sub-agent tasks running at the same time")
+    summary_max_chars: int = Field(default=1500, description="Max size of the results passed between agents")
+
+    @model_validator(mode="after")
+    def register_agents(self) -> Self:
+        """Adds a delegation tool for every sub-agent to the toolbox"""
+        self.toolbox = [agent_tool(agent, self.summary_max_chars) for agent in self.agents] + self.toolbox
+        return self
+
+    @property
+    def agent_tools(self) -> Dict[str, Tool]:
+        """Delegation tools by name"""
+        names = {re.sub(r"[^a-zA-Z0-9_-]", "_", agent.name) for agent in self.agents}
+        return {name: tool for name, tool in self.tools_map.items() if name in names}
+
+    async def stream_reflection(self, input_messages: Memory) -> Tuple[List[ToolCall], Optional[str]]:
+        """Reflects with a streamed completion, tool calls are only scheduled by `act`.
+
+        Tasks cannot start as soon as they arrive: their dependencies are only
+        known once the whole plan is received.
+        """
+        tool_calls: List[ToolCall] = []
+        content = None
+
+        async for event in self.model.stream(input_messages, self.select_tools(), self.tool_choice, self.parallel_tool_calls, self.priority, self.context.budget.llm_timeout):
+            if event.type == StreamEventType.CONTENT and self.stream_handler:
+                self.stream_handler(event.content)
+            elif event.type == StreamEventType.TOOL_CALL:
+                tool_calls.append(event.tool_call)
+            elif event.type == StreamEventType.DONE:
+                content = event.content
+
+        return tool_calls, content
+
+    def plan(self, tool_calls: List[ToolCall]) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+        """Builds the task DAG of the requested calls.
+
+        Returns:
+            The dependencies of every task (by tool call id) on other tasks of
+            the same reflection, and the errors of tasks that cannot run: unknown
+            dependencies or dependency cycles
+        """
+        agent_tools = self.agent_tools
+        task_ids = {}
+        for tool_call in tool_calls:
+            if tool_call.name in agent_tools:
+                task_ids[(tool_call.arguments or {}).get("task_id") or tool_call.id] = tool_call.id
+
+        dependencies: Dict[str, List[str]] = {}
+        errors: Dict[str, str] = {}
+        for tool_call in tool_calls:
+            dependencies[tool_call.id] = []
+            if tool_call.name not in agent_tools:
+                continue
+            for task_id in (tool_call.arguments or {}).get("depends_on") or []:
+                if task_id in task_ids:
+                    dependencies[tool_call.id].append(task_ids[task_id])
+                elif task_id not in self.context.artifacts: # results of previous steps are already available
+                    errors[tool_call.id] = f"Error: unknown dependency '{task_id}'"
+
+        # Tasks in a cycle fail without waiting for anything
+        for call_id in cyclic_nodes(dependencies):
+            errors[call_id] = "Error: the task is part of a dependency cycle"
+            dependencies[call_id] = []
+
+        return dependencies, errors
+
+    async def act(self) -> str:
+        """Executes the requested tasks as a DAG, independent tasks concurrently"""
+        tool_calls = self.tool_calls
+        dependencies, errors = self.plan(tool_calls)
+        agent_tools = self.agent_tools
+        task_ids = {tool_call.id: (tool_call.arguments or {}).get("task_id") or tool_call.id for tool_call in tool_calls}
+
+        calls = {tool_call.id: tool_call for tool_call in tool_calls}
+        async def run_task(call_id: str) -> str:
+            tool_call = calls[call_id]
+            if call_id in errors:
+                return errors[call_id]
+
+            arguments = dict(tool_call.arguments or {})
+            if tool_call.name in agent_tools:
+                inputs = [
+                    f"- {task_id}: {self.context.artifacts.get(task_id, 'no result available')}"
+                    for task_id in arguments.get("depends_on") or []
+                ]
+                if inputs:
+                    arguments["task"] = f"{arguments.get('task', '')}\n\nResults of the tasks this task depends on:\n" + "\n".join(inputs)
+
+            log_event("orchestrator.task", agent=self.name, run_id=self.context.run_id, task_id=task_ids[call_id], tool=tool_call.name,
+                      message=f"{self.name} started task '{task_ids[call_id]}' on '{tool_call.name}'")
+            try:
+                result = await self.execute_tool(ToolCall(id=call_id, name=tool_call.name, arguments=arguments, error=tool_call.error))
+            except Exception as e:
+                logger.error(f"Task '{task_ids[call_id]}' failed: {e}")
+                result = f"Error: task '{task_ids[call_id]}' failed ({e})"
+
+            if tool_call.name in agent_tools:
+                self.context.artifacts[task_ids[call_id]] = result
+            return result
+
+        results = list((await run_dag(dependencies, run_task, self.max_parallel)).values())
+
+        # Updates memory with every task result, matched by its call id
+        for tool_call, result in zip(tool_calls, results):
+            self.update_memory("tool", result, tool_call.id)
+
+        self.check_progress(tool_calls)
+        self.tool_calls = []  # erases previous tool calls
+
+        return "\n".join(results)
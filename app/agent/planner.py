@@ -0,0 +1,202 @@
+import json
+import re
+
+from typing import Any, Dict, List, Optional, Set
+from pydantic import BaseModel, Field
+
+from app.logger import logger, log_event
+from app.agent.dag import cyclic_nodes, run_dag
+from app.agent.toolcall import ToolAgent
+from app.tools.base import Tool, ToolArgumentError
+from app.schema import Memory, ToolCall
+from app.llm import LLM
+from app.prompts.planner import SYSTEM_INSTRUCTIONS, NEXT_STEP
+
+# Reference to the result of a previous step as a whole argument, e.g. "$s1"
+REFERENCE = re.compile(r"\$([A-Za-z0-9_-]+)")
+
+# Reference inside a longer text argument, delimited so amounts such as "$1" stay literal, e.g. "${s1}"
+EMBEDDED_REFERENCE = re.compile(r"\$\{([A-Za-z0-9_-]+)\}")
+
+class PlanStep(BaseModel):
+    """Single tool call of a plan"""
+    id: str = Field(..., description="Short unique identifier of the step, e.g. 's1'")
+    tool: str = Field(..., description="Name of the tool called by the step")
+    arguments: str = Field(..., description="Arguments of the tool as a JSON object. A value '$<step id>', or '${<step id>}' inside a text, is replaced by the result of that step")
+    depends_on: List[str] = Field(..., description="Identifiers of the steps that must finish first, empty when independent")
+
+def plan(steps: List[PlanStep]) -> str:
+    """Runs a plan of tool calls, independent steps at the same time, and returns the result of every step.
+
+    Args:
+        steps: Every tool call needed, in any order
+    """
+    # Plans need the toolbox of the agent running them: PlannerAgent executes them without calling this function
+    return "Error: plans can only be executed by a PlannerAgent, call the tools directly instead"
+
+# Offered to planner agents besides their toolbox
+PLAN_TOOL = Tool(plan, pinned=True)
+
+def resolve_references(value: Any, results: Dict[str, str]) -> Any:
+    """Replaces the references to step results inside tool arguments.
+
+    A value made of a single reference ("$s1") is replaced by the result,
+    delimited references inside a longer text ("${s1}") are substituted in
+    place. Any other "$" is literal text, and unknown references are kept.
+    """
+    if isinstance(value, dict):
+        return {key: resolve_references(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    match = REFERENCE.fullmatch(value.strip())
+    if match and match.group(1) in results:
+        return results[match.group(1)]
+    return EMBEDDED_REFERENCE.sub(lambda m: results.get(m.group(1), m.group(0)), value)
+
+def find_references(value: Any) -> Set[str]:
+    """Step identifiers referenced inside tool arguments"""
+    if isinstance(value, dict):
+        return set().union(*(find_references(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(find_references(item) for item in value))
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value.strip())
+        return set(EMBEDDED_REFERENCE.findall(value)) | ({match.group(1)} if match else set())
+    return set()
+
+class PlannerAgent(ToolAgent):
+    """Plan-and-execute agent, batching tool calls into a single round trip.
+
+    Besides its toolbox, the model is offered a `plan` tool taking every tool
+    call needed at once, with the dependencies between them. The plan runs as
+    a DAG: every step starts as soon as the steps it depends on finished, and
+    receives their results through "$<step id>" references in its arguments
+    ("${<step id>}" inside a text).
+    The model is only called again to re-plan from the results, or to answer,
+    so a search-then-compute request takes two LLM calls instead of one per
+    tool call.
+
+    Example:
+        >>> agent = PlannerAgent(name="MARS", model=llm, toolbox=[search_duckduckgo, multiply, divide])
+        >>> result = await agent.run("What are 2 * 3 and (2 * 3) / 4?")
+    """
+    # Prompts
+    system_instructions: str = SYSTEM_INSTRUCTIONS
+    next_step_instructions: str = NEXT_STEP
+
+    # Artifacts
+    model: LLM = Field(default_factory=LLM)
+    memory_template: Memory = Field(default_factory=Memory, alias="memory")
+
+    # Planning specific attributes
+    max_plan_steps: int = Field(default=16, description="Max steps of a single plan, larger plans are rejected")
+    max_parallel: Optional[int] = Field(default=None, description="Max plan steps running at the same time, unbounded when None (tools keep their own limits)")
+
+    def select_tools(self) -> List[Tool]:
+        """The plan tool, followed by the tools of the toolbox offered for the next step"""
+        return [PLAN_TOOL] + super().select_tools()
+
+    async def execute_tool(self, tool_call: ToolCall) -> str:
+        """Executes a plan, or a single tool call requested directly"""
+        if tool_call.name != PLAN_TOOL.name:
+            return await super().execute_tool(tool_call)
+
+        if tool_call.error:
+            return f"Error: invalid plan: {tool_call.error}"
+        try:
+            steps = PLAN_TOOL.validate(tool_call.arguments)["steps"]
+        except ToolArgumentError as e:
+            return f"Error: {e}"
+
+        return await self.execute_plan(tool_call.id, steps)
+
+    async def execute_plan(self, plan_id: str, steps: List[PlanStep]) -> str:
+        """Executes the steps of a plan, independent steps concurrently.
+
+        Steps with invalid arguments, unknown dependencies, an id already used
+        by an earlier plan or in a dependency cycle are not executed, nor are the
+        steps depending on a failed step. Results of successful steps are kept in
+        the run artifacts, so later plans can reference them by step id.
+
+        Args:
+            plan_id: Tool call id of the plan
+            steps: Steps of the plan
+
+        Returns:
+            The result of every step, in plan order
+        """
+        if len(steps) > self.max_plan_steps:
+            return f"Error: the plan has {len(steps)} steps, at most {self.max_plan_steps} are allowed. Split it and plan the rest once it is done"
+        duplicates = sorted({step.id for step in steps if [other.id for other in steps].count(step.id) > 1})
+        if duplicates:
+            return f"Error: step ids must be unique, repeated: {', '.join(duplicates)}"
+
+        log_event("planner.plan", agent=self.name, run_id=self.context.run_id, call_id=plan_id, steps=[f"{step.id}:{step.tool}" for step in steps],
+                  message=f"{self.name} is executing a plan of {len(steps)} step(s)")
+
+        by_id = {step.id: step for step in steps}
+        arguments: Dict[str, Any] = {}
+        dependencies: Dict[str, List[str]] = {}
+        errors: Dict[str, str] = {}
+        for step in steps:
+            dependencies[step.id] = []
+            if step.id in self.context.artifacts:
+                errors[step.id] = f"Error: step id '{step.id}' is already used by an earlier plan, plan the step again with a new id"
+                continue
+            try:
+                arguments[step.id] = json.loads(step.arguments or "{}")
+            except json.JSONDecodeError as e:
+                errors[step.id] = f"Error: arguments are not valid JSON ({e})"
+                continue
+            if not isinstance(arguments[step.id], dict):
+                errors[step.id] = "Error: arguments must be a JSON object"
+                continue
+
+            # References to other steps are dependencies, even when not listed
+            referenced = {ref for ref in find_references(arguments[step.id]) if ref in by_id}
+            for dep in dict.fromkeys([*step.depends_on, *sorted(referenced)]):
+                if dep in by_id and dep != step.id:
+                    dependencies[step.id].append(dep)
+                elif dep not in self.context.artifacts:
+                    errors[step.id] = f"Error: unknown dependency '{dep}'"
+
+        for step_id in cyclic_nodes(dependencies):
+            errors[step_id] = "Error: the step is part of a dependency cycle"
+            dependencies[step_id] = []
+
+        results: Dict[str, str] = {}
+        failed: Set[str] = set()
+        async def run_step(step_id: str) -> str:
+            step = by_id[step_id]
+            failed_dependencies = [dep for dep in dependencies[step_id] if dep in failed]
+            call_id = f"{plan_id}-{step_id}"
+            if step_id in errors:
+                result = errors[step_id]
+            elif failed_dependencies:
+                result = f"Error: skipped, step '{failed_dependencies[0]}' failed"
+            else:
+                resolved = resolve_references(arguments[step_id], {**self.context.artifacts, **results})
+                try:
+                    result = await super(PlannerAgent, self).execute_tool(ToolCall(id=call_id, name=step.tool, arguments=resolved))
+                except Exception as e:
+                    logger.error(f"Step '{step_id}' of the plan failed: {e}")
+                    result = f"Error: {e}"
+
+            # Failures are tracked explicitly: a successful result may well start with "Error"
+            if step_id in errors or failed_dependencies or call_id in self.context.failed_calls:
+                failed.add(step_id)
+            else:
+                self.context.artifacts[step_id] = result
+            results[step_id] = result
+            return result
+
+        await run_dag(dependencies, run_step, self.max_parallel)
+
+        # A plan made only of calls already answered brings nothing new
+        if all(f"{plan_id}-{step.id}" in self.context.repeated_calls for step in steps):
+            self.context.repeated_calls.add(plan_id)
+
+        return "\n".join(f"[{step.id}] {step.tool}: {results[step.id]}" for step in steps)
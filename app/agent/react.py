@@ -3,9 +3,8 @@ from abc import abstractmethod
 from typing import Optional
 from pydantic import Field
 
-from app.logger import logger
 from app.agent.base import BaseAgent
-from app.schema import AgentState, Memory
+from app.schema import Memory
 from app.llm import LLM
 from app.prompts.default import NEXT_STEP, SYSTEM_INSTRUCTIONS
 
@@ -25,12 +24,10 @@ class ReactAgent(BaseAgent):
 
     # Artifacts
     model: LLM = Field(default_factory=LLM)
-    memory: Memory = Field(default_factory=Memory)
-    state: AgentState = Field(default=AgentState.IDLE)
+    memory_template: Memory = Field(default_factory=Memory, alias="memory")
 
     # Execution specifications
     max_steps: int = Field(default=10, description="Max execution steps allowed for the agent")
-    current_step: int = Field(default=0, description="Current step in execution")
 
     @abstractmethod
     async def reflect(self) -> bool:
@@ -41,10 +38,15 @@ class ReactAgent(BaseAgent):
         """Executes an action after reflecting"""
 
     async def step(self) -> str:
+        # Tool calls restored by `resume` were already requested: act without reflecting again
+        if self.context.tool_calls:
+            return await self.act()
+
         reflection_result = await self.reflect()
         
         # Checks if any action is needed
         if not reflection_result:
            return "Reflecting completed: no more needed actions"
         
+        self.save_checkpoint() # the requested tool calls survive a crash while acting
         return await self.act()
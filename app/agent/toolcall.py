@@ -1,12 +1,18 @@
-from typing import Optional, List
-from pydantic import Field
+import asyncio
+import json
 
-from app.logger import logger
+from typing import Optional, List, Dict, Tuple, Callable, Any, Awaitable
+from pydantic import Field, PrivateAttr
+
+from app.logger import logger, log_event
 from app.agent.react import ReactAgent
-from app.tools.base import Tool
-from app.schema import Memory, AgentState, ToolChoice, ToolCall
-from app.llm import LLM
-from app.prompts.default import SYSTEM_INSTRUCTIONS, NEXT_STEP
+from app.tools.base import Tool, ToolArgumentError
+from app.tools.retrieval import ToolIndex
+from app.cache import make_key
+from app.schema import AgentState, Memory, Priority, Role, StopReason, ToolChoice, ToolCall, StreamEventType
+from app.llm import LLM, LLMTimeoutError
+from app.tracing import TRACER, SpanKind
+from app.prompts.default import SYSTEM_INSTRUCTIONS, NEXT_STEP, LOOP_WARNING
 
 class ToolAgent(ReactAgent):
     """ReAct Agent Wrapper, capable of calling and executing tools"""
@@ -20,67 +26,258 @@ class ToolAgent(ReactAgent):
 
     # Artifacts
     model: LLM = Field(default_factory=LLM)
-    memory: Memory = Field(default_factory=Memory)
-    state: AgentState = Field(default=AgentState.IDLE)
+    memory_template: Memory = Field(default_factory=Memory, alias="memory")
 
     # Execution specifications
     max_steps: int = Field(default=10, description="Max execution steps allowed for the agent")
-    current_step: int = Field(default=0, description="Current step in execution")
 
     # Tool specific attributes
     toolbox: List[Tool] = Field(default_factory=list, description="Collection of tools provided to the agent")
     tool_choice: Optional[ToolChoice] = Field(default=ToolChoice.AUTO, description="Definition of how the agent must handle the tools")
-    tool_call: Optional[ToolCall] = Field(default_factory=ToolCall, description="Tool response call")
+    parallel_tool_calls: bool = Field(default=True, description="Allows the model to request several tool calls in a single response")
+    priority: Priority = Field(default=Priority.INTERACTIVE, description="Scheduling priority of the agent LLM calls, batch runs yield to interactive ones")
+    tool_top_k: Optional[int] = Field(default=None, description="Max tools offered per step, picked by relevance to the conversation. None offers the whole toolbox")
+    pinned_tools: List[str] = Field(default_factory=list, description="Names of tools always offered, besides the tools created with pinned=True")
+    tool_query_messages: int = Field(default=4, description="Recent messages describing the current need when picking tools")
+    reuse_tool_results: bool = Field(default=True, description="Answers repeated calls of a run to reusable tools (same tool, same arguments) with the first result instead of executing them")
+    max_stalled_steps: int = Field(default=2, description="Consecutive steps without progress (only repeated calls, or A->B->A cycles) tolerated before the run stops, a corrective message is added after each one")
+
+    # Streaming specific attributes
+    stream: bool = Field(default=False, description="Streams completions, starting tools as soon as their call is complete")
+    stream_handler: Optional[Callable[[str], Any]] = Field(default=None, description="Receives every text delta while streaming")
+
+    _tools_map: Optional[Tuple[Tuple[Tool, ...], Dict[str, Tool]]] = PrivateAttr(default=None)
+    _tool_index: Optional[Tuple[Tuple[Tool, ...], ToolIndex]] = PrivateAttr(default=None)
+
+    @property
+    def tool_calls(self) -> List[ToolCall]:
+        """Tool calls requested by the model in the last reflection of the current run"""
+        return self.context.tool_calls
+
+    @tool_calls.setter
+    def tool_calls(self, tool_calls: List[ToolCall]) -> None:
+        self.context.tool_calls = tool_calls
 
     async def reflect(self) -> bool:
         """Reflects on current state and define next action"""
-        # Fetch memory messages
-        input_messages = self.messages
+        # Fetch memory, its serialized view is reused for the request
+        input_messages = self.memory
         try:
             logger.info(f"[{self.name}'s status: {self.state.value}] {self.name} is currently reflecting...")
 
-            response = await self.model.invoke_tools(input_messages, self.toolbox, self.tool_choice)
+            if self.stream:
+                tool_calls, content = await self.stream_reflection(input_messages)
+            else:
+                response = await self.model.invoke_tools(input_messages, self.select_tools(), self.tool_choice, self.parallel_tool_calls, self.priority, self.context.budget.llm_timeout)
+                tool_calls = ToolCall.from_response(response.tool_calls) if response and response.tool_calls else []
+                content = response.content if response else None
 
+        except LLMTimeoutError:
+            raise # stops the run with its partial result
         except Exception as e:
             logger.error(f"Error during reflection: {e}")
             raise ValueError(f"Error during reflection: {e}")
         
         logger.info(f"[{self.name}'s status: {self.state.value}] {self.name} finished reflecting successfully!")
 
-        if response and response.tool_calls:
-            self.tool_call.save(response.tool_calls)
-            self.update_memory("assistant", [self.tool_call.to_dict()]) # append model tool call mesage
-            logger.info(f"{self.name} selected tool: {self.tool_call.name}")
-        if response and response.content:
-            content = response.content
-
-        if self.tool_call.name:
+        if tool_calls:
+            self.tool_calls = tool_calls
+            self.update_memory("assistant", [tool_call.to_dict() for tool_call in self.tool_calls]) # append model tool call mesage
+            log_event("agent.tool_calls", agent=self.name, run_id=self.context.run_id, tools=[tool_call.name for tool_call in self.tool_calls],
+                      message=f"{self.name} selected {len(self.tool_calls)} tool call(s)")
             return True
-        
+
         if content:
             self.update_memory("assistant", content)
-            return False
 
-    async def act(self) -> str:
-        """Executes an action after reflecting"""
-        # Define the map of avaiable tools
-        tools_map = {tool.name: tool.func for tool in self.toolbox}
+        return False
+
+    async def stream_reflection(self, input_messages: Memory) -> Tuple[List[ToolCall], Optional[str]]:
+        """Reflects with a streamed completion.
+
+        Text deltas are forwarded to the stream handler and each tool call starts
+        executing as soon as its arguments are complete. If the stream fails, the
+        tool calls already started are cancelled.
+
+        Returns:
+            The requested tool calls and the text answer
+        """
+        tool_calls: List[ToolCall] = []
+        content = None
 
-        selected_tool = tools_map[self.tool_call.name]
         try:
-            logger.info(f"{self.name} is executing the tool '{self.tool_call.name}' now...")
-            result = selected_tool(**self.tool_call.arguments)
-        except Exception as e:
-            logger.info(f"Failed to execute '{self.tool_call.name}'")
-            raise ValueError(f"Failed to execute '{self.tool_call.name}'")
-        
-        logger.info(f"Tool {self.tool_call.name} was executed successfully!. Tool result: {result}")
+            async for event in self.model.stream(input_messages, self.select_tools(), self.tool_choice, self.parallel_tool_calls, self.priority, self.context.budget.llm_timeout):
+                if event.type == StreamEventType.CONTENT and self.stream_handler:
+                    self.stream_handler(event.content)
+                elif event.type == StreamEventType.TOOL_CALL:
+                    tool_calls.append(event.tool_call)
+                    self.context.tool_tasks[event.tool_call.id] = asyncio.ensure_future(self.execute_tool(event.tool_call))
+                elif event.type == StreamEventType.DONE:
+                    content = event.content
+        except BaseException:
+            for task in self.context.tool_tasks.values():
+                if task.done() and not task.cancelled():
+                    task.exception() # already failed, nobody will await it
+                task.cancel()
+            self.context.tool_tasks.clear()
+            raise
+
+        return tool_calls, content
+
+    @property
+    def tools_map(self) -> Dict[str, Tool]:
+        """Tools of the toolbox by name, rebuilt only when the toolbox changes"""
+        key = tuple(self.toolbox) # tools hash by identity
+        if self._tools_map is None or self._tools_map[0] != key:
+            self._tools_map = (key, {tool.name: tool for tool in self.toolbox})
+        return self._tools_map[1]
+
+    def select_tools(self) -> List[Tool]:
+        """Tools offered to the model for the next step.
+
+        With `tool_top_k` set, the toolbox is indexed once and the tools best
+        matching the recent messages (and the tools they called) are offered,
+        along with the pinned tools. Requests list them pinned first, then by
+        name, whatever the selection order.
+        """
+        if self.tool_top_k is None or len(self.toolbox) <= self.tool_top_k:
+            return self.toolbox
+
+        key = tuple(self.toolbox) # tools hash by identity
+        if self._tool_index is None or self._tool_index[0] != key:
+            self._tool_index = (key, ToolIndex(self.toolbox))
+
+        query = []
+        for message in self.memory.get_recent_messages(self.tool_query_messages):
+            if message.role == Role.SYSTEM:
+                continue
+            if message.tool_calls:
+                query += [tool_call["function"]["name"] for tool_call in message.tool_calls]
+            elif message.content:
+                query.append(message.content)
+
+        selected = self._tool_index[1].select(" ".join(query), self.tool_top_k, self.pinned_tools)
+        log_event("agent.tools_selected", level="DEBUG", agent=self.name, run_id=self.context.run_id, tools=[tool.name for tool in selected])
+        return selected
+
+    async def execute_tool(self, tool_call: ToolCall) -> str:
+        """Executes a single tool call and returns its result as text.
+
+        Calls to unknown tools or with invalid arguments are not executed: the
+        error is returned as the result, so the model can correct the call. So is
+        a call taking longer than the tool timeout of the run, which is cancelled.
+        A call to a reusable tool already made in the run is answered from the
+        run ledger, other tools (e.g. asking the user) are always executed.
+        """
+        selected_tool = self.tools_map.get(tool_call.name)
+        if selected_tool is None:
+            log_event("tool.rejected", level="WARNING", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id,
+                      message=f"{self.name} called the unknown tool '{tool_call.name}'")
+            self.context.failed_calls.add(tool_call.id)
+            return f"Error: tool '{tool_call.name}' is not available. Available tools: {', '.join(self.tools_map)}"
+        if tool_call.error:
+            log_event("tool.rejected", level="WARNING", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id, error=tool_call.error,
+                      message=f"Rejected call to '{tool_call.name}': {tool_call.error}")
+            self.context.failed_calls.add(tool_call.id)
+            return f"Error: invalid call to tool '{tool_call.name}': {tool_call.error}"
+
+        key = make_key(tool_call.name, tool_call.arguments)
+        reusable = self.reuse_tool_results and selected_tool.reusable
+        if reusable and key in self.context.ledger:
+            self.context.repeated_calls.add(tool_call.id)
+            log_event("tool.repeated", level="WARNING", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id, arguments=tool_call.arguments,
+                      message=f"{self.name} repeated a call to '{tool_call.name}', answered from the run ledger")
+            return f"{self.context.ledger[key]}\n(Repeated call: same result as the identical call made earlier in this run)"
+
+        with TRACER.span(f"tool.{tool_call.name}", SpanKind.TOOL, tool=tool_call.name, request_bytes=len(json.dumps(tool_call.arguments))) as span:
+            try:
+                log_event("tool.call", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id, arguments=tool_call.arguments,
+                          message=f"{self.name} is executing the tool '{tool_call.name}' now...")
+                async with asyncio.timeout(self.context.budget.tool_timeout):
+                    result = await selected_tool.invoke(**(tool_call.arguments or {}))
+            except TimeoutError:
+                log_event("tool.timeout", level="WARNING", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id,
+                          timeout=self.context.budget.tool_timeout, message=f"Tool '{tool_call.name}' timed out")
+                span.set(timed_out=True)
+                self.context.failed_calls.add(tool_call.id)
+                return f"Error: tool '{tool_call.name}' did not answer within {self.context.budget.tool_timeout}s"
+            except ToolArgumentError as e:
+                log_event("tool.rejected", level="WARNING", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id, error=e,
+                          message=f"Rejected call to '{tool_call.name}': invalid arguments")
+                span.set(rejected=True)
+                self.context.failed_calls.add(tool_call.id)
+                return f"Error: {e}"
+            except Exception as e:
+                log_event("tool.error", level="ERROR", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id, error=e,
+                          message=f"Failed to execute '{tool_call.name}'")
+                self.context.failed_calls.add(tool_call.id)
+                raise ValueError(f"Failed to execute '{tool_call.name}'")
+            
+            result = str(result)
+            span.set(response_bytes=len(result.encode("utf-8")))
+            log_event("tool.result", agent=self.name, run_id=self.context.run_id, tool=tool_call.name, call_id=tool_call.id, result=result,
+                      duration=span.duration, message=f"Tool {tool_call.name} was executed successfully!")
+
+        if reusable:
+            self.context.ledger[key] = result
+        return result
+
+    async def act(self) -> str:
+        """Executes every tool call requested after reflecting, concurrently.
+
+        A failing call does not interrupt the others: its error becomes its
+        result, so every call of the assistant message gets its tool response.
+        """
+        async def answer(tool_call: ToolCall, execution: Awaitable[str]) -> str:
+            try:
+                return await execution
+            except Exception as e:
+                logger.error(f"Tool call '{tool_call.id}' to '{tool_call.name}' failed: {e}")
+                self.context.failed_calls.add(tool_call.id)
+                return f"Error: {e}"
+
+        # Tool calls already started while streaming are awaited instead of executed again
+        tasks = [answer(tool_call, self.context.tool_tasks.pop(tool_call.id, None) or self.execute_tool(tool_call)) for tool_call in self.tool_calls]
+        results = await asyncio.gather(*tasks) # cancelling the step cancels every call
+
+        # Updates memory with every tool result, matched by its call id, and call llm again
+        for tool_call, result in zip(self.tool_calls, results):
+            self.update_memory("tool", result, tool_call.id)
+
+        self.check_progress(self.tool_calls)
+        self.tool_calls = []  # erases previous tool calls
+
+        return "\n".join(results)
+
+    def check_progress(self, tool_calls: List[ToolCall]) -> None:
+        """Spots runs going in circles after an acting step.
+
+        A step makes no progress when all its calls were already made in the run,
+        or when it repeats the calls of the step before the previous one (A->B->A).
+        Each such step adds a corrective message to memory; after more than
+        `max_stalled_steps` in a row the run stops with the LOOP stop reason.
+        """
+        if not tool_calls:
+            return
 
-        # Updates memory and call llm again with tool result
-        self.update_memory("tool", str(result), self.tool_call.id)
+        history = self.context.call_history
+        history.append(tuple(sorted(make_key(tool_call.name, tool_call.arguments) for tool_call in tool_calls)))
+        repeated = all(tool_call.id in self.context.repeated_calls for tool_call in tool_calls)
+        cycle = len(history) >= 3 and history[-1] == history[-3] and history[-1] != history[-2]
 
-        self.tool_call.clear()  # erases previous tool call
+        if not (repeated or cycle):
+            self.context.stalled_steps = 0
+            return
 
-        return str(result)
+        self.context.stalled_steps += 1
+        calls = ", ".join(f"{tool_call.name}({json.dumps(tool_call.arguments, sort_keys=True)})" for tool_call in tool_calls)
+        if self.context.stalled_steps > self.max_stalled_steps:
+            log_event("agent.stopped", level="WARNING", agent=self.name, run_id=self.context.run_id, step=self.current_step, reason=StopReason.LOOP.value,
+                      message=f"['{self.name}' STATUS: {self.state.value}] Agent '{self.name}' process terminated. No progress in {self.context.stalled_steps} steps")
+            self.context.stop_reason = StopReason.LOOP
+            self.state = AgentState.FINISHED
+            return
 
-        
\ No newline at end of file
+        log_event("agent.loop", level="WARNING", agent=self.name, run_id=self.context.run_id, step=self.current_step, cycle=cycle, calls=calls,
+                  message=f"{self.name} made no progress in step {self.current_step}, adding a corrective message")
+        self.update_memory("user", LOOP_WARNING.format(calls=calls))
@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+# internal packages
+from app.config import PROJECT_ROOT
+from app.logger import logger
+
+def make_key(*parts: Any) -> str:
+    """Builds a content address for the given parts.
+
+    Parts are serialized as canonical JSON (sorted keys, no whitespace) so equal
+    inputs always produce the same key.
+
+    Args:
+        parts: Any JSON serializable values
+
+    Returns:
+        SHA-256 hex digest of the canonical serialization
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class CacheStats(BaseModel):
+    """Counters describing how effective a cache is"""
+    hits: int = Field(default=0, description="Lookups answered from the cache, including joined in-flight requests")
+    misses: int = Field(default=0, description="Lookups that had to compute the value")
+    evictions: int = Field(default=0, description="Entries removed because of TTL or size limits")
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class LRUCache:
+    """In-memory cache tier with least recently used eviction and optional TTL"""
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Returns a (found, value) pair, refreshing the entry recency"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        created_at, value = entry
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            del self._entries[key]
+            self.evictions += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any, created_at: Optional[float] = None) -> None:
+        """Stores a value, evicting the least recently used entries beyond the limit"""
+        self._entries[key] = (created_at or time.time(), value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Delete every entry"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteCache:
+    """On-disk cache tier backed by SQLite, values are stored as JSON.
+
+    Reads do not write: access times are buffered and written in a single
+    transaction by the next `set`, or once `flush_every` are pending. The
+    connection is shared by threads, calls are serialized by a lock.
+    """
+    def __init__(self, path: Optional[Path] = None, max_entries: int = 100_000, ttl: Optional[float] = None, flush_every: int = 256):
+        self.path = Path(path or PROJECT_ROOT / "cache" / "cache.sqlite")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_every = flush_every
+
+        self.evictions = 0
+        self._accessed: Dict[str, float] = {} # access times not written yet
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._connection.commit()
+
+    def get(self, key: str) -> Tuple[bool, Any, Optional[float]]:
+        """Returns a (found, value, created_at) triple, recording the entry access time.
+
+        Expired entries are reported as missing and deleted by the next `set`.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None, None
+
+            value, created_at = row
+            now = time.time()
+            if self.ttl is not None and now - created_at > self.ttl:
+                return False, None, None
+
+            self._accessed[key] = now
+            if len(self._accessed) >= self.flush_every:
+                self._write_access_times()
+                self._connection.commit()
+        return True, json.loads(value), created_at
+
+    def set(self, key: str, value: Any) -> None:
+        """Stores a value, evicting the least recently accessed entries beyond the limit"""
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._write_access_times()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now),
+            )
+            if self.ttl is not None:
+                self.evictions += self._connection.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+            self.evictions += self._connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._connection.commit()
+
+    def flush(self) -> None:
+        """Writes the buffered access times"""
+        with self._lock:
+            self._write_access_times()
+            self._connection.commit()
+
+    def _write_access_times(self) -> None:
+        """Adds the buffered access times to the current transaction, the lock must be held"""
+        if self._accessed:
+            self._connection.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?", [(at, key) for key, at in self._accessed.items()])
+            self._accessed.clear()
+
+    def clear(self) -> None:
+        """Delete every entry"""
+        with self._lock:
+            self._accessed.clear()
+            self._connection.execute("DELETE FROM cache")
+            self._connection.commit()
+
+    def close(self) -> None:
+        """Writes the buffered access times and closes the database connection"""
+        self.flush()
+        self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+class ResponseCache:
+    """Two tier cache with in-flight deduplication.
+
+    Lookups go to the in-memory LRU tier first and then to the optional SQLite
+    tier. Concurrent requests for the same missing key share a single computation
+    (single-flight), so identical calls only reach the upstream service once.
+    Inside `get_or_compute` the SQLite tier is only accessed from worker
+    threads, never blocking the event loop. The SQLite file is only opened by
+    the first lookup, so creating a cache (e.g. when a module defining cached
+    tools is imported) touches no file.
+
+    Example:
+        >>> cache = ResponseCache(max_entries=256, ttl=3600, persistent=True)
+        >>> llm = LLM(llm_config, cache=cache)
+    """
+    def __init__(self,
+                 max_entries: int = 1024,
+                 ttl: Optional[float] = None,
+                 persistent: bool = False,
+                 path: Optional[Path] = None,
+                 max_disk_entries: int = 100_000,
+                 allow_nondeterministic: bool = False):
+        """
+        Args:
+            max_entries: Max number of entries kept in memory
+            ttl: (Optional) Seconds an entry stays valid
+            persistent: Adds the on-disk SQLite tier
+            path: (Optional) SQLite file location
+            max_disk_entries: Max number of entries kept on disk
+            allow_nondeterministic: Caches calls even when sampling is random (temperature > 0)
+        """
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.persistent = persistent
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._disk: Optional[SQLiteCache] = None
+        self._disk_lock = threading.Lock()
+        self.allow_nondeterministic = allow_nondeterministic
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def disk(self) -> Optional[SQLiteCache]:
+        """SQLite tier, opened on first use, None when the cache is not persistent"""
+        if self.persistent and self._disk is None:
+            with self._disk_lock:
+                if self._disk is None:
+                    self._disk = SQLiteCache(path=self.path, max_entries=self.max_disk_entries, ttl=self.ttl)
+        return self._disk
+
+    @property
+    def stats(self) -> CacheStats:
+        """Hits, misses and evictions across every tier"""
+        evictions = self.memory.evictions + (self._disk.evictions if self._disk is not None else 0)
+        return CacheStats(hits=self._hits, misses=self._misses, evictions=evictions)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Returns a (found, value) pair looking through every tier"""
+        found, value = self.memory.get(key)
+        if found:
+            return True, value
+
+        if self.disk is not None:
+            found, value, created_at = self.disk.get(key)
+            if found:
+                self.memory.set(key, value, created_at) # promote to the memory tier
+                return True, value
+
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        """Stores a value in every tier"""
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached value or computes it once for all concurrent callers.
+
+        Args:
+            key: Content address of the request
+            compute: Coroutine function producing a JSON serializable value on a miss
+
+        Returns:
+            The cached or freshly computed value
+        """
+        found, value = self.memory.get(key)
+        if found:
+            self._hits += 1
+            logger.debug("Cache hit for key {}", key[:12])
+            return value
+
+        # Joins the computation in flight, computing again if its leader was cancelled
+        while (in_flight := self._in_flight.get(key)) is not None:
+            logger.debug("Joining in-flight request for key {}", key[:12])
+            try:
+                value = await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                logger.debug("In-flight request for key {} was cancelled, computing it again", key[:12])
+                continue
+            self._hits += 1
+            return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if self.persistent:
+                found, value, created_at = await asyncio.to_thread(lambda: self.disk.get(key)) # opened off the loop
+                if found:
+                    self._hits += 1
+                    self.memory.set(key, value, created_at) # promote to the memory tier
+                    future.set_result(value)
+                    return value
+
+            self._misses += 1
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # mark as retrieved when nobody else is waiting
+            raise
+        finally:
+            del self._in_flight[key]
+
+        self.memory.set(key, value)
+        future.set_result(value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+        return value
+
+    def clear(self) -> None:
+        """Delete every entry from every tier"""
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
@@ -0,0 +1,207 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# internal packages
+from app.cache import make_key
+from app.logger import logger
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request was not recorded"""
+
+class ReplayedToolError(RuntimeError):
+    """Error recorded from a failed tool call, raised again on replay"""
+
+class Cassette:
+    """Recording of the LLM and tool calls of agent sessions.
+
+    In record mode every completion (including streamed chunks) and tool result
+    is written, with its duration, as one compact JSON line keyed by the hash of
+    the request. In replay mode the recorded answers are served back without any
+    network access; identical requests are answered in recorded order, the last
+    answer being repeated once they are exhausted. Paths ending with `.gz` are
+    gzip compressed.
+
+    Example:
+        >>> with use_cassette("cassettes/session.jsonl", mode="record"):
+        ...     await agent.run("What is 2 * 3?")
+        >>> with use_cassette("cassettes/session.jsonl", mode="replay", keep_timings=True):
+        ...     await agent.run("What is 2 * 3?")   # no provider or tool is called
+    """
+    def __init__(self, path: Path, mode: str = "replay", keep_timings: bool = False):
+        """
+        Args:
+            path: Cassette file, overwritten in record mode
+            mode: "record" or "replay"
+            keep_timings: Replays answers after their recorded duration instead of immediately
+
+        Raises:
+            ValueError: If the mode is not supported
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode '{mode}' not supported. Supported are 'record' and 'replay'.")
+
+        self.path = Path(path)
+        self.mode = mode
+        self.keep_timings = keep_timings
+        self._entries: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+        if self.recording:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self._open("wt")
+        else:
+            with self._open("rt") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault((entry["kind"], entry["key"]), deque()).append(entry)
+            logger.info(f"Loaded {sum(len(entries) for entries in self._entries.values())} recorded calls from {self.path}")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _open(self, mode: str):
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return self.path.open(mode, encoding="utf-8")
+
+    def _write(self, kind: str, key: str, elapsed: float, **payload: Any) -> None:
+        line = json.dumps({"kind": kind, "key": key, "elapsed": round(elapsed, 6), **payload},
+                          ensure_ascii=False, default=str, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            if self.path.suffix != ".gz": # flushing every line would defeat the compression
+                self._file.flush()
+
+    def _next(self, kind: str, key: str) -> Dict[str, Any]:
+        """Recorded answer of a request, raises CassetteMiss when there is none"""
+        entries = self._entries.get((kind, key))
+        if not entries:
+            raise CassetteMiss(f"No recorded {kind} call with key {key[:12]} in {self.path}")
+        return entries.popleft() if len(entries) > 1 else entries[0]
+
+    async def _wait(self, seconds: float) -> None:
+        if self.keep_timings and seconds > 0:
+            await asyncio.sleep(seconds)
+
+    async def record_llm(self, request: Dict[str, Any], call: Callable[[], Awaitable[Any]]) -> Any:
+        """Sends a completion request and records its response, streams are recorded once consumed"""
+        key = make_key(request)
+        started_at = time.perf_counter()
+        response = await call()
+
+        if request.get("stream"):
+            return self._recording_stream(key, response, started_at)
+
+        self._write("llm", key, time.perf_counter() - started_at, response=response.model_dump(mode="json", exclude_none=True))
+        return response
+
+    async def _recording_stream(self, key: str, response: AsyncIterator[Any], started_at: float) -> AsyncIterator[Any]:
+        chunks: List[Tuple[float, Dict[str, Any]]] = []
+        async for chunk in response:
+            chunks.append((round(time.perf_counter() - started_at, 6), chunk.model_dump(mode="json", exclude_none=True)))
+            yield chunk
+
+        self._write("llm", key, time.perf_counter() - started_at, chunks=chunks)
+
+    async def replay_llm(self, request: Dict[str, Any]) -> Any:
+        """Recorded response (or stream) of a completion request"""
+        entry = self._next("llm", make_key(request))
+        if "chunks" in entry:
+            return self._replayed_stream(entry["chunks"])
+
+        await self._wait(entry["elapsed"])
+        return ChatCompletion.construct(**entry["response"])
+
+    async def _replayed_stream(self, chunks: List[Tuple[float, Dict[str, Any]]]) -> AsyncIterator[ChatCompletionChunk]:
+        previous = 0.0
+        for offset, chunk in chunks:
+            await self._wait(offset - previous)
+            previous = offset
+            yield self._restore_chunk(chunk)
+
+    @staticmethod
+    def _restore_chunk(chunk: Dict[str, Any]) -> ChatCompletionChunk:
+        """Rebuilds a recorded chunk, including the usage Groq reports in `x_groq`"""
+        restored = ChatCompletionChunk.construct(**chunk)
+        x_groq = chunk.get("x_groq")
+        if isinstance(x_groq, dict) and x_groq.get("usage"):
+            restored.x_groq = SimpleNamespace(**{**x_groq, "usage": CompletionUsage.construct(**x_groq["usage"])})
+        return restored
+
+    async def tool_call(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Records or replays a tool call, failed calls are recorded and fail again on replay.
+
+        Args:
+            key: Content address of the call
+            call: Coroutine function executing the tool
+
+        Returns:
+            The tool result
+        """
+        if self.replaying:
+            entry = self._next("tool", key)
+            await self._wait(entry["elapsed"])
+            if "error" in entry:
+                raise ReplayedToolError(entry["error"])
+            return entry["result"]
+
+        started_at = time.perf_counter()
+        try:
+            result = await call()
+        except Exception as e:
+            self._write("tool", key, time.perf_counter() - started_at, error=f"{type(e).__name__}: {e}")
+            raise
+
+        self._write("tool", key, time.perf_counter() - started_at, result=result)
+        return result
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Cassette used by the LLM and tool calls of the current task
+_active_cassette: ContextVar[Optional[Cassette]] = ContextVar("active_cassette", default=None)
+
+def active_cassette() -> Optional[Cassette]:
+    """Returns the cassette recording or replaying the current task, if any"""
+    return _active_cassette.get()
+
+@contextmanager
+def use_cassette(path: Path, mode: str = "replay", keep_timings: bool = False) -> Iterator[Cassette]:
+    """Records or replays every LLM and tool call made inside the block.
+
+    Tasks started inside the block inherit the cassette, so concurrent tool
+    calls and sub-agents are recorded too.
+
+    Args:
+        path: Cassette file
+        mode: "record" or "replay"
+        keep_timings: Replays answers after their recorded duration
+    """
+    cassette = Cassette(path, mode, keep_timings)
+    token = _active_cassette.set(cassette)
+    try:
+        yield cassette
+    finally:
+        _active_cassette.reset(token)
+        cassette.close()
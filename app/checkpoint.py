@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+# internal packages
+from app.config import PROJECT_ROOT
+from app.logger import logger
+from app.schema import AgentState, StopReason
+
+class RunCheckpoint(BaseModel):
+    """State of a run rebuilt from its checkpoint log"""
+    run_id: str = Field(..., description="Unique identifier of the run")
+    agent: Optional[str] = Field(None, description="Name of the agent executing the run")
+    request: Optional[str] = Field(None, description="Request the run was started with")
+    current_step: int = Field(default=0, description="Last checkpointed step")
+    state: AgentState = Field(default=AgentState.IDLE, description="Run state at the last checkpoint")
+    messages: List[dict] = Field(default_factory=list, description="Serialized messages added to memory, in order")
+    results: List[str] = Field(default_factory=list, description="Result of every checkpointed step")
+    tool_calls: List[dict] = Field(default_factory=list, description="Tool calls requested but not executed yet")
+    ledger: Dict[str, str] = Field(default_factory=dict, description="Results of the reusable tool calls made, by canonical call")
+    call_history: List[List[str]] = Field(default_factory=list, description="Canonical tool calls of every acting step, to spot loops")
+    stalled_steps: int = Field(default=0, description="Consecutive acting steps without progress")
+    stop_reason: Optional[StopReason] = Field(default=None, description="Why the run stopped before answering, at the last checkpoint")
+
+    @property
+    def finished(self) -> bool:
+        return self.state == AgentState.FINISHED
+
+class CheckpointLog:
+    """Append-only checkpoint log of a single run.
+
+    One JSON record per line: a `run` header, then one `step` record per
+    checkpoint holding only what changed since the previous one. A record torn
+    by a crash is the last line and is ignored when loading.
+    """
+    def __init__(self, path: Path, fsync: bool = False):
+        """
+        Args:
+            path: Log file, appended to
+            fsync: Forces every record to disk, surviving power losses at the cost of latency
+        """
+        self.path = Path(path)
+        self.fsync = fsync
+        self.saved_results = 0 # step results already in the log
+        self.saved_ledger = 0 # ledger entries already in the log
+        self.saved_history = 0 # acting steps of the call history already in the log
+        self._file = self.path.open("a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+class CheckpointStore:
+    """Directory of run checkpoint logs, one file per run.
+
+    Agents with a store write a checkpoint after every reflection and step, so
+    a run interrupted by a crash or a deploy continues with `agent.resume(run_id)`
+    without repeating the LLM and tool calls already done.
+
+    Example:
+        >>> agent = ToolAgent(name="MARS", model=llm, toolbox=tools, checkpoints=CheckpointStore())
+        >>> result = await agent.run("What is 2 * 3?")
+        >>> result = await agent.resume(run_id)   # after a restart
+    """
+    def __init__(self, directory: Optional[Path] = None, fsync: bool = False):
+        """
+        Args:
+            directory: (Optional) Folder of the logs, defaults to PROJECT_ROOT/checkpoints
+            fsync: Forces every record to disk
+        """
+        self.directory = Path(directory) if directory else PROJECT_ROOT / "checkpoints"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+
+    def path(self, run_id: str) -> Path:
+        return self.directory / f"{run_id}.jsonl"
+
+    def exists(self, run_id: str) -> bool:
+        return self.path(run_id).exists()
+
+    def create(self, run_id: str, agent: str, request: Optional[str]) -> CheckpointLog:
+        """Starts the log of a new run"""
+        log = CheckpointLog(self.path(run_id), self.fsync)
+        log.append({"type": "run", "run_id": run_id, "agent": agent, "request": request})
+        return log
+
+    def reopen(self, checkpoint: RunCheckpoint) -> CheckpointLog:
+        """Continues the log of a resumed run"""
+        log = CheckpointLog(self.path(checkpoint.run_id), self.fsync)
+        log.saved_results = len(checkpoint.results)
+        log.saved_ledger = len(checkpoint.ledger)
+        log.saved_history = len(checkpoint.call_history)
+        return log
+
+    def load(self, run_id: str) -> RunCheckpoint:
+        """Rebuilds the state of a run by folding its log, in a single pass.
+
+        Raises:
+            ValueError: If there is no log for the run
+        """
+        path = self.path(run_id)
+        if not path.exists():
+            raise ValueError(f"No checkpoint found for run '{run_id}' in {self.directory}")
+
+        checkpoint = RunCheckpoint(run_id=run_id)
+        with path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring a torn checkpoint record of run '{run_id}'")
+                    break
+
+                if record["type"] == "run":
+                    checkpoint.agent = record.get("agent")
+                    checkpoint.request = record.get("request")
+                elif record["type"] == "step":
+                    checkpoint.current_step = record["step"]
+                    checkpoint.state = AgentState(record["state"])
+                    checkpoint.messages.extend(record["messages"])
+                    checkpoint.results.extend(record["results"])
+                    checkpoint.tool_calls = record["tool_calls"]
+                    checkpoint.ledger.update(record.get("ledger", {}))
+                    checkpoint.call_history.extend(record.get("call_history", []))
+                    checkpoint.stalled_steps = record.get("stalled_steps", 0)
+                    checkpoint.stop_reason = StopReason(record["stop_reason"]) if record.get("stop_reason") else None
+
+        return checkpoint
+
+    def delete(self, run_id: str) -> None:
+        self.path(run_id).unlink(missing_ok=True)
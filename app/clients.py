@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import importlib.util
+from typing import Dict, Tuple, Union
+
+import httpx
+from groq import AsyncGroq
+from openai import AsyncAzureOpenAI
+
+# internal packages
+from app.logger import logger
+from app.schema import LLMSettings
+
+ProviderClient = Union[AsyncGroq, AsyncAzureOpenAI]
+
+class ClientRegistry:
+    """Process-wide registry of provider clients.
+
+    LLM instances sharing provider, endpoint, credentials and pool settings share
+    one client, and therefore one HTTP connection pool, so TLS handshakes and
+    keep-alive connections are reused across agents and sockets stay bounded.
+    Connection pools are bound to the event loop that first uses them: call
+    `aclose()` before the loop ends.
+
+    Example:
+        >>> llm = LLM(llm_config)             # clients are taken from CLIENTS
+        >>> await CLIENTS.warmup()            # optional, opens connections at startup
+        >>> await CLIENTS.aclose()            # on shutdown
+    """
+    def __init__(self):
+        self._clients: Dict[Tuple, ProviderClient] = {}
+
+    @staticmethod
+    def client_key(llm_config: LLMSettings) -> Tuple:
+        """Identifies the client needed by the settings, credentials are hashed"""
+        credentials = hashlib.sha256(llm_config.api_key.encode("utf-8")).hexdigest()
+        return (
+            llm_config.provider.lower(),
+            llm_config.base_url,
+            llm_config.api_version,
+            credentials,
+            llm_config.max_connections,
+            llm_config.max_keepalive_connections,
+            llm_config.keepalive_expiry,
+            llm_config.http2,
+        )
+
+    def get_client(self, llm_config: LLMSettings) -> ProviderClient:
+        """Returns the shared client for the settings, creating it on first use.
+
+        Raises:
+            ValueError: If the provider is not supported
+        """
+        key = self.client_key(llm_config)
+        if key not in self._clients:
+            self._clients[key] = self._create_client(llm_config)
+
+        return self._clients[key]
+
+    def _create_client(self, llm_config: LLMSettings) -> ProviderClient:
+        """Creates a provider client with a tuned HTTP connection pool"""
+        http2 = llm_config.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=llm_config.max_connections,
+                max_keepalive_connections=llm_config.max_keepalive_connections,
+                keepalive_expiry=llm_config.keepalive_expiry,
+            ),
+        )
+
+        provider = llm_config.provider.lower()
+        if provider == "groq":
+            return AsyncGroq(
+                api_key=llm_config.api_key,
+                base_url=llm_config.base_url,
+                http_client=http_client,
+            )
+        elif provider == "azure":
+            return AsyncAzureOpenAI(
+                azure_endpoint=llm_config.base_url,
+                api_key=llm_config.api_key,
+                api_version=llm_config.api_version,
+                http_client=http_client,
+            )
+
+        raise ValueError(f"Provider '{llm_config.provider}' not supported. Supported are 'groq' and 'azure'.")
+
+    async def warmup(self) -> None:
+        """Opens a connection for every registered client with a lightweight call.
+
+        Failures are logged and ignored: warm-up only moves the handshake cost out
+        of the first completion.
+        """
+        async def warm(client: ProviderClient) -> None:
+            try:
+                await client.models.list()
+            except Exception as e:
+                logger.warning(f"Client warm-up failed for {client.base_url}: {e}")
+
+        await asyncio.gather(*(warm(client) for client in self._clients.values()))
+
+    async def aclose(self) -> None:
+        """Closes every client and its connection pool"""
+        clients, self._clients = list(self._clients.values()), {}
+        await asyncio.gather(*(client.close() for client in clients))
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+# Process-wide registry used by every LLM
+CLIENTS = ClientRegistry()
@@ -1,17 +1,35 @@
-from typing import List
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, AsyncIterator, Dict, Any, Set, Tuple, Union
 
-from app.schema import LLMSettings, Message, ToolChoice
+from app.cache import ResponseCache, make_key
+from app.cassette import active_cassette
+from app.clients import CLIENTS
+from app.scheduler import get_scheduler
+from app.schema import LLMSettings, Memory, Message, Priority, RequestSize, ToolChoice, ToolCall, StreamEvent, StreamEventType
 from app.tools.base import Tool
+from app.tokens import estimate_messages_tokens, estimate_tokens
+from app.tracing import TRACER, SpanKind
 
-from app.logger import logger
+from app.logger import log_event
 
-# Groq API,
-from groq import AsyncGroq
-from openai import AsyncAzureOpenAI
+from openai.types.chat import ChatCompletionMessage
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when a completion takes longer than its timeout"""
 
 class LLM:
     """Wrapper class for LLM calls"""
-    def __init__(self, llm_config: LLMSettings):
+    def __init__(self, llm_config: LLMSettings, cache: Optional[ResponseCache] = None):
+        """
+        Args:
+            llm_config: Client and completion settings
+            cache: (Optional) Response cache shared by identical requests
+        """
+        self.cache = cache
+        self.provider = llm_config.provider.lower()
         self.model_name = llm_config.model_name
         self.api_key = llm_config.api_key
         self.base_url = llm_config.base_url
@@ -19,29 +37,139 @@ class LLM:
         self.max_completion_tokens = llm_config.max_completion_tokens
         self.top_p = llm_config.top_p
 
-        # check for the API key provided to 
-        provider = llm_config.provider.lower()
-
-        if provider == "groq":
-            # Initialize model with groq
-            self.client = AsyncGroq(
-                api_key=self.api_key,
-                base_url=self.base_url,
-                )
-        elif provider == "azure":
-            self.client = AsyncAzureOpenAI(
-                azure_endpoint=self.base_url,
-                api_key=self.api_key,
-                api_version=llm_config.api_version
-            )
-    
-    def format_messages(self, messages: List[Message]) -> List[dict]:
+        # Prices of a million tokens
+        self.prompt_token_cost = llm_config.prompt_token_cost
+        self.cached_token_cost = llm_config.cached_token_cost if llm_config.cached_token_cost is not None else llm_config.prompt_token_cost
+        self.completion_token_cost = llm_config.completion_token_cost
+
+        # Clients (and their connection pools) are shared by every LLM with the same provider settings
+        self.client = CLIENTS.get_client(llm_config)
+
+        # Calls to the same provider model share one rate limit scheduler
+        self.scheduler = get_scheduler(llm_config)
+
+        # Tool schemas sent with the requests, their serialized size and estimated tokens, by toolbox
+        self._tools_payloads: Dict[Tuple[Tool, ...], Tuple[List[Dict[str, Any]], int, int]] = {}
+
+    def tools_payload(self, tools: List[Tool]) -> List[Dict[str, Any]]:
+        """Tool schemas of a toolbox, built once per toolbox and reused by every request.
+
+        Pinned tools come first, then the others by name: the same tools always
+        produce the same bytes, and subsets selected for different steps share
+        the pinned tools prefix.
+        """
+        return self._tools_entry(tools)[0]
+
+    def _tools_entry(self, tools: List[Tool]) -> Tuple[List[Dict[str, Any]], int, int]:
+        """Tool schemas of a toolbox, their serialized size and estimated tokens, computed once per toolbox"""
+        key = tuple(tools) # tools hash by identity
+        entry = self._tools_payloads.get(key)
+        if entry is None:
+            if len(self._tools_payloads) >= 256: # selected subsets of large toolboxes
+                self._tools_payloads.clear()
+            ordered = sorted(tools, key=lambda tool: (not tool.pinned, tool.name))
+            payload = [tool.tool_metadata for tool in ordered]
+            serialized = json.dumps(payload)
+            entry = self._tools_payloads[key] = (payload, len(serialized), estimate_tokens(serialized))
+        return entry
+
+    def request_size(self, conversation_messages: Union[List[Message], Memory], tools: Optional[List[Tool]] = None) -> RequestSize:
+        """Size of a request, without serializing it again.
+
+        The sizes of a Memory are maintained as messages are added and the tool
+        schemas are measured once per toolbox; plain message lists are measured.
+        Tool schemas count as prompt tokens.
+
+        Args:
+            conversation_messages: List of conversation messages, or an agent Memory
+            tools: (Optional) Tools made available to the model
+
+        Returns:
+            The estimated prompt tokens and serialized size of the request
+        """
+        if isinstance(conversation_messages, Memory):
+            tokens, size = conversation_messages.total_tokens, conversation_messages.payload_bytes
+        else:
+            formatted = self.format_messages(conversation_messages)
+            tokens, size = estimate_messages_tokens(formatted), len(json.dumps(formatted, default=str))
+        if tools:
+            _, tools_size, tools_tokens = self._tools_entry(tools)
+            size += tools_size
+            tokens += tools_tokens
+        return RequestSize(tokens=tokens, bytes=size)
+
+    @asynccontextmanager
+    async def timeout(self, seconds: Optional[float]):
+        """Cancels the calls made inside the block after `seconds`, never when None
+
+        Raises:
+            LLMTimeoutError: If the block takes longer than `seconds`
+        """
+        try:
+            async with asyncio.timeout(seconds):
+                yield
+        except TimeoutError:
+            raise LLMTimeoutError(f"No response from '{self.model_name}' within {seconds}s") from None
+
+    def build_request(self,
+                      conversation_messages: Union[List[Message], Memory],
+                      tools: Optional[List[Tool]] = None,
+                      tool_choice: ToolChoice = ToolChoice.AUTO,
+                      parallel_tool_calls: bool = True,
+                      stream: bool = False) -> Dict[str, Any]:
+        """Builds a canonical chat completion request.
+
+        Provider prompt caches only match a byte-identical prefix. The SDK lays
+        out the request body itself, so what is kept stable is the content: the
+        same sampling settings, tool schemas as canonical JSON in a stable order (see
+        `tools_payload`), and messages whose static system prompts lead the
+        conversation.
+
+        Args:
+            conversation_messages: List of conversation messages, or an agent Memory
+            tools: (Optional) Tools made available to the model
+            tool_choice: How the model must handle the tools
+            parallel_tool_calls: Allows the model to request several tool calls in one response
+            stream: Streams the completion
+
+        Returns:
+            Chat completion API arguments
+        """
+        request: Dict[str, Any] = {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_completion_tokens": self.max_completion_tokens,
+        }
+        if tools:
+            request["tools"] = self.tools_payload(tools)
+            request["tool_choice"] = tool_choice.value
+            request["parallel_tool_calls"] = parallel_tool_calls
+        if stream:
+            request["stream"] = True
+            request["stream_options"] = {"include_usage": True} # every provider reports usage in the last chunk
+        request["messages"] = self.format_messages(conversation_messages)
+
+        return request
+
+    def adapt_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Adapts a request built by another LLM to this one: its model and sampling settings"""
+        return {
+            **request,
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "max_completion_tokens": self.max_completion_tokens,
+        }
+
+    def format_messages(self, messages: Union[List[Message], Memory]) -> List[dict]:
         """Formats messages to LLM format.
         
-        Receives messages and converts to a dict in OpenAI format
+        Receives messages and converts to a dict in OpenAI format. When a Memory
+        is received, its pre-serialized view is reused.
 
         Args:
-            messages: A list of messages as Message object
+            messages: A list of messages as Message object, or an agent Memory
 
         Returns:
             A list of messages in dictionary format, followig OpenAI's pattern
@@ -54,60 +182,294 @@ class LLM:
             ...           ]
             >>> formatted = messages.format_messages(message)
         """
+        if isinstance(messages, Memory):
+            return messages.to_dict_list()
+
         formatted_messages = []
         for message in messages:
             formatted_messages.append(message.to_dict())
         
         return formatted_messages
     
-    async def invoke(self, conversation_messages: List[Message]) -> str:
+    async def invoke(self, 
+                     conversation_messages: Union[List[Message], Memory],
+                     priority: Priority = Priority.INTERACTIVE,
+                     timeout: Optional[float] = None) -> str:
         """Invokes the Language Model.
         
         Calls the Chat completion API.
 
         Args:
-            conversation_messages: List of conversation messages
-            system_message: List of system messages to add before the conversation
+            conversation_messages: List of conversation messages, or an agent Memory
+            priority: Scheduling priority of the call within the provider rate limits
+            timeout: (Optional) Seconds the call may take, including the wait for the rate limits
         
         Returns:
             Models text response
 
+        Raises:
+            LLMTimeoutError: If the call takes longer than the timeout
+
         Example: 
         >>> response = llm.invoke(Message.user_message("Hi, how are you?"))
         """
-        formatted_messages = []
-
-        conversation_messages = self.format_messages(conversation_messages)
-        formatted_messages.extend(conversation_messages)
+        async with self.timeout(timeout):
+            message = await self.complete(self.build_request(conversation_messages), priority, self.request_size(conversation_messages))
 
-        response = await self.client.chat.completions.create(
-            messages=formatted_messages,
-            model=self.model_name,
-        )
-
-        return response.choices[0].message.content
+        return message.content
 
     async def invoke_tools(self, 
-                           conversation_messages: List[Message], 
+                           conversation_messages: Union[List[Message], Memory], 
                            tools: List[Tool],
-                           tool_choice: ToolChoice = ToolChoice.AUTO) -> str:
+                           tool_choice: ToolChoice = ToolChoice.AUTO,
+                           parallel_tool_calls: bool = True,
+                           priority: Priority = Priority.INTERACTIVE,
+                           timeout: Optional[float] = None) -> str:
         """Invokes the langugae model with tools.
         
         Allows the use of tools for the call
+
+        Args:
+            conversation_messages: List of conversation messages, or an agent Memory
+            tools: Tools made available to the model
+            tool_choice: How the model must handle the tools
+            parallel_tool_calls: Allows the model to request several tool calls in one response
+            priority: Scheduling priority of the call within the provider rate limits
+            timeout: (Optional) Seconds the call may take, including the wait for the rate limits
+
+        Raises:
+            LLMTimeoutError: If the call takes longer than the timeout
         """
-        formatted_messages = []
+        request = self.build_request(conversation_messages, tools, tool_choice, parallel_tool_calls)
+        async with self.timeout(timeout):
+            return await self.complete(request, priority, self.request_size(conversation_messages, tools))
+
+    async def complete(self, request: Dict[str, Any], priority: Priority = Priority.INTERACTIVE, size: Optional[RequestSize] = None) -> ChatCompletionMessage:
+        """Sends a chat completion request, going through the response cache when enabled.
+
+        The cache is bypassed when sampling is random (temperature > 0), unless the
+        cache explicitly allows non deterministic responses.
+
+        Args:
+            request: Chat completion API arguments
+            priority: Scheduling priority of the call within the provider rate limits
+            size: (Optional) Size of the request, measured from the request when None
+
+        Returns:
+            The completion message
+        """
+        with TRACER.span("llm.complete", SpanKind.LLM, provider=self.provider, model=self.model_name) as span:
+            if self.cache is None or (request.get("temperature", self.temperature) > 0 and not self.cache.allow_nondeterministic):
+                response = await self.create(request, priority, size)
+                return response.choices[0].message
+
+            fetched = []
+            async def fetch_message() -> Dict[str, Any]:
+                fetched.append(True)
+                return await self._fetch_message(request, priority, size)
+
+            key = make_key(request) # the request carries the sampling settings
+            payload = await self.cache.get_or_compute(key, fetch_message)
+            span.set(cache_hit=not fetched)
+
+            return ChatCompletionMessage.model_validate(payload)
+
+    async def _fetch_message(self, request: Dict[str, Any], priority: Priority, size: Optional[RequestSize]) -> Dict[str, Any]:
+        """Sends a chat completion request and returns the message as a JSON serializable dict"""
+        response = await self.create(request, priority, size)
+        return response.choices[0].message.model_dump(mode="json", exclude_none=True)
+
+    async def create(self, request: Dict[str, Any], priority: Priority = Priority.INTERACTIVE, size: Optional[RequestSize] = None) -> Any:
+        """Sends a request to the provider once the rate limit scheduler allows it.
+
+        The estimated prompt tokens, tool schemas included, count against the
+        tokens-per-minute limit.
+        Inside `use_cassette` the response is recorded, or replayed from the
+        cassette without calling the provider.
+
+        Args:
+            request: Chat completion API arguments
+            priority: Scheduling priority of the call
+            size: (Optional) Size of the request as given by `request_size`, measured from
+                the request when None
+
+        Returns:
+            The raw chat completion response (or stream)
+        """
+        if size is None:
+            tools_tokens = estimate_tokens(json.dumps(request["tools"])) if request.get("tools") else 0
+            size = RequestSize(tokens=estimate_messages_tokens(request["messages"]) + tools_tokens, bytes=len(json.dumps(request, default=str)))
+        cassette = active_cassette()
+
+        with TRACER.span("llm.request", SpanKind.REQUEST, provider=self.provider, model=self.model_name) as span:
+            span.set(request_bytes=size.bytes)
+
+            async def send() -> Any:
+                span.set(queue_time=span.duration) # time spent waiting for the scheduler
+                if cassette is not None:
+                    return await cassette.record_llm(request, lambda: self.client.chat.completions.create(**request))
+                return await self.client.chat.completions.create(**request)
+
+            if cassette is not None and cassette.replaying:
+                response = await cassette.replay_llm(request) # no provider call, nor rate limit
+            else:
+                response = await self.scheduler.submit(send, size.tokens, priority)
+
+            if not request.get("stream"):
+                span.set(**self.priced_usage(getattr(response, "usage", None)), response_bytes=message_bytes(response.choices[0].message))
+
+            return response
+
+    async def stream(self,
+                     conversation_messages: Union[List[Message], Memory],
+                     tools: Optional[List[Tool]] = None,
+                     tool_choice: ToolChoice = ToolChoice.AUTO,
+                     parallel_tool_calls: bool = True,
+                     priority: Priority = Priority.INTERACTIVE,
+                     timeout: Optional[float] = None) -> AsyncIterator[StreamEvent]:
+        """Streams the language model completion.
+
+        Yields text deltas as soon as they arrive. Tool call fragments are assembled
+        incrementally, by index and in any order, and every tool call is yielded
+        once its arguments form a complete JSON object, so it can be executed while
+        the model is still generating the next ones. Calls still incomplete when
+        the model finishes are yielded then.
+
+        Args:
+            conversation_messages: List of conversation messages, or an agent Memory
+            tools: (Optional) Tools made available to the model
+            tool_choice: How the model must handle the tools
+            parallel_tool_calls: Allows the model to request several tool calls in one response
+            priority: Scheduling priority of the call within the provider rate limits
+            timeout: (Optional) Seconds until the response starts, including the wait for the rate
+                limits, and between two chunks: a stream stalling midway fails too
+
+        Yields:
+            StreamEvent objects, the last one being a DONE event with the full text
+            and the time to first token
+
+        Raises:
+            LLMTimeoutError: If the response does not start, or stalls, for longer than the timeout
+
+        Example:
+        >>> async for event in llm.stream([Message.user_message("Hi, how are you?")]):
+        ...     if event.type == StreamEventType.CONTENT:
+        ...         print(event.content, end="")
+        """
+        request = self.build_request(conversation_messages, tools, tool_choice, parallel_tool_calls, stream=True)
+
+        # The span is not made current: async generators share the context of their consumer
+        span = TRACER.start_span("llm.stream", SpanKind.LLM, provider=self.provider, model=self.model_name)
+        started_at = time.perf_counter()
+        time_to_first_token = None
+        content_parts: List[str] = []
+        pending_calls: Dict[int, Dict[str, str]] = {} # tool call fragments by index
+        emitted_calls: Set[int] = set() # indexes of the tool calls already yielded
+        response_bytes = 0
+
+        try:
+            async with self.timeout(timeout):
+                response = await self.create(request, priority, self.request_size(conversation_messages, tools))
+            pricing = getattr(response, "backend", self) # routed streams are priced by the backend answering
+
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    async with self.timeout(timeout):
+                        chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+
+                usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+                if usage:
+                    span.set(**pricing.priced_usage(usage))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+
+                if time_to_first_token is None and (delta.content or delta.tool_calls):
+                    time_to_first_token = time.perf_counter() - started_at
+                    span.set(time_to_first_token=time_to_first_token)
+                    log_event("llm.first_token", provider=self.provider, model=self.model_name, time_to_first_token=time_to_first_token,
+                              message=f"Time to first token for '{self.model_name}': {time_to_first_token:.3f}s")
+
+                if delta.content:
+                    content_parts.append(delta.content)
+                    response_bytes += len(delta.content.encode("utf-8"))
+                    yield StreamEvent(type=StreamEventType.CONTENT, content=delta.content)
+
+                for fragment in delta.tool_calls or []:
+                    if fragment.index in emitted_calls:
+                        continue # trailing whitespace of arguments already complete
+                    call = pending_calls.setdefault(fragment.index, {"id": "", "name": "", "arguments": ""})
+                    if fragment.id:
+                        call["id"] = fragment.id
+                    if fragment.function and fragment.function.name:
+                        call["name"] += fragment.function.name
+                    if fragment.function and fragment.function.arguments:
+                        call["arguments"] += fragment.function.arguments
+                        response_bytes += len(fragment.function.arguments.encode("utf-8"))
+
+                    # Fragments of several calls may interleave: a call starts as soon as its arguments are a complete JSON object
+                    if call["id"] and call["name"] and is_complete_json(call["arguments"]):
+                        emitted_calls.add(fragment.index)
+                        yield StreamEvent(type=StreamEventType.TOOL_CALL, tool_call=self._assemble_tool_call(pending_calls.pop(fragment.index)))
+
+                if chunk.choices[0].finish_reason:
+                    for index in sorted(pending_calls): # incomplete arguments are reported by the tool call
+                        emitted_calls.add(index)
+                        yield StreamEvent(type=StreamEventType.TOOL_CALL, tool_call=self._assemble_tool_call(pending_calls.pop(index)))
+
+            for index in sorted(pending_calls):
+                yield StreamEvent(type=StreamEventType.TOOL_CALL, tool_call=self._assemble_tool_call(pending_calls.pop(index)))
+
+            yield StreamEvent(type=StreamEventType.DONE, content="".join(content_parts), time_to_first_token=time_to_first_token)
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            span.set(response_bytes=response_bytes)
+            TRACER.end_span(span)
+
+    def priced_usage(self, usage: Any) -> Dict[str, Any]:
+        """Token counts of a provider usage report and their cost"""
+        attributes = usage_attributes(usage)
+        if attributes:
+            uncached = attributes["prompt_tokens"] - attributes["cached_tokens"]
+            attributes["cost"] = (uncached * self.prompt_token_cost
+                                  + attributes["cached_tokens"] * self.cached_token_cost
+                                  + attributes["completion_tokens"] * self.completion_token_cost) / 1_000_000
+        return attributes
+
+    @staticmethod
+    def _assemble_tool_call(call: Dict[str, str]) -> ToolCall:
+        """Builds a ToolCall from its streamed fragments"""
+        return ToolCall.from_raw(call["id"], call["name"], call["arguments"])
 
-        conversation_messages = self.format_messages(conversation_messages)
-        formatted_messages.extend(conversation_messages)
+def is_complete_json(text: str) -> bool:
+    """Checks if streamed tool call arguments form a complete JSON object"""
+    if not text.rstrip().endswith("}"):
+        return False # cheap check, most fragments end elsewhere
+    try:
+        return isinstance(json.loads(text), dict)
+    except json.JSONDecodeError:
+        return False
 
-        # Unpack all provided tools for use
-        toolbox = [t.tool_metadata for t in tools]
+def usage_attributes(usage: Any) -> Dict[str, int]:
+    """Extracts token counts from a provider usage report"""
+    if usage is None:
+        return {}
 
-        response = await self.client.chat.completions.create(
-            messages=formatted_messages,
-            model=self.model_name,
-            tools=toolbox,
-            tool_choice=tool_choice.value,
-        )
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
 
-        return response.choices[0].message
\ No newline at end of file
+def message_bytes(message: Any) -> int:
+    """Size of the text and tool call arguments of a completion message"""
+    size = len((message.content or "").encode("utf-8"))
+    for tool_call in message.tool_calls or []:
+        size += len(tool_call.function.arguments.encode("utf-8"))
+    return size
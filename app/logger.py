@@ -1,19 +1,101 @@
+import json
+import random
 import sys
+import threading
 from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
 from loguru import logger as _logger
 
 # internal packages
 from app.config import PROJECT_ROOT
 
 _print_level = "INFO"
+_event_level_no = 20 # events below this level are skipped before formatting
+
+# Max characters kept from a payload field (tool results, prompts...) in the event log
+PAYLOAD_MAX_CHARS = 500
+
+# Default fraction of the high frequency events that is logged, other events are always logged
+SAMPLE_RATES = {
+    "llm.first_token": 0.1, # already recorded on the LLM span
+    "agent.tools_selected": 0.1,
+}
+_sample_rates: Dict[str, float] = dict(SAMPLE_RATES)
+
+class EventSink:
+    """Loguru sink writing structured events as compact JSON lines.
+
+    Only records logged with `log_event` are written. Each line holds the time,
+    level, event name and fields, so a run can be replayed with `read_events`.
+    Files are rotated by size and only the most recent ones are kept.
+    """
+    def __init__(self, path: Path, max_bytes: int = 50 * 1024 * 1024, backups: int = 5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = self.path.open("a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, message) -> None:
+        record = message.record
+        line = json.dumps({
+            "t": record["time"].timestamp(),
+            "level": record["level"].name,
+            "event": record["extra"]["event"],
+            **record["extra"].get("fields", {}),
+        }, ensure_ascii=False, default=str, separators=(",", ":"))
+
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
 
-def define_log_level(print_level="DEBUG", logfile_level="DEBUG", name: str = None):
-    """Adjust log level to level above"""
-    global _print_level
+    def _rotate(self) -> None:
+        """Renames the current file to .1 (shifting older backups) and opens a new one"""
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{index}")
+            if source.exists():
+                source.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+        self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        self._file = self.path.open("a", encoding="utf-8")
+
+    def stop(self) -> None:
+        self._file.close()
+
+def define_log_level(print_level="DEBUG",
+                     logfile_level="DEBUG",
+                     name: str = None,
+                     rotation: str = "50 MB",
+                     retention: str = "14 days",
+                     enqueue: bool = True,
+                     events: bool = True,
+                     event_level: str = "INFO",
+                     sample_rates: Optional[Dict[str, float]] = None,
+                     log_dir: Path = PROJECT_ROOT / "logs"):
+    """Adjust log level to level above
+
+    Args:
+        print_level: Level printed to stderr
+        logfile_level: Level written to the log file
+        name: (Optional) Prefix of the log file names
+        rotation: Size or age after which the log file is rotated
+        retention: Age after which rotated log files are deleted
+        enqueue: Writes from a background thread, so logging never blocks on stderr or disk
+        events: Also writes structured events to a compact JSONL file
+        event_level: Lowest level of the events logged with `log_event`
+        sample_rates: (Optional) Fraction of each event name logged, defaults to SAMPLE_RATES
+        log_dir: Directory of the log files
+    """
+    global _print_level, _event_level_no, _sample_rates
     _print_level = print_level
     current_date = datetime.now()
     formatted_date = current_date.strftime("%Y/%m/%d%H%M%S")
-    
+
     # Custom log format with special treatment for THOUGHT messages
     log_format = (
         "<green>{time:YYYY-MM-DD HH:mm:ss.SSS zz}</green> | "
@@ -21,7 +103,7 @@ def define_log_level(print_level="DEBUG", logfile_level="DEBUG", name: str = Non
         "<yellow>Line {line: >4} ({file}):</yellow> "
         "{message}\n"
     )
-    
+
     # Special format for THOUGHT level - entire message in dark green
     thought_format = (
         "<magenta>{time:YYYY-MM-DD HH:mm:ss.SSS zz} | "
@@ -29,21 +111,75 @@ def define_log_level(print_level="DEBUG", logfile_level="DEBUG", name: str = Non
         "Line {line: >4} ({file}): "
         "{message}</magenta>\n"
     )
-    
+
     log_name = f"{name}_{formatted_date}" if name else formatted_date
-    
+
     # possibility to name the log with a specific name
     _logger.remove()
-    
-    # Define a custom level
-    _logger.level("THOUGHT", no=15, color="<magenta>")
-    
+
+    # Define a custom level, once: loguru refuses to redefine a level
+    try:
+        _logger.level("THOUGHT")
+    except ValueError:
+        _logger.level("THOUGHT", no=15, color="<magenta>")
+
     # Define the level with Loguru
-    _logger.add(sys.stderr, level=print_level, format=lambda record: thought_format if record["level"].name == "THOUGHT" else log_format)
-    _logger.add(PROJECT_ROOT / f"logs/{log_name}.log", level=logfile_level)
-    
+    _logger.add(sys.stderr, level=print_level, enqueue=enqueue,
+                format=lambda record: thought_format if record["level"].name == "THOUGHT" else log_format)
+    _logger.add(Path(log_dir) / f"{log_name}.log", level=logfile_level, enqueue=enqueue, rotation=rotation, retention=retention)
+    if events:
+        _logger.add(EventSink(Path(log_dir) / f"{log_name}.events.jsonl"), level=event_level, enqueue=enqueue,
+                    filter=lambda record: "event" in record["extra"])
+
+    _event_level_no = _logger.level(event_level).no
+    _sample_rates = dict(SAMPLE_RATES if sample_rates is None else sample_rates)
+
     return _logger
 
+def is_enabled(level: str) -> bool:
+    """Checks if events of the level are logged, to skip building expensive messages"""
+    return _logger.level(level).no >= _event_level_no
+
+def cap(value: Any, max_chars: int = PAYLOAD_MAX_CHARS) -> Any:
+    """Caps a payload field, long values are truncated with their original size"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [{len(text)} chars]"
+
+def log_event(event: str, level: str = "INFO", sample_rate: Optional[float] = None, message: Optional[str] = None, **fields: Any) -> None:
+    """Logs a structured event.
+
+    Nothing is formatted when the level is below the event level or the event
+    is not sampled. Payload fields are capped to PAYLOAD_MAX_CHARS.
+
+    Args:
+        event: Event name, such as "tool.result"
+        level: Log level
+        sample_rate: (Optional) Fraction of the events logged, defaults to the configured rate of the event name
+        message: (Optional) Human readable message, defaults to the event name
+        fields: Event fields, written to the JSONL event log
+    """
+    if not is_enabled(level):
+        return
+    if sample_rate is None:
+        sample_rate = _sample_rates.get(event, 1.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+
+    capped = {key: cap(value) for key, value in fields.items()}
+    _logger.bind(event=event, fields=capped).opt(depth=1).log(level, message or event)
+
+def read_events(path: Path) -> Iterator[Dict[str, Any]]:
+    """Reads back the events written to a JSONL event log"""
+    with Path(path).open(encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
 logger = define_log_level()
 
 if __name__ == "__main__":
@@ -53,8 +189,9 @@ if __name__ == "__main__":
     logger.error("Error message")
     logger.critical("Critical message")
     logger.log("THOUGHT", "Agent thought message")  # No need for extra tags since format handles it
-    
+    log_event("tool.result", tool="search", result="x" * 2000)
+
     try:
         raise ValueError("Test error")
     except Exception as e:
-        logger.exception(f"Exception message: {e}")
\ No newline at end of file
+        logger.exception(f"Exception message: {e}")
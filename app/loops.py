@@ -0,0 +1,40 @@
+import asyncio
+from typing import Callable, Dict, Generic, TypeVar
+
+T = TypeVar("T")
+
+class LoopLocal(Generic[T]):
+    """Value created once per event loop, for asyncio primitives shared by several loops.
+
+    Semaphores, locks and conditions are bound to the loop that first uses them,
+    so objects used from several loops (threads running their own loop, or
+    successive `asyncio.run` calls) need one primitive per loop. A primitive in
+    use references its loop, so loops cannot be weak keys: values of closed
+    loops are dropped whenever a value is created for a new loop.
+
+    Example:
+        >>> semaphores = LoopLocal(lambda: asyncio.Semaphore(4))
+        >>> async with semaphores.get():
+        ...     ...
+    """
+    def __init__(self, factory: Callable[[], T]):
+        """
+        Args:
+            factory: Creates the value of a loop, called inside that loop
+        """
+        self.factory = factory
+        self._values: Dict[asyncio.AbstractEventLoop, T] = {}
+
+    def get(self) -> T:
+        """Returns the value of the running loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        value = self._values.get(loop)
+        if value is None:
+            for other in list(self._values):
+                if other.is_closed():
+                    self._values.pop(other, None)
+            value = self._values[loop] = self.factory()
+        return value
+
+    def __len__(self) -> int:
+        return len(self._values)
@@ -7,7 +7,11 @@ NEXT_STEP = """Your job is to analyze the user's message carefully and determine
 - **Fresh news**: Always use the search tool for up to date, relvant information.
 
 # Crucial, never answer mathmatical questions without a tool.
-# Crucial, only call a tool at a time.
+# When several independent tool calls are needed, request all of them at once in the same response.
 
 Reflect if you actually need a tool and never repeat tool calls. 
 """
+
+LOOP_WARNING = """You are going in circles: you already made these tool calls in this run and their results are above: {calls}.
+Do not repeat them. Answer with the results you already have, or try a different approach.
+"""
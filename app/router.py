@@ -0,0 +1,196 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+# internal packages
+from app.cache import ResponseCache
+from app.llm import LLM
+from app.logger import logger
+from app.schema import LLMSettings, Priority, RequestSize
+
+class BackendHealth:
+    """Observed latency and failures of a backend"""
+    def __init__(self, alpha: float = 0.3, window: int = 100):
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_latency(self, latency: float) -> None:
+        """Updates the exponentially weighted moving average of latencies"""
+        self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+        self.samples.append(latency)
+        self.failures = 0
+
+    def record_lower_bound(self, elapsed: float) -> None:
+        """Accounts for a cancelled call that had already taken `elapsed` seconds.
+
+        The real latency is unknown, only that it exceeds `elapsed`: the average is
+        seeded with it when unknown, raised when it is below, never lowered, and no
+        sample nor success is recorded.
+        """
+        if self.ewma is None:
+            self.ewma = elapsed
+        elif elapsed > self.ewma:
+            self.ewma = self.alpha * elapsed + (1 - self.alpha) * self.ewma
+
+    def record_failure(self, cooldown: float) -> None:
+        """Marks the backend as unhealthy, the cooldown doubles with consecutive failures"""
+        self.failures += 1
+        self.unhealthy_until = time.monotonic() + cooldown * 2 ** (self.failures - 1)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Latency quantile of the recent samples, None without samples"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+class BackendStream:
+    """Streamed response of a backend, carrying the backend so its usage is priced with its settings"""
+    def __init__(self, stream: Any, backend: LLM):
+        self.stream = stream
+        self.backend = backend
+
+    def __aiter__(self):
+        return self.stream.__aiter__()
+
+class RoutedLLM(LLM):
+    """LLM routing every call across several providers.
+
+    Each call goes to the healthy backend with the lowest recent latency (EWMA),
+    with the model, sampling settings and prices of that backend.
+    Failing backends are skipped for a cooldown and the call fails over to the next
+    one. With hedging enabled, a duplicate request is sent to the next backend when
+    the first one takes longer than its recent p95 latency; the first answer wins
+    and the other request is cancelled.
+
+    Example:
+        >>> llm = RoutedLLM([groq_config, azure_config], hedge=True)
+        >>> agent = ToolAgent(name="MARS", model=llm, toolbox=tools)
+    """
+    def __init__(self,
+                 llm_configs: List[LLMSettings],
+                 cache: Optional[ResponseCache] = None,
+                 hedge: bool = False,
+                 hedge_quantile: float = 0.95,
+                 default_hedge_delay: float = 2.0,
+                 min_hedge_samples: int = 10,
+                 ewma_alpha: float = 0.3,
+                 failure_cooldown: float = 5.0):
+        """
+        Args:
+            llm_configs: Settings of every backend, the first one is preferred until latencies are known
+            cache: (Optional) Response cache shared by identical requests
+            hedge: Sends a duplicate request when the first backend is slow
+            hedge_quantile: Latency quantile of the first backend after which the duplicate is sent
+            default_hedge_delay: Hedge delay, in seconds, until enough latencies are observed
+            min_hedge_samples: Latencies needed before using the observed quantile
+            ewma_alpha: Weight of the newest latency in the moving average
+            failure_cooldown: Seconds a failing backend is skipped, doubled on consecutive failures
+        """
+        if not llm_configs:
+            raise ValueError("At least one LLMSettings is needed")
+
+        super().__init__(llm_configs[0], cache)
+        self.backends = [LLM(llm_config) for llm_config in llm_configs]
+        self.health: Dict[int, BackendHealth] = {id(backend): BackendHealth(ewma_alpha) for backend in self.backends}
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_samples = min_hedge_samples
+        self.failure_cooldown = failure_cooldown
+
+    def ranked_backends(self) -> List[LLM]:
+        """Healthy backends by latency (unknown latencies last), then unhealthy ones by recovery time"""
+        def rank(indexed):
+            index, backend = indexed
+            health = self.health[id(backend)]
+            if health.healthy:
+                return (0, health.ewma is None, health.ewma or 0.0, index)
+            return (1, False, health.unhealthy_until, index)
+
+        return [backend for _, backend in sorted(enumerate(self.backends), key=rank)]
+
+    def hedge_delay(self, backend: LLM) -> float:
+        """Seconds to wait for a backend before sending the duplicate request"""
+        health = self.health[id(backend)]
+        if len(health.samples) < self.min_hedge_samples:
+            return self.default_hedge_delay
+        return health.quantile(self.hedge_quantile)
+
+    async def _call_backend(self, backend: LLM, request: Dict[str, Any], priority: Priority, size: Optional[RequestSize]) -> Any:
+        """Sends the request to a backend, recording its latency or failure"""
+        health = self.health[id(backend)]
+        started_at = time.perf_counter()
+        try:
+            response = await backend.create(backend.adapt_request(request), priority, size)
+        except asyncio.CancelledError:
+            # Lost a hedge or the caller gave up: the elapsed time only bounds the latency from below
+            health.record_lower_bound(time.perf_counter() - started_at)
+            raise
+        except Exception as e:
+            health.record_failure(self.failure_cooldown)
+            logger.warning(f"Backend '{backend.provider}/{backend.model_name}' failed: {e}")
+            raise
+
+        health.record_latency(time.perf_counter() - started_at)
+        return BackendStream(response, backend) if request.get("stream") else response
+
+    async def create(self, request: Dict[str, Any], priority: Priority = Priority.INTERACTIVE, size: Optional[RequestSize] = None) -> Any:
+        """Sends the request to the best backend, failing over (and hedging) as configured.
+
+        Args:
+            request: Chat completion API arguments, the model is replaced by each backend's
+            priority: Scheduling priority of the call
+            size: (Optional) Size of the request, measured from the request when None
+
+        Returns:
+            The raw chat completion response (or stream) of the first successful backend
+
+        Raises:
+            The error of the last backend when every backend fails
+        """
+        remaining = self.ranked_backends()
+        pending: Set[asyncio.Future] = set()
+        last_error: Optional[Exception] = None
+
+        def launch() -> LLM:
+            backend = remaining.pop(0)
+            pending.add(asyncio.ensure_future(self._call_backend(backend, request, priority, size)))
+            return backend
+
+        try:
+            primary = launch()
+            while pending:
+                # Without hedging the next backend is only tried after a failure
+                timeout = self.hedge_delay(primary) if self.hedge and remaining and len(pending) == 1 else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedged = launch()
+                    logger.info(f"Hedging request to '{hedged.provider}/{hedged.model_name}' after {timeout:.2f}s")
+                    continue
+
+                pending -= done
+                succeeded = [task for task in done if task.exception() is None] # retrieves every error
+                if succeeded:
+                    return succeeded[0].result()
+                last_error = next(iter(done)).exception()
+
+                if not pending and remaining:
+                    primary = launch() # fail over
+        finally:
+            # Requests that lost the hedge are cancelled and awaited, never left running
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        raise last_error
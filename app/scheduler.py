@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+# internal packages
+from app.logger import logger
+from app.loops import LoopLocal
+from app.schema import LLMSettings, Priority
+
+T = TypeVar("T")
+
+class TokenBucket:
+    """Token bucket refilled continuously up to its capacity"""
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available, 0 when they already are"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.refill_per_second)
+
+    def consume(self, amount: float) -> None:
+        """Takes tokens from the bucket, amounts above the capacity take the whole bucket"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self) -> None:
+        """Empties the bucket, used when the provider reports the limit was hit"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+class RequestScheduler:
+    """Schedules LLM calls within requests-per-minute and tokens-per-minute limits.
+
+    Calls wait in a priority queue (interactive before batch, then first come first
+    served) until both token buckets allow them. Rate limit errors (HTTP 429) pause
+    the whole scheduler for the `retry-after` delay, or an exponential backoff when
+    the provider does not send one, and the call is retried. The limits are
+    shared by every event loop, each loop queues its own calls.
+    """
+    def __init__(self,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 max_retries: int = 5,
+                 base_backoff: float = 1.0):
+        """
+        Args:
+            requests_per_minute: (Optional) Max requests per minute, unlimited when None
+            tokens_per_minute: (Optional) Max prompt tokens per minute, unlimited when None
+            max_retries: Max retries of a call failing with a rate limit error
+            base_backoff: First backoff delay, in seconds, when no retry-after is received
+        """
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        # Waiting calls (priority, sequence, tokens) and their condition, per event loop
+        self._waiting: LoopLocal[Tuple[asyncio.Condition, List[Tuple[int, int, float]]]] = LoopLocal(lambda: (asyncio.Condition(), []))
+
+    def _wait_time(self, tokens: float) -> float:
+        """Seconds until a call of `tokens` prompt tokens can be sent"""
+        wait = max(0.0, self._paused_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def acquire(self, tokens: int, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Waits for the turn of a call and takes its share of the limits"""
+        condition, queue = self._waiting.get()
+        entry = (int(priority), next(self._sequence), tokens)
+        async with condition:
+            heapq.heappush(queue, entry)
+            try:
+                while True:
+                    wait = self._wait_time(tokens) if queue[0] is entry else None
+                    if wait == 0:
+                        break
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                condition.notify_all()
+                raise
+
+            heapq.heappop(queue)
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None:
+                self.tokens.consume(tokens)
+            condition.notify_all()
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        """Pauses the scheduler after a rate limit error, returns the delay"""
+        delay = retry_after(error)
+        if delay is None:
+            delay = self.base_backoff * 2 ** attempt * (1 + random.random() / 2)
+
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        if self.requests is not None:
+            self.requests.drain()
+        if self.tokens is not None:
+            self.tokens.drain()
+
+        return delay
+
+    async def submit(self,
+                     call: Callable[[], Awaitable[T]],
+                     tokens: int = 0,
+                     priority: Priority = Priority.INTERACTIVE) -> T:
+        """Runs a call when the limits allow it, retrying on rate limit errors.
+
+        Args:
+            call: Coroutine function sending the request
+            tokens: Estimated prompt tokens of the request
+            priority: Interactive calls are sent before batch calls
+
+        Returns:
+            The call result
+        """
+        attempt = 0
+        while True:
+            await self.acquire(tokens, priority)
+            try:
+                return await call()
+            except Exception as e:
+                if getattr(e, "status_code", None) != 429 or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(e, attempt)
+                logger.warning(f"Rate limit reached, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+                attempt += 1
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Reads the retry delay, in seconds, sent by the provider with a rate limit error"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None # HTTP-date values are not used by the supported providers
+
+    return None
+
+# Schedulers shared by every LLM calling the same provider deployment
+SCHEDULERS: Dict[Tuple, RequestScheduler] = {}
+SCHEDULER_LIMITS: Dict[Tuple, Tuple[Optional[int], Optional[int], int]] = {} # settings each scheduler was created with
+
+def get_scheduler(llm_config: LLMSettings) -> RequestScheduler:
+    """Returns the scheduler of a provider and model, creating it on first use.
+
+    The limits are those of the provider deployment, so every LLM calling it
+    shares the scheduler created with the first settings. Settings with other
+    limits are logged as a conflict and keep the first limits.
+    """
+    key = (llm_config.provider.lower(), llm_config.base_url, llm_config.model_name)
+    limits = (llm_config.requests_per_minute, llm_config.tokens_per_minute, llm_config.max_retries)
+    if key not in SCHEDULERS:
+        SCHEDULERS[key] = RequestScheduler(*limits)
+        SCHEDULER_LIMITS[key] = limits
+    elif SCHEDULER_LIMITS[key] != limits:
+        logger.warning(f"Conflicting limits for '{llm_config.provider}/{llm_config.model_name}': "
+                       f"(requests_per_minute, tokens_per_minute, max_retries) {limits} ignored, the shared scheduler keeps {SCHEDULER_LIMITS[key]}")
+
+    return SCHEDULERS[key]
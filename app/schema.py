@@ -1,13 +1,20 @@
 
 import json
 
-from typing import Optional, List, Dict, Any
+from collections import deque
+from itertools import islice
+from typing import Optional, List, Dict, Any, Callable, Deque, Set, Tuple
 from typing_extensions import Self
 from enum import Enum
-from pydantic import BaseModel, Field
+from uuid import uuid4
+from pydantic import BaseModel, Field, PrivateAttr, ConfigDict
 
 from groq.types.chat import ChatCompletionMessageToolCall
 
+# internal packages
+from app.tokens import estimate_message_tokens
+from app.tracing import RunMetrics
+
 class ToolChoice(str, Enum):
     """Enum type class for determining specific model behaviours in tool choice"""
     NONE = "none"
@@ -30,6 +37,21 @@ class AgentState(str, Enum):
     FINISHED = "finished"
     ERROR = "error"
 
+class StopReason(str, Enum):
+    """Enum type class for the reason a run stopped before answering"""
+    MAX_STEPS = "max_steps"
+    DEADLINE = "deadline"
+    TOKEN_BUDGET = "token_budget"
+    COST_BUDGET = "cost_budget"
+    CANCELLED = "cancelled"
+    LLM_TIMEOUT = "llm_timeout"
+    LOOP = "loop"
+
+class Priority(int, Enum):
+    """Enum type class for scheduling LLM calls, lower values are sent first"""
+    INTERACTIVE = 0
+    BATCH = 1
+
 class LLMSettings(BaseModel):
     """Wrap all LLM settings.
     
@@ -49,10 +71,27 @@ class LLMSettings(BaseModel):
     max_completion_tokens: int = Field(default=4096, description="The maximum number of tokens to generate.")
     top_p: float = Field(default=1, description="Controls diversity via nucleus sampling: 0.5 means half of all likelihood-weighted options are considered.")
 
-class Message(BaseModel):
-    """Class for representing a chat message. 
-    
-    Can hold system, user, assistant or tool messages.
+    # (Optional) HTTP connection pool settings, shared by every LLM using the same client
+    max_connections: int = Field(default=100, description="Max number of concurrent connections to the provider")
+    max_keepalive_connections: int = Field(default=20, description="Max number of idle connections kept open for reuse")
+    keepalive_expiry: float = Field(default=30.0, description="Seconds an idle connection is kept open")
+    http2: bool = Field(default=False, description="Uses HTTP/2 when the 'h2' package is installed")
+
+    # (Optional) Provider rate limits, shared by every LLM calling the same model
+    requests_per_minute: Optional[int] = Field(default=None, description="Max requests per minute allowed by the provider")
+    tokens_per_minute: Optional[int] = Field(default=None, description="Max prompt tokens per minute allowed by the provider")
+    max_retries: int = Field(default=5, description="Max retries of a call failing with a rate limit error")
+
+    # (Optional) Prices, used for run cost budgets
+    prompt_token_cost: float = Field(default=0.0, description="Cost of one million prompt tokens")
+    cached_token_cost: Optional[float] = Field(default=None, description="Cost of one million prompt tokens served from the provider prompt cache, the prompt token cost when None")
+    completion_token_cost: float = Field(default=0.0, description="Cost of one million completion tokens")
+
+class MessageModel(BaseModel):
+    """Validated representation of a chat message.
+
+    Used only at the API boundary, to validate messages coming from outside the
+    framework. Agents store messages as the compact Message class.
     """
     # Main attributes
     role: Role = Field(..., description="Role of the entity that sent the message")
@@ -65,6 +104,31 @@ class Message(BaseModel):
     tool_call_id: Optional[str] = Field(None, description="ID of the tool call for providing response")
     arguments: Optional[Dict[str, Any]] = Field(None, description="Function arguments")
 
+class Message:
+    """Class for representing a chat message. 
+    
+    Can hold system, user, assistant or tool messages. Messages are compact,
+    slotted objects built without validation; use `Message.from_dict` to validate
+    messages received from outside the framework.
+    """
+    __slots__ = ("role", "content", "tool_name", "tool_calls", "tool_id", "tool_call_id", "arguments")
+
+    def __init__(self,
+                 role: Role,
+                 content: str,
+                 tool_name: Optional[str] = None,
+                 tool_calls: Optional[List] = None,
+                 tool_id: Optional[str] = None,
+                 tool_call_id: Optional[str] = None,
+                 arguments: Optional[Dict[str, Any]] = None):
+        self.role = role if isinstance(role, Role) else Role(role) # enum members are shared singletons
+        self.content = content
+        self.tool_name = tool_name
+        self.tool_calls = tool_calls
+        self.tool_id = tool_id
+        self.tool_call_id = tool_call_id
+        self.arguments = arguments
+
     def to_dict(self) -> dict:
         """Returns the message in dict format"""
         message = {"role": self.role.value}
@@ -84,6 +148,30 @@ class Message(BaseModel):
         
         return message
 
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        """Validates a message received from outside the framework.
+
+        Args:
+            data: Message fields, as in OpenAI's format
+
+        Raises:
+            pydantic.ValidationError: If the message is malformed
+        """
+        return cls(**MessageModel.model_validate(data).model_dump())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    # Messages are mutable and compared by value: they are not hashable
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__ if getattr(self, field) is not None)
+        return f"Message({fields})"
+
     @classmethod
     def system_message(cls, content: str) -> "Message":
         """Create a system message"""
@@ -104,26 +192,238 @@ class Message(BaseModel):
         """Create a tool message"""
         return cls(role=Role.TOOL, tool_call_id=tool_call_id, content=content)
 
+class RequestSize(BaseModel):
+    """Size of a chat completion request, measured from the sizes cached by Memory and the tool payloads"""
+    tokens: int = Field(..., description="Estimated prompt tokens, for the rate limits")
+    bytes: int = Field(..., description="Size of the serialized messages and tool schemas")
+
 class Memory(BaseModel):
     """Class for managing agents Memory
     
-    Structure for adding, removing, and retrieving messages
+    Structure for adding, removing, and retrieving messages. Every message is
+    serialized once, when it is added, and the request payload reuses that
+    append-only view instead of re-formatting the whole history on every step.
+    Messages must not be mutated after being added.
+
+    The window is limited by number of messages and, optionally, by a token budget.
+    Leading system messages (system and next-step prompts) are always kept, and an
+    assistant tool call is never separated from its tool responses. Evicted turns
+    can be folded into a rolling summary message placed right after the prompts.
+    The window is a ring buffer (deque), so evicting the oldest turn is O(1).
+
+    `messages` and `to_dict_list` return list views maintained as messages are
+    added and evicted, so reading them does not copy the history. The views
+    change with the memory: never mutate them, and copy them to keep a snapshot.
     """
-    messages: List[Message] = Field(default_factory=list)
     max_messages: int = Field(default=100, description="Max number of messages the memory can hold")
 
+    # Token aware windowing
+    max_tokens: Optional[int] = Field(default=None, description="Max number of prompt tokens the memory can hold")
+    token_counter: Callable[[dict], int] = Field(default=estimate_message_tokens, description="Counts the tokens of a serialized message")
+    summarize_evicted: bool = Field(default=False, description="Folds evicted messages into a rolling summary message")
+    summarizer: Optional[Callable[[Optional[str], List[Message]], str]] = Field(default=None, description="Builds the new summary from the previous one and the evicted messages")
+    summary_max_chars: int = Field(default=2000, description="Max size of the default rolling summary")
+
+    # Leading system messages, never evicted
+    _pinned: List[Message] = PrivateAttr(default_factory=list)
+
+    # Rolling summary message of the evicted turns, placed after the pinned messages
+    _summary: Optional[str] = PrivateAttr(default=None)
+    _summary_message: Optional[Message] = PrivateAttr(default=None)
+    _summary_payload: Optional[dict] = PrivateAttr(default=None)
+    _summary_tokens: int = PrivateAttr(default=0)
+    _summary_bytes: int = PrivateAttr(default=0)
+
+    # Conversation window with the token count and serialized size of each message
+    _window: Deque[Message] = PrivateAttr(default_factory=deque)
+    _window_tokens: Deque[int] = PrivateAttr(default_factory=deque)
+    _window_bytes: Deque[int] = PrivateAttr(default_factory=deque)
+    _total_tokens: int = PrivateAttr(default=0)
+    _total_bytes: int = PrivateAttr(default=0)
+
+    # Every message and its serialized view in order (pinned, summary, window), maintained in place
+    _messages_view: List[Message] = PrivateAttr(default_factory=list)
+    _payload_view: List[dict] = PrivateAttr(default_factory=list)
+
+    # Serialized messages added since the last checkpoint, None when not journaling
+    _journal: Optional[List[dict]] = PrivateAttr(default=None)
+
+    @property
+    def messages(self) -> List[Message]:
+        """Messages currently in memory, oldest first, as a live view (see the class docstring)"""
+        return self._messages_view
+
+    @property
+    def last(self) -> Optional[Message]:
+        """Most recent message, None when the memory is empty"""
+        return self._messages_view[-1] if self._messages_view else None
+
+    @property
+    def total_tokens(self) -> int:
+        """Estimated prompt tokens of the messages currently in memory"""
+        return self._total_tokens
+
+    @property
+    def payload_bytes(self) -> int:
+        """Size of the serialized messages currently in memory, measured once per message"""
+        return self._total_bytes
+
+    @property
+    def summary(self) -> Optional[str]:
+        """Rolling summary of the evicted messages"""
+        return self._summary
+
+    def __len__(self) -> int:
+        return len(self._pinned) + (self._summary_message is not None) + len(self._window)
+
     def add_message(self, message: Message):
         """Adds a single message to memory"""
-        self.messages.append(message)
+        payload = message.to_dict()
+        tokens = self.token_counter(payload)
+        size = len(json.dumps(payload, default=str))
+        self._total_tokens += tokens
+        self._total_bytes += size
+        if self._journal is not None:
+            self._journal.append(payload)
+        self._messages_view.append(message)
+        self._payload_view.append(payload)
+
+        if message.role == Role.SYSTEM and not self._window and self._summary_message is None:
+            # still within the leading prompts
+            self._pinned.append(message)
+            return
+
+        self._window.append(message)
+        self._window_tokens.append(tokens)
+        self._window_bytes.append(size)
+
+        # Implement limit of messages and tokens in memory, removing oldest messages
+        while True:
+            evicted = self._evict_overflow()
+            if not evicted or not self.summarize_evicted:
+                break
+            self._update_summary(evicted)
+
+        if self._summary_message is not None:
+            self._fit_summary()
+
+    def _over_limit(self) -> bool:
+        """Checks if the memory exceeds the message or token limits"""
+        if len(self) > self.max_messages:
+            return True
+        return self.max_tokens is not None and self._total_tokens > self.max_tokens
+
+    def _evict_overflow(self) -> List[Message]:
+        """Removes the oldest turns until the memory fits its limits.
+
+        A tool call and its tool responses are removed together and the most recent
+        turn is always kept, even when it alone exceeds the limits.
+
+        Returns:
+            The evicted messages
+        """
+        evicted: List[Message] = []
+
+        while self._over_limit():
+            turn_size = 1
+            while turn_size < len(self._window) and self._window[turn_size].role == Role.TOOL:
+                turn_size += 1 # keep tool responses together with their call
+
+            if turn_size >= len(self._window):
+                break # only the latest turn is left
+
+            window_start = len(self._pinned) + (self._summary_message is not None)
+            del self._messages_view[window_start:window_start + turn_size]
+            del self._payload_view[window_start:window_start + turn_size]
+            for _ in range(turn_size):
+                evicted.append(self._window.popleft())
+                self._total_tokens -= self._window_tokens.popleft()
+                self._total_bytes -= self._window_bytes.popleft()
+
+        return evicted
+
+    def _update_summary(self, evicted: List[Message]) -> None:
+        """Folds evicted messages into the rolling summary message"""
+        summarizer = self.summarizer or self._default_summarizer
+        self._set_summary(summarizer(self._summary, evicted))
+
+    def _set_summary(self, summary: Optional[str]) -> None:
+        """Replaces the rolling summary message, removing it when None"""
+        position = len(self._pinned)
+        if self._summary_message is not None:
+            del self._messages_view[position]
+            del self._payload_view[position]
+        self._total_tokens -= self._summary_tokens
+        self._total_bytes -= self._summary_bytes
+
+        self._summary = summary
+        if summary is None:
+            self._summary_message = self._summary_payload = None
+            self._summary_tokens = self._summary_bytes = 0
+            return
+
+        self._summary_message = Message.system_message(f"Summary of the earlier conversation:\n{summary}")
+        self._summary_payload = self._summary_message.to_dict()
+        self._summary_tokens = self.token_counter(self._summary_payload)
+        self._summary_bytes = len(json.dumps(self._summary_payload, default=str))
+        self._total_tokens += self._summary_tokens
+        self._total_bytes += self._summary_bytes
+        self._messages_view.insert(position, self._summary_message)
+        self._payload_view.insert(position, self._summary_payload)
+
+    def _fit_summary(self) -> None:
+        """Drops the oldest summary lines while the memory exceeds its token budget.
+
+        The summary counts against `max_tokens` like any message: when even its
+        last line does not fit, the summary is removed.
+        """
+        while self.max_tokens is not None and self._total_tokens > self.max_tokens and self._summary is not None:
+            lines = self._summary.splitlines()
+            self._set_summary("\n".join(lines[1:]) if len(lines) > 1 else None)
+
+    def _default_summarizer(self, summary: Optional[str], evicted: List[Message]) -> str:
+        """Extractive summary: one truncated line per evicted message, oldest lines dropped first"""
+        lines = [summary] if summary else []
+        for message in evicted:
+            text = message.content if not message.tool_calls else f"called {', '.join(c['function']['name'] for c in message.tool_calls)}"
+            lines.append(f"- {message.role.value}: {' '.join(str(text).split())[:200]}")
+
+        lines = "\n".join(lines).splitlines()
+        while len(lines) > 1 and sum(len(line) + 1 for line in lines) > self.summary_max_chars:
+            lines.pop(0)
+
+        return "\n".join(lines)[-self.summary_max_chars:]
+
+    def start_journal(self) -> None:
+        """Starts recording the messages added from now on, see `drain_journal`"""
+        self._journal = []
+
+    def drain_journal(self) -> List[dict]:
+        """Returns the messages added since the previous call (or `start_journal`), serialized"""
+        if self._journal is None:
+            return []
+        added, self._journal = self._journal, []
+        return added
+
+    def empty_copy(self) -> "Memory":
+        """Returns a new, empty Memory with the same settings"""
+        return Memory(**{name: getattr(self, name) for name in Memory.model_fields})
 
-        # Implement limit of messages in memory
-        if len(self.messages) > self.max_messages:
-            overflow = len(self.messages) - self.messages # compute the amount of messages beyond memory limit
-            self.messages = self.messages[overflow:] # always maintain max number of messages in memory removing oldest messages
-    
     def clear(self):
         """Delete all messages from memory"""
-        self.messages.clear()
+        self._pinned.clear()
+        self._summary = None
+        self._summary_message = None
+        self._summary_payload = None
+        self._summary_tokens = 0
+        self._summary_bytes = 0
+        self._window.clear()
+        self._window_tokens.clear()
+        self._window_bytes.clear()
+        self._total_tokens = 0
+        self._total_bytes = 0
+        self._messages_view.clear()
+        self._payload_view.clear()
     
     def get_recent_messages(self, n: int) -> List[Message]:
         """Return n most recent messages
@@ -133,11 +433,15 @@ class Memory(BaseModel):
         Returns:
             List[Message]: List of the n most recent Messages
         """
+        if n <= 0:
+            return []
+        if n <= len(self._window):
+            return list(islice(reversed(self._window), n))[::-1]
         return self.messages[-n:]
     
     def to_dict_list(self) -> List[dict]:
-        """Convert messages to list of dicts"""
-        return [msg.to_dict() for msg in self.messages]
+        """Messages as a list of dicts: the live serialized view (see the class docstring)"""
+        return self._payload_view
 
 class ToolCall(BaseModel):
     """Class for managing the ToolCall output from Language Models"""
@@ -145,8 +449,24 @@ class ToolCall(BaseModel):
     type: str = Field(default="function", description="Type of the tool call")
     name: str = Field(None, description="Name of the tool selected by the language model")
     arguments: Dict[str, Any] = Field(None, description="Arguments extracted for the selected tool")
+    error: Optional[str] = Field(None, description="Why the arguments could not be parsed, None for valid calls")
 
-    def save(self, tool_call: List[ChatCompletionMessageToolCall]) -> Self:
+    @classmethod
+    def from_raw(cls, id: str, name: str, arguments: Optional[str]) -> "ToolCall":
+        """Builds a tool call from its JSON encoded arguments.
+
+        Malformed arguments do not raise: the call keeps empty arguments and the
+        parsing error, which is returned to the model instead of executing the tool.
+        """
+        try:
+            parsed = json.loads(arguments or "{}")
+            error = None if isinstance(parsed, dict) else f"arguments must be a JSON object, got {type(parsed).__name__}"
+        except json.JSONDecodeError as e:
+            parsed, error = {}, f"arguments are not valid JSON ({e})"
+
+        return cls(id=id, name=name, arguments=parsed if error is None else {}, error=error)
+
+    def save(self, tool_call: ChatCompletionMessageToolCall) -> Self:
         """Saves a received tool call response from a language model.
         
         Converts a ChatCompletionMessageToolCall object to a ToolCall object
@@ -155,12 +475,29 @@ class ToolCall(BaseModel):
         Args:
             tool_call: ChatCompletions API default response for tool calling
         """
-        self.id = tool_call[0].id
-        self.name = tool_call[0].function.name
-        self.arguments = json.loads(tool_call[0].function.arguments) # Parse arguments
+        parsed = self.from_raw(tool_call.id, tool_call.function.name, tool_call.function.arguments)
+        self.id = parsed.id
+        self.name = parsed.name
+        self.arguments = parsed.arguments
+        self.error = parsed.error
 
         return self
 
+    @classmethod
+    def from_response(cls, tool_calls: List[ChatCompletionMessageToolCall]) -> List["ToolCall"]:
+        """Converts every tool call returned by a language model.
+
+        Models may request several independent tool calls in a single response,
+        all of them are kept in the order they were returned.
+
+        Args:
+            tool_calls: ChatCompletions API default response for tool calling
+
+        Returns:
+            A list of ToolCall objects
+        """
+        return [cls().save(tool_call) for tool_call in tool_calls]
+
     def to_dict(self) -> Dict:
         """Returns ToolCall as a dict"""
         tool_call_obj = {
@@ -168,7 +505,7 @@ class ToolCall(BaseModel):
             "type": self.type,
             "function": {
                 "name": self.name,
-                "arguments": json.dumps(self.arguments)
+                "arguments": json.dumps(self.arguments, sort_keys=True, separators=(",", ":")) # canonical, for stable prompts
             }
         }
 
@@ -179,6 +516,74 @@ class ToolCall(BaseModel):
         self.id = None
         self.name = None
         self.arguments = {}
+        self.error = None
+
+class StreamEventType(str, Enum):
+    """Enum type class for the kind of event yielded by a streamed completion"""
+    CONTENT = "content"
+    TOOL_CALL = "tool_call"
+    DONE = "done"
+
+class StreamEvent(BaseModel):
+    """Class for representing a single event of a streamed completion.
+
+    Content events carry a text delta, tool call events carry a fully assembled
+    tool call and the done event closes the stream with the complete answer.
+    """
+    type: StreamEventType = Field(..., description="Kind of the stream event")
+    content: Optional[str] = Field(None, description="Text delta, or the full text for the done event")
+    tool_call: Optional[ToolCall] = Field(None, description="Completed tool call")
+    time_to_first_token: Optional[float] = Field(None, description="Seconds until the first delta arrived, set on the done event")
+
+class RunBudget(BaseModel):
+    """Limits of a single agent run, None disables a limit.
+
+    The deadline and cancellation abort the in-flight LLM and tool calls. Token
+    and cost budgets are checked between steps, so the step exceeding them
+    completes. A run stopped by a limit, including an LLM call timing out,
+    returns its partial result.
+    """
+    timeout: Optional[float] = Field(default=None, description="Seconds the whole run may take")
+    max_tokens: Optional[int] = Field(default=None, description="Max prompt and completion tokens of the run")
+    max_cost: Optional[float] = Field(default=None, description="Max cost of the run, priced with the LLM settings")
+    llm_timeout: Optional[float] = Field(default=None, description="Seconds a single LLM call may take. When streaming, seconds until the response starts and between two chunks")
+    tool_timeout: Optional[float] = Field(default=None, description="Seconds a single tool call may take, a timed out call is reported to the model")
+
+class RunContext(BaseModel):
+    """Class holding the state of a single agent run.
+
+    Agents keep only their definition (model, toolbox, prompts); everything that
+    changes while a request is processed lives here, so one agent can serve many
+    concurrent runs.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True) # allow non pydantic classes
+
+    run_id: str = Field(default_factory=lambda: uuid4().hex, description="Unique identifier of the run")
+    memory: Memory = Field(default_factory=Memory, description="Run memory")
+    state: AgentState = Field(default=AgentState.IDLE, description="Current run state")
+    current_step: int = Field(default=0, description="Current step in execution")
+    tool_calls: List[ToolCall] = Field(default_factory=list, description="Tool calls requested by the model in the last reflection")
+    tool_tasks: Dict[str, Any] = Field(default_factory=dict, exclude=True, description="Tool executions already started, by tool call id")
+    results: List[str] = Field(default_factory=list, description="Result of every executed step")
+    artifacts: Dict[str, Any] = Field(default_factory=dict, description="Values shared between the steps of the run, such as sub-agent results")
+    ledger: Dict[str, str] = Field(default_factory=dict, description="Result of every successful call to a reusable tool in the run, by tool name and canonical arguments")
+    repeated_calls: Set[str] = Field(default_factory=set, description="Ids of the tool calls answered from the ledger")
+    failed_calls: Set[str] = Field(default_factory=set, description="Ids of the tool calls rejected, timed out or failed, their result is an error message")
+    call_history: List[Tuple[str, ...]] = Field(default_factory=list, description="Canonical tool calls requested at every acting step, to spot loops")
+    stalled_steps: int = Field(default=0, description="Consecutive acting steps without progress")
+    metrics: RunMetrics = Field(default_factory=RunMetrics, description="Metrics of the run, updated as spans finish")
+    checkpoint: Optional[Any] = Field(default=None, exclude=True, description="Checkpoint log of the run, when checkpointing is enabled")
+    budget: RunBudget = Field(default_factory=RunBudget, description="Limits of the run")
+    stop_reason: Optional[StopReason] = Field(default=None, description="Why the run stopped before answering")
+    task: Optional[Any] = Field(default=None, exclude=True, description="Task executing the steps, cancelled to stop the run")
+
+class RunResult(BaseModel):
+    """Class for representing the outcome of an agent run"""
+    run_id: str = Field(..., description="Unique identifier of the run")
+    results: List[str] = Field(default_factory=list, description="Result of every executed step")
+    answer: Optional[str] = Field(None, description="Last assistant message of the run")
+    metrics: RunMetrics = Field(default_factory=RunMetrics, description="Timing, token and payload summary of the run")
+    stop_reason: Optional[StopReason] = Field(None, description="Why the run stopped before answering, None when it answered")
 
 if __name__ =="__main__":
 
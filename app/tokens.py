@@ -0,0 +1,33 @@
+import json
+from typing import Dict, Any, List
+
+# Rough average of characters per token for English text on GPT/Llama tokenizers
+CHARS_PER_TOKEN = 4
+
+# Tokens added by the chat format around every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text without a tokenizer"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """Estimates the number of prompt tokens of a message in OpenAI format.
+
+    Args:
+        message: Serialized message, as returned by Message.to_dict()
+
+    Returns:
+        Approximate token count, including the chat format overhead
+    """
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    if message.get("content"):
+        tokens += estimate_tokens(message["content"])
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"]))
+
+    return tokens
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimates the number of prompt tokens of a list of messages in OpenAI format"""
+    return sum(estimate_message_tokens(message) for message in messages)
@@ -1,6 +1,6 @@
 from app.tools.base import Tool
 
-@Tool.as_tool
+@Tool.as_tool(max_concurrency=1, pinned=True)
 def ask_user(question: str) -> str:
     """Ask the user a question
     
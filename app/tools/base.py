@@ -1,57 +1,205 @@
-from typing import Callable, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any, List, Tuple, Type, get_type_hints
+import asyncio
 import functools
+import inspect
+import json
+import re
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, create_model
+
+# internal packages
+from app.cache import ResponseCache, CacheStats, make_key
+from app.cassette import active_cassette
+from app.config import PROJECT_ROOT
+from app.loops import LoopLocal
+
+# Shared pool running synchronous tools outside of the event loop
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tool")
+
+# Sections of Google style docstrings ending the parameter descriptions
+DOCSTRING_SECTIONS = ("args:", "arguments:", "parameters:", "returns:", "return:", "raises:", "yields:", "example:", "examples:")
+
+class ToolArgumentError(ValueError):
+    """Raised when a model calls a tool with invalid arguments"""
+
+def parse_docstring(docstring: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """Splits a Google style docstring into its summary and parameter descriptions.
+
+    Args:
+        docstring: Function docstring
+
+    Returns:
+        The text before the first section and the description of every
+        parameter listed under `Args:`
+    """
+    summary: List[str] = []
+    params: Dict[str, str] = {}
+    section = None
+    current = None
+
+    for line in inspect.cleandoc(docstring or "").splitlines():
+        stripped = line.strip()
+        if stripped.lower() in DOCSTRING_SECTIONS:
+            section = stripped.lower()
+            current = None
+        elif section is None:
+            summary.append(line)
+        elif section in ("args:", "arguments:", "parameters:") and stripped:
+            match = re.match(r"^(\*{0,2}\w+)\s*(\([^)]*\))?\s*:\s*(.*)$", stripped)
+            if match:
+                current = match.group(1).lstrip("*")
+                params[current] = match.group(3)
+            elif current:
+                params[current] = f"{params[current]} {stripped}".strip()
+
+    return "\n".join(summary).strip(), params
+
+def clean_schema(schema: Any, strict: bool, root: bool = True) -> Any:
+    """Prepares a pydantic JSON schema for function calling.
+
+    Titles are dropped. In strict mode every object lists all its properties as
+    required and defaults are moved to the descriptions, as required by OpenAI
+    structured outputs. Optional parameters of the root object become nullable,
+    null standing for their default (see `Tool.validate`); fields of nested
+    models keep their type, their validators do not accept null for a default.
+    """
+    if isinstance(schema, list):
+        return [clean_schema(item, strict, False) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    cleaned = {}
+    for key, value in schema.items():
+        if key == "title" and isinstance(value, str):
+            continue
+        if key == "default" and strict:
+            continue
+        if key in ("properties", "$defs"):
+            cleaned[key] = {name: clean_schema(item, strict, False) for name, item in value.items()}
+        else:
+            cleaned[key] = clean_schema(value, strict, False)
+
+    if strict and schema.get("default") is not None:
+        cleaned["description"] = f"{cleaned.get('description', '')} (default: {json.dumps(schema['default'], default=str)})".strip()
+
+    if strict and "properties" in cleaned:
+        required = set(cleaned.get("required", []))
+        for name, item in cleaned["properties"].items():
+            if root and name not in required and not is_nullable(item):
+                description = item.pop("description", None)
+                cleaned["properties"][name] = {"anyOf": [item, {"type": "null"}], **({"description": description} if description else {})}
+        cleaned["required"] = list(cleaned["properties"])
+        cleaned["additionalProperties"] = False
+
+    return cleaned
+
+def canonical_schema(schema: Any) -> Any:
+    """Sorts the keys of a JSON schema so it always serializes to the same bytes.
+
+    Properties keep the order of the function parameters.
+    """
+    if isinstance(schema, list):
+        return [canonical_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    return {
+        key: ({name: canonical_schema(item) for name, item in schema[key].items()} if key in ("properties", "$defs") else canonical_schema(schema[key]))
+        for key in sorted(schema)
+    }
+
+def is_nullable(schema: Dict[str, Any]) -> bool:
+    """Checks if a JSON schema accepts null"""
+    types = schema.get("type")
+    return types == "null" or (isinstance(types, list) and "null" in types) or any(is_nullable(item) for item in schema.get("anyOf", []))
 
 class Tool:
     """
     Converts Python functions into OpenAI function-callable format.
     """
-    def __init__(self, func: Callable, name: Optional[str] = None, description: Optional[str] = None, strict: bool = True):
+    def __init__(self, 
+                 func: Callable, 
+                 name: Optional[str] = None, 
+                 description: Optional[str] = None, 
+                 strict: bool = True,
+                 max_concurrency: Optional[int] = None,
+                 cache: bool = False,
+                 cache_ttl: Optional[float] = None,
+                 cache_max_entries: int = 256,
+                 cache_persistent: bool = False,
+                 pinned: bool = False,
+                 reusable: bool = False):
         self.func = func
         self.name = name or func.__name__
-        self.description = description or (func.__doc__.strip() if func.__doc__ else "")
+        self.description = description # defaults to the docstring summary, set when compiling
         self.strict = strict
-        self.tool_metadata = self._extract_metadata()
+        self.is_async = inspect.iscoroutinefunction(func)
+        self.max_concurrency = max_concurrency
+        self.pinned = pinned # always offered to the model when the toolbox is filtered
+        self.reusable = reusable or cache # repeated calls of a run may be answered with the first result
+        self.signature = inspect.signature(func)
+
+        # Schema sent to the model and validator of its calls, compiled once
+        self.validator: Type[BaseModel] = None
+        self.tool_metadata: Dict[str, Any] = {}
+        self._compile()
+
+        # Memoizes results of deterministic or idempotent tools
+        self.cache = ResponseCache(
+            max_entries=cache_max_entries,
+            ttl=cache_ttl,
+            persistent=cache_persistent,
+            path=PROJECT_ROOT / "cache" / "tools" / f"{self.name}.sqlite",
+        ) if cache else None
+
+        # Limits simultaneous executions of this tool, one semaphore per event loop
+        self._semaphores: Optional[LoopLocal[asyncio.Semaphore]] = LoopLocal(lambda: asyncio.Semaphore(max_concurrency)) if max_concurrency is not None else None
 
         # Preserve function attributes
         functools.update_wrapper(self, func)
 
-    def _extract_metadata(self) -> Dict[str, Any]:
-        """Extract function metadata to match OpenAI's function-calling format."""
-        parameters = {
-            "type": "object",
-            "properties": {},
-            "required": [],
-            "additionalProperties": False
-        }
+    def _compile(self) -> None:
+        """Compiles the tool schema and argument validator from the function signature.
 
-        annotations = self.func.__annotations__
-        python_to_json_type = {
-            "int": "integer",
-            "float": "number",
-            "bool": "boolean",
-            "str": "string",
-        }
+        Parameters are typed with their full type hints (Optional, Literal, lists,
+        nested pydantic models...), untyped parameters take the type of their
+        default and fall back to strings. Descriptions come from the `Args:`
+        section of the docstring.
+        """
+        summary, param_docs = parse_docstring(self.func.__doc__)
+        self.description = self.description or summary
 
-        for param, param_type in annotations.items():
-            if param == 'return':
+        hints = get_type_hints(self.func, include_extras=True)
+        fields = {}
+        for param in self.signature.parameters.values():
+            if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
                 continue
 
-            param_info = {"type": "string"}  # Default
+            annotation = hints.get(param.name)
+            if annotation is None:
+                annotation = type(param.default) if param.default not in (param.empty, None) else str
+            if annotation is list:
+                annotation = List[str] # items must be typed, bare lists hold strings
 
-            origin = getattr(param_type, "__origin__", None)
-            if origin is list:
-                param_info = {"type": "array", "items": {"type": "string"}}
-            elif origin is dict:
-                param_info = {"type": "object"}
-            elif isinstance(param_type, type):
-                json_type = python_to_json_type.get(param_type.__name__)
-                if json_type:
-                    param_info = {"type": json_type}
+            if param.default is param.empty:
+                fields[param.name] = (annotation, Field(description=param_docs.get(param.name)))
+            else:
+                # Strict schemas require every parameter: null stands for the default
+                annotation = Optional[annotation] if self.strict else annotation
+                fields[param.name] = (annotation, Field(default=param.default, description=param_docs.get(param.name)))
 
-            parameters["properties"][param] = param_info
-            parameters["required"].append(param)
+        self.validator = create_model(
+            f"{self.name}_arguments",
+            __config__=ConfigDict(extra="forbid", arbitrary_types_allowed=True),
+            **fields,
+        )
 
-        return {
+        parameters = clean_schema(self.validator.model_json_schema(), self.strict)
+        parameters.setdefault("required", [])
+        parameters["additionalProperties"] = False
+
+        self.tool_metadata = canonical_schema({
             "type": "function",
             "function": {
                 "name": self.name,
@@ -59,26 +207,145 @@ class Tool:
                 "parameters": parameters,
                 "strict": self.strict
             }
-        }
+        })
+
+    def validate(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Validates and converts the arguments of a call.
+
+        Args:
+            arguments: Arguments sent by the model
+
+        Returns:
+            Keyword arguments for the function, nulls are replaced by the defaults
 
+        Raises:
+            ToolArgumentError: With every invalid argument and the reason
+        """
+        try:
+            validated = self.validator.model_validate(arguments or {})
+        except ValidationError as e:
+            problems = "; ".join(
+                f"{'.'.join(str(loc) for loc in error['loc']) or 'arguments'}: {error['msg']}"
+                + (f" (got {error['input']!r})" if error["type"] not in ("missing", "extra_forbidden") else "")
+                for error in e.errors()
+            )
+            raise ToolArgumentError(f"Invalid arguments for tool '{self.name}': {problems}") from None
+
+        kwargs = {}
+        for name in self.validator.model_fields:
+            value = getattr(validated, name)
+            default = self.signature.parameters[name].default
+            kwargs[name] = default if value is None and default is not inspect.Parameter.empty else value
+        return kwargs
     
     def __call__(self, *args, **kwargs):
         """Execute the wrapped function."""
         return self.func(*args, **kwargs)
 
+    @property
+    def cache_stats(self) -> Optional[CacheStats]:
+        """Cache hits, misses and evictions of this tool, None when caching is disabled"""
+        return self.cache.stats if self.cache is not None else None
+
+    def cache_key(self, **kwargs) -> str:
+        """Content address of a call, arguments are bound to the signature with defaults applied"""
+        bound = self.signature.bind(**kwargs)
+        bound.apply_defaults()
+        return make_key(self.name, bound.arguments)
+
+    async def invoke(self, **kwargs) -> Any:
+        """Execute the tool without blocking the event loop.
+
+        Coroutine functions are awaited directly, synchronous functions run in
+        the shared tool thread pool. When `max_concurrency` is set, at most that
+        many executions of this tool run at the same time in an event loop. Cached tools answer
+        repeated calls with the same arguments from their cache. Inside
+        `use_cassette` the result is recorded, or replayed without executing the tool.
+
+        Args:
+            kwargs: Arguments for the wrapped function, validated first
+
+        Returns:
+            The wrapped function result
+
+        Raises:
+            ToolArgumentError: If the arguments do not match the tool schema
+        """
+        kwargs = self.validate(kwargs)
+        cassette = active_cassette()
+        if cassette is not None:
+            return await cassette.tool_call(self.cache_key(**kwargs), lambda: self._cached(**kwargs))
+
+        return await self._cached(**kwargs)
+
+    async def _cached(self, **kwargs) -> Any:
+        """Answers from the tool cache when enabled, executes the function otherwise"""
+        if self.cache is not None:
+            return await self.cache.get_or_compute(self.cache_key(**kwargs), lambda: self._limited(**kwargs))
+
+        return await self._limited(**kwargs)
+
+    async def _limited(self, **kwargs) -> Any:
+        """Executes the function within the tool concurrency limit"""
+        if self._semaphores is None:
+            return await self._execute(**kwargs)
+
+        async with self._semaphores.get():
+            return await self._execute(**kwargs)
+
+    async def _execute(self, **kwargs) -> Any:
+        """Awaits or off-loads the wrapped function"""
+        if self.is_async:
+            return await self.func(**kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(TOOL_EXECUTOR, functools.partial(self.func, **kwargs))
+
     @staticmethod
-    def as_tool(func: Callable = None, *, name: Optional[str] = None, description: Optional[str] = None, strict: bool = True) -> "Tool":
+    def as_tool(func: Callable = None, 
+                *, 
+                name: Optional[str] = None, 
+                description: Optional[str] = None, 
+                strict: bool = True,
+                max_concurrency: Optional[int] = None,
+                cache: bool = False,
+                cache_ttl: Optional[float] = None,
+                cache_max_entries: int = 256,
+                cache_persistent: bool = False,
+                pinned: bool = False,
+                reusable: bool = False) -> "Tool":
         """
         Converts a function into a Tool instance.
         Can be used as:
         
         - `@as_tool`
         - `as_tool(func)`
+        - `@as_tool(max_concurrency=4)`
+        - `@as_tool(cache=True, cache_ttl=3600, cache_persistent=True)`
+        - `@as_tool(pinned=True)`, always offered when agents select their tools
+        - `@as_tool(reusable=True)`, repeated calls of a run are answered with the first result
+
+        Only enable the cache for deterministic or idempotent tools, results must be
+        JSON serializable when the persistent backend is used. Cached tools are
+        reusable; never mark as reusable a tool whose answer may change within a
+        run, such as asking the user.
         """
+        options = {
+            "name": name,
+            "description": description,
+            "strict": strict,
+            "max_concurrency": max_concurrency,
+            "cache": cache,
+            "cache_ttl": cache_ttl,
+            "cache_max_entries": cache_max_entries,
+            "cache_persistent": cache_persistent,
+            "pinned": pinned,
+            "reusable": reusable,
+        }
         if func is None:
-            return lambda f: Tool.as_tool(f, name=name, description=description, strict=strict)
+            return lambda f: Tool.as_tool(f, **options)
 
         if not callable(func):
             raise TypeError(f"Expected a function, but got {type(func)}")
 
-        return Tool(func, name, description, strict)
\ No newline at end of file
+        return Tool(func, **options)
\ No newline at end of file
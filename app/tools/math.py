@@ -1,6 +1,6 @@
 from app.tools.base import Tool
 
-@Tool.as_tool
+@Tool.as_tool(reusable=True)
 def multiply(a: float, b: float) -> float:
     """Mutiply two numbers
     
@@ -13,7 +13,7 @@ def multiply(a: float, b: float) -> float:
     """
     return a*b
 
-@Tool.as_tool
+@Tool.as_tool(reusable=True)
 def divide(a: float, b: float) -> float:
     """Divide two numbers
     
@@ -0,0 +1,104 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+# internal packages
+from app.tools.base import Tool
+
+# Frequent words carrying no information about the tool needed
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i in is it its me my of on or please
+the this to was what when where which who why will with you your
+""".split())
+
+# Suffixes stripped so inflections match, e.g. "divided" and "divide"
+SUFFIXES = ("ing", "ed", "es", "e", "s")
+
+def stem(token: str) -> str:
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+def tokenize(text: str) -> List[str]:
+    """Stemmed lowercase words without stopwords, snake_case and camelCase names are split into words"""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text or "")
+    return [stem(token) for token in re.split(r"[^a-z0-9]+", text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+def tool_document(tool: Tool) -> List[str]:
+    """Tokens describing a tool: name (weighted twice), description and parameters"""
+    function = tool.tool_metadata["function"]
+    parts = [tool.name, tool.name, function.get("description", "")]
+    for name, schema in function["parameters"].get("properties", {}).items():
+        parts += [name, schema.get("description", "")]
+    return tokenize(" ".join(parts))
+
+class ToolIndex:
+    """BM25 index over the names, descriptions and parameters of a toolbox.
+
+    Built once for a toolbox, it selects the tools relevant to a query so only
+    their schemas are sent with the request. Pinned tools are always selected.
+    The selection keeps the toolbox order; requests list the tools pinned first
+    and then by name (see `LLM.tools_payload`), so they stay stable whatever the
+    selection.
+
+    Example:
+        >>> index = ToolIndex(tools)
+        >>> index.select("divide 8 by 2", top_k=3)
+    """
+    def __init__(self, tools: Sequence[Tool], k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            tools: Indexed toolbox
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+        """
+        self.tools = list(tools)
+        self.k1 = k1
+        self.b = b
+
+        self._frequencies = [Counter(tool_document(tool)) for tool in self.tools]
+        self._lengths = [sum(frequencies.values()) for frequencies in self._frequencies]
+        self._average_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+        documents = Counter(term for frequencies in self._frequencies for term in frequencies)
+        self._idf: Dict[str, float] = {
+            term: math.log(1 + (len(self.tools) - count + 0.5) / (count + 0.5))
+            for term, count in documents.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every tool for the query"""
+        terms = Counter(tokenize(query))
+        scores = []
+        for frequencies, length in zip(self._frequencies, self._lengths):
+            score = 0.0
+            for term, query_count in terms.items():
+                frequency = frequencies.get(term)
+                if frequency:
+                    norm = frequency + self.k1 * (1 - self.b + self.b * length / self._average_length)
+                    score += query_count * self._idf[term] * frequency * (self.k1 + 1) / norm
+            scores.append(score)
+        return scores
+
+    def select(self, query: str, top_k: int, pinned: Optional[Sequence[str]] = None) -> List[Tool]:
+        """Selects the pinned tools and the `top_k` best matching other tools.
+
+        Tools not matching any query term are never selected, unless pinned.
+
+        Args:
+            query: Text describing the current need, usually the recent conversation
+            top_k: Max tools selected besides the pinned ones
+            pinned: (Optional) Names of tools always selected, added to the tools created with `pinned=True`
+
+        Returns:
+            Selected tools, in toolbox order (requests reorder them, see `LLM.tools_payload`)
+        """
+        pinned = set(pinned or ())
+        scores = self.scores(query)
+
+        candidates = [i for i, tool in enumerate(self.tools) if not (tool.pinned or tool.name in pinned) and scores[i] > 0]
+        best = set(sorted(candidates, key=lambda i: -scores[i])[:top_k])
+
+        return [tool for i, tool in enumerate(self.tools) if tool.pinned or tool.name in pinned or i in best]
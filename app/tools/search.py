@@ -1,19 +1,154 @@
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import urlsplit, urlunsplit
+
 from duckduckgo_search import DDGS
 
-from app.tools.base import Tool
+# internal packages
+from app.cache import ResponseCache, make_key
+from app.logger import logger
+from app.loops import LoopLocal
+from app.tools.base import Tool, TOOL_EXECUTOR
+
+# DuckDuckGo sessions, one per tool thread: a session is reused across calls but never shared between threads
+_sessions = threading.local()
+
+def get_ddgs_session() -> DDGS:
+    """Returns the DuckDuckGo session of the current thread, created once and kept open"""
+    session = getattr(_sessions, "ddgs", None)
+    if session is None:
+        session = _sessions.ddgs = DDGS()
+    return session
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for deduplication: no fragment, no trailing slash, lowercase scheme and host"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), parts.query, ""))
+
+def shorten(text: str, max_chars: int) -> str:
+    """Collapses the whitespace of a text and truncates it to `max_chars`, ending with "..." when cut"""
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+def compact_results(results: Dict[str, List[Dict[str, Any]]], max_chars: int, snippet_chars: int) -> str:
+    """Renders the results of several queries as compact text within a character budget.
+
+    Results are deduplicated by URL across queries and picked round-robin, best
+    ranked first, so every query keeps its top results when the budget is tight.
+    They are rendered grouped by query, in rank order.
 
-@Tool.as_tool
-def search_duckduckgo(query: str, num_results=10):
+    Args:
+        results: Search results (title, href, body) of every query
+        max_chars: Max size of the text
+        snippet_chars: Max size of a single result snippet
+
+    Returns:
+        One block per query, one line per result. Queries whose results were
+        all dropped by the budget say so, instead of reporting no results
     """
-    Perform a DuckDuckGo search and return results.
-    
+    lines = {query: [] for query in results}
+    omitted = {query: False for query in results}
+    seen = set()
+    used = sum(len(f'Results for "{query}":\n') for query in results)
+
+    for rank in range(max((len(items) for items in results.values()), default=0)):
+        for query, items in results.items():
+            if rank >= len(items):
+                continue
+            url = items[rank].get("href") or ""
+            key = normalize_url(url)
+            if not url or key in seen:
+                continue
+
+            line = f"- {shorten(items[rank].get('title', ''), 120)} ({url}): {shorten(items[rank].get('body', ''), snippet_chars)}"
+            if used + len(line) + 1 > max_chars:
+                omitted[query] = True
+                continue # a shorter result of another query may still fit
+            seen.add(key)
+            lines[query].append(line)
+            used += len(line) + 1
+
+    blocks = []
+    for query, query_lines in lines.items():
+        if not query_lines:
+            query_lines = ["(omitted: character budget)" if omitted[query] else "- no results"]
+        blocks.append(f'Results for "{query}":\n' + "\n".join(query_lines))
+    return "\n".join(blocks)
+
+def duckduckgo_search_tool(name: str = "search_duckduckgo",
+                           max_chars: int = 4000,
+                           snippet_chars: int = 300,
+                           max_results: int = 10,
+                           max_concurrency: int = 4,
+                           cache_ttl: Optional[float] = 3600) -> Tool:
+    """Builds a DuckDuckGo search tool answering several queries per call.
+
+    The queries of a call are searched concurrently, on DuckDuckGo sessions kept
+    open across calls. Results of every query are cached, so queries repeated by
+    other calls or agents are answered without searching again. The results are
+    deduplicated by URL and trimmed to `max_chars` before reaching the model.
+
     Args:
-        query: Search query string.
-        num_results: Number of search results to return.
+        name: Tool name
+        max_chars: Max size of the text returned to the model
+        snippet_chars: Max size of a single result snippet
+        max_results: Max results per query the model may request
+        max_concurrency: Max queries searched at the same time, over every call of an event loop
+        cache_ttl: (Optional) Seconds results are reused, never expiring when None
+
+    Returns:
+        A Tool named `name`
 
-    Returns: 
-        List of search results with title, link, and snippet.
+    Example:
+        >>> search = duckduckgo_search_tool(max_chars=2000)
+        >>> agent = ToolAgent(name="researcher", model=llm, toolbox=[search])
     """
-    with DDGS() as ddgs:
-        results = ddgs.text(query, max_results=num_results)
-    return list(results)
\ No newline at end of file
+    cache = ResponseCache(max_entries=512, ttl=cache_ttl)
+    semaphores = LoopLocal(lambda: asyncio.Semaphore(max_concurrency))
+
+    def search_one(query: str, num_results: int) -> List[Dict[str, Any]]:
+        return list(get_ddgs_session().text(query, max_results=num_results) or [])
+
+    async def search(query: str, num_results: int) -> List[Dict[str, Any]]:
+        async with semaphores.get():
+            return await asyncio.get_running_loop().run_in_executor(TOOL_EXECUTOR, search_one, query, num_results)
+
+    async def search_duckduckgo(queries: Union[List[str], str], num_results: int = 5) -> str:
+        """Searches the web with DuckDuckGo, several queries at once.
+
+        Args:
+            queries: Search queries, all searched at the same time. Put every query needed in a single call
+            num_results: Results per query
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        num_results = max(1, min(num_results, max_results))
+        unique = list(dict.fromkeys(query.strip() for query in queries if query.strip()))
+        if not unique:
+            return "No query to search"
+
+        outcomes = await asyncio.gather(
+            *(cache.get_or_compute(make_key(name, query, num_results), lambda query=query: search(query, num_results)) for query in unique),
+            return_exceptions=True,
+        )
+
+        results, failures = {}, {}
+        for query, outcome in zip(unique, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.warning(f"Search failed for '{query}': {outcome}")
+                failures[query] = outcome
+            else:
+                results[query] = outcome
+        if not results:
+            raise RuntimeError(f"Every search failed, last error: {failures[unique[-1]]}")
+
+        text = compact_results(results, max_chars, snippet_chars)
+        for query, error in failures.items():
+            text += f'\nResults for "{query}":\n- search failed ({type(error).__name__}), try again later or rephrase'
+        return text
+
+    return Tool(search_duckduckgo, name=name, reusable=True)
+
+# Default search tool
+search_duckduckgo = duckduckgo_search_tool()
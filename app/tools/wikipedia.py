@@ -1,7 +1,22 @@
+import threading
+from typing import Dict
+
 import wikipediaapi
 from app.tools.base import Tool
 
-@Tool.as_tool
+# Wikipedia clients by language, one set per tool thread: their HTTP sessions are never shared between threads
+_clients = threading.local()
+
+def get_wikipedia_client(lang: str = "en") -> wikipediaapi.Wikipedia:
+    """Returns the Wikipedia client of the current thread for the language, created once and reused"""
+    clients: Dict[str, wikipediaapi.Wikipedia] = getattr(_clients, "by_lang", None)
+    if clients is None:
+        clients = _clients.by_lang = {}
+    if lang not in clients:
+        clients[lang] = wikipediaapi.Wikipedia(user_agent="mars-agent", language=lang)
+    return clients[lang]
+
+@Tool.as_tool(cache=True, cache_ttl=24 * 3600, cache_max_entries=1024, cache_persistent=True)
 def get_wikipedia_summary(topic: str, lang: str = "en") -> str:
     """Fetches the summary of a Wikipedia page.
     
@@ -12,7 +27,7 @@ def get_wikipedia_summary(topic: str, lang: str = "en") -> str:
     Returns:
         str: The summary of the Wikipedia page or an error message.
     """
-    wiki = wikipediaapi.Wikipedia(user_agent="mars-agent")
+    wiki = get_wikipedia_client(lang)
     page = wiki.page(topic)
 
     if not page.exists():
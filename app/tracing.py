@@ -0,0 +1,273 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, ClassVar, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+# internal packages
+from app.logger import logger
+
+class SpanKind(str, Enum):
+    """Enum type class for the traced operations"""
+    RUN = "run"
+    STEP = "step"
+    LLM = "llm"
+    REQUEST = "request"
+    TOOL = "tool"
+
+class RunMetrics(BaseModel):
+    """Summary of the work done by an agent run"""
+    wall_time: float = Field(default=0.0, description="Seconds taken by the run")
+    steps: int = Field(default=0, description="Executed steps")
+    llm_calls: int = Field(default=0, description="Completion requests sent to providers")
+    cached_responses: int = Field(default=0, description="Completions answered by the response cache")
+    tool_calls: int = Field(default=0, description="Executed tool calls")
+    llm_time: float = Field(default=0.0, description="Seconds spent waiting for completions")
+    tool_time: float = Field(default=0.0, description="Seconds spent executing tools, summed over parallel calls")
+    queue_time: float = Field(default=0.0, description="Seconds requests waited in the rate limit scheduler")
+    prompt_tokens: int = Field(default=0, description="Prompt tokens reported by providers")
+    completion_tokens: int = Field(default=0, description="Completion tokens reported by providers")
+    cached_tokens: int = Field(default=0, description="Prompt tokens served from the provider prompt cache")
+    cached_requests: int = Field(default=0, description="Completions whose prompt was partly served from the provider prompt cache")
+    cost: float = Field(default=0.0, description="Cost of the completions, priced with the LLM settings")
+    request_bytes: int = Field(default=0, description="Size of the serialized requests")
+    response_bytes: int = Field(default=0, description="Size of the received answers and tool calls")
+    subagent_steps: int = Field(default=0, description="Steps executed by nested runs, such as sub-agent runs")
+    subagent_llm_calls: int = Field(default=0, description="Completion requests sent by nested runs")
+    subagent_tool_calls: int = Field(default=0, description="Tool calls executed by nested runs")
+
+    # Spend of a nested run counted in its parent run, so the parent budgets cover it
+    NESTED_SPEND: ClassVar[Tuple[str, ...]] = ("prompt_tokens", "completion_tokens", "cached_tokens", "cached_requests", "cost", "request_bytes", "response_bytes")
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def prompt_cache_hit_rate(self) -> float:
+        """Fraction of the prompt tokens served from the provider prompt cache"""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def add(self, other: "RunMetrics") -> None:
+        """Adds the metrics of a nested run, such as a sub-agent run.
+
+        Its tokens, cost and bytes are summed with the run's own. Its steps, LLM
+        and tool calls go to the `subagent_*` counts, so the run's counts only
+        describe its own work. Its times are already part of the tool call that
+        started it.
+        """
+        for name in self.NESTED_SPEND:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.subagent_steps += other.steps + other.subagent_steps
+        self.subagent_llm_calls += other.llm_calls + other.subagent_llm_calls
+        self.subagent_tool_calls += other.tool_calls + other.subagent_tool_calls
+
+    def record(self, span: "Span") -> None:
+        """Adds a finished span to the summary"""
+        attributes = span.attributes
+        if span.kind == SpanKind.STEP:
+            self.steps += 1
+        elif span.kind == SpanKind.LLM:
+            self.llm_time += span.duration
+            self.cached_responses += 1 if attributes.get("cache_hit") else 0
+        elif span.kind == SpanKind.REQUEST:
+            self.llm_calls += 1
+            self.queue_time += attributes.get("queue_time", 0.0)
+        elif span.kind == SpanKind.TOOL:
+            self.tool_calls += 1
+            self.tool_time += span.duration
+
+        self.prompt_tokens += attributes.get("prompt_tokens", 0)
+        self.completion_tokens += attributes.get("completion_tokens", 0)
+        self.cached_tokens += attributes.get("cached_tokens", 0)
+        self.cached_requests += 1 if attributes.get("cached_tokens") else 0
+        self.cost += attributes.get("cost", 0.0)
+        self.request_bytes += attributes.get("request_bytes", 0)
+        self.response_bytes += attributes.get("response_bytes", 0)
+
+class Span:
+    """A timed operation of an agent run.
+
+    Spans form a tree: run -> step -> LLM call / tool call. Every finished span is
+    added to the metrics of its run and sent to the tracer hooks.
+    """
+    __slots__ = ("trace_id", "span_id", "parent", "name", "kind", "attributes", "status", "error",
+                 "start_time", "end_time", "_started_at", "_duration", "metrics")
+
+    def __init__(self, name: str, kind: SpanKind, parent: Optional["Span"] = None, trace_id: Optional[str] = None, **attributes: Any):
+        self.trace_id = trace_id or (parent.trace_id if parent else uuid4().hex)
+        self.span_id = uuid4().hex[:16]
+        self.parent = parent
+        self.name = name
+        self.kind = kind
+        self.attributes: Dict[str, Any] = attributes
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self._started_at = time.perf_counter()
+        self._duration: Optional[float] = None
+        self.metrics = RunMetrics() if kind == SpanKind.RUN else None
+
+    @property
+    def duration(self) -> float:
+        """Seconds since the span started, final once it ended"""
+        return self._duration if self._duration is not None else time.perf_counter() - self._started_at
+
+    @property
+    def run(self) -> Optional["Span"]:
+        """The run span this span belongs to"""
+        span = self
+        while span is not None and span.kind != SpanKind.RUN:
+            span = span.parent
+        return span
+
+    def set(self, **attributes: Any) -> None:
+        """Adds attributes to the span"""
+        self.attributes.update(attributes)
+
+    def fail(self, error: BaseException) -> None:
+        """Marks the span as failed"""
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the span as a flat dict, one JSON line per span"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "kind": self.kind.value,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Returns the span in OpenTelemetry OTLP/JSON span format"""
+        def value(v: Any) -> Dict[str, Any]:
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": v if isinstance(v, str) else json.dumps(v, default=str)}
+
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1, # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int(self.start_time * 1e9)),
+            "endTimeUnixNano": str(int((self.end_time or time.time()) * 1e9)),
+            "attributes": [{"key": key, "value": value(v)} for key, v in {"mars.kind": self.kind.value, **self.attributes}.items()],
+            "status": {"code": 2, "message": self.error} if self.status == "error" else {"code": 1},
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+
+        return span
+
+# Span being executed in the current task
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_span() -> Optional[Span]:
+    """Returns the span being executed in the current task"""
+    return _current_span.get()
+
+class Tracer:
+    """Creates spans and sends every finished span to the registered hooks.
+
+    Example:
+        >>> TRACER.add_hook(JSONLExporter("logs/traces.jsonl"))
+        >>> result = await agent.run("What is 2 * 3?")
+        >>> result.metrics.prompt_tokens
+    """
+    def __init__(self):
+        self.hooks: List[Callable[[Span], Any]] = []
+
+    def add_hook(self, hook: Callable[[Span], Any]) -> None:
+        """Registers a callable receiving every finished span"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[Span], Any]) -> None:
+        """Unregisters a hook"""
+        self.hooks.remove(hook)
+
+    def start_span(self, name: str, kind: SpanKind, trace_id: Optional[str] = None, **attributes: Any) -> Span:
+        """Starts a span child of the current one, without making it current"""
+        return Span(name, kind, parent=current_span(), trace_id=trace_id, **attributes)
+
+    def end_span(self, span: Span) -> None:
+        """Ends a span, adds it to its run metrics and sends it to the hooks.
+
+        A run started inside another run (a sub-agent called as a tool) adds its
+        metrics to the outer run, so budgets and results cover the whole work.
+        """
+        if span.end_time is not None:
+            return
+        span._duration = time.perf_counter() - span._started_at
+        span.end_time = time.time()
+
+        run = span.run
+        if run is not None:
+            if span is run:
+                run.metrics.wall_time = span.duration
+                outer = span.parent.run if span.parent is not None else None
+                if outer is not None:
+                    outer.metrics.add(run.metrics)
+            else:
+                run.metrics.record(span)
+
+        for hook in self.hooks:
+            try:
+                hook(span)
+            except Exception as e:
+                logger.warning(f"Tracing hook {hook!r} failed: {e}")
+
+    @contextmanager
+    def span(self, name: str, kind: SpanKind, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+        """Context manager running the block inside a new current span"""
+        span = self.start_span(name, kind, trace_id=trace_id, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span)
+
+class JSONLExporter:
+    """Hook writing every finished span as a JSON line"""
+    def __init__(self, path: Path, otlp: bool = False):
+        """
+        Args:
+            path: File receiving the spans, appended to
+            otlp: Writes spans in OpenTelemetry OTLP/JSON format instead of the flat format
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.otlp = otlp
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span) -> None:
+        record = {"resourceSpans": [{"scopeSpans": [{"scope": {"name": "mars"}, "spans": [span.to_otlp()]}]}]} if self.otlp else span.to_dict()
+        line = json.dumps(record, default=str)
+        with self._lock, self.path.open("a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+# Process-wide tracer used by agents, LLMs and tools
+TRACER = Tracer()
@@ -0,0 +1,143 @@
+"""End to end agent throughput against the local mock chat completions server.
+
+Runs ToolAgent conversations (one step calling two tools, then the answer) at
+increasing concurrency and reports, for every level:
+    - steps/s: agent steps completed per second
+    - step p50/p99: latency of a single step (LLM call + tools)
+    - run p50/p99: latency of a whole run
+    - overhead: mean step time minus the mean mock latency, i.e. the time spent
+      in the framework, the HTTP client and the event loop
+    - agent ovh: mean step time outside LLM calls (memory, tools, bookkeeping)
+Memory per agent is measured last, with tracemalloc, over agents kept alive
+after their run.
+
+The mock server runs in a background thread by default; pass --server-url to
+use a server started separately (`python -m benchmarks.mock_server`) so it
+does not share the interpreter with the agents.
+
+Usage:
+    python -m benchmarks.agent_throughput
+    python -m benchmarks.agent_throughput --concurrency 1 16 64 --runs 200 --latency 0.1 --jitter 0.02 --stream
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import statistics
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from app.agent.toolcall import ToolAgent
+from app.clients import CLIENTS
+from app.llm import LLM
+from app.logger import define_log_level
+from app.schema import LLMSettings
+from app.tools.math import multiply, divide
+from app.tracing import TRACER, Span, SpanKind
+from benchmarks.mock_server import BackgroundServer, MockChatServer
+
+REQUEST = "What are 2 * 3 and 8 / 2?"
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+def new_agent(llm: LLM, stream: bool) -> ToolAgent:
+    return ToolAgent(name="bench", model=llm, toolbox=[multiply, divide], stream=stream)
+
+async def quiet_run(agent: ToolAgent) -> None:
+    """Runs a single agent without printing its answer"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        await agent.run(REQUEST)
+
+async def sweep(llm: LLM, concurrency: int, runs: int, stream: bool, mock_delay: float) -> Dict[str, float]:
+    """Runs `runs` conversations with at most `concurrency` in flight"""
+    step_durations: List[float] = []
+    def collect(span: Span) -> None:
+        if span.kind == SpanKind.STEP:
+            step_durations.append(span.duration)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async def one_run():
+        async with semaphore:
+            return await new_agent(llm, stream).run(REQUEST)
+
+    TRACER.add_hook(collect)
+    try:
+        started_at = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # agents print their answers
+            results = await asyncio.gather(*(one_run() for _ in range(runs)))
+        elapsed = time.perf_counter() - started_at
+    finally:
+        TRACER.remove_hook(collect)
+
+    metrics = [result.metrics for result in results]
+    steps = sum(m.steps for m in metrics)
+    return {
+        "steps_per_second": steps / elapsed,
+        "step_p50": percentile(step_durations, 0.50),
+        "step_p99": percentile(step_durations, 0.99),
+        "run_p50": percentile([m.wall_time for m in metrics], 0.50),
+        "run_p99": percentile([m.wall_time for m in metrics], 0.99),
+        "overhead": statistics.mean(step_durations) - mock_delay,
+        "agent_overhead": sum(m.wall_time - m.llm_time for m in metrics) / steps,
+    }
+
+async def memory_per_agent(llm: LLM, agents: int, stream: bool) -> float:
+    """Average bytes retained by an agent after its run (context, memory, tool calls)"""
+    await quiet_run(new_agent(llm, stream)) # warm up imports, clients and caches
+    gc.collect()
+    tracemalloc.start()
+    kept = [new_agent(llm, stream) for _ in range(agents)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(agent.run(REQUEST) for agent in kept))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / agents
+
+async def benchmark(args: argparse.Namespace, server_url: str) -> None:
+    llm = LLM(LLMSettings(provider="groq", model_name="mock", api_key="mock", base_url=server_url, max_connections=args.max_connections))
+    mock_delay = args.latency + args.jitter / 2
+
+    try:
+        await quiet_run(new_agent(llm, args.stream)) # opens the connection pool
+        print(f"mock latency {args.latency * 1000:.1f}ms + jitter {args.jitter * 1000:.1f}ms | stream={args.stream} | {args.runs} runs per level")
+        print(f"{'conc':>5} {'steps/s':>9} {'step p50':>9} {'step p99':>9} {'run p50':>9} {'run p99':>9} {'overhead':>9} {'agent ovh':>9}")
+        for concurrency in args.concurrency:
+            result = await sweep(llm, concurrency, max(args.runs, concurrency), args.stream, mock_delay)
+            ms = {key: value * 1000 for key, value in result.items() if key != "steps_per_second"}
+            print(f"{concurrency:>5} {result['steps_per_second']:>9.1f} {ms['step_p50']:>7.2f}ms {ms['step_p99']:>7.2f}ms "
+                  f"{ms['run_p50']:>7.2f}ms {ms['run_p99']:>7.2f}ms {ms['overhead']:>7.2f}ms {ms['agent_overhead']:>7.2f}ms")
+
+        size = await memory_per_agent(llm, args.memory_agents, args.stream)
+        print(f"memory: {size / 1024:.1f} KiB per agent ({args.memory_agents} agents kept alive)")
+    finally:
+        await CLIENTS.aclose()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Agent throughput against the mock chat completions server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128], help="Concurrency levels of the sweep")
+    parser.add_argument("--runs", type=int, default=100, help="Agent runs per concurrency level (at least the concurrency)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Mock jitter in seconds")
+    parser.add_argument("--stream", action="store_true", help="Streams completions")
+    parser.add_argument("--memory-agents", type=int, default=100, help="Agents kept alive to measure memory per agent")
+    parser.add_argument("--max-connections", type=int, default=100, help="Connection pool size")
+    parser.add_argument("--server-url", help="Use an already running mock server, its latency must match --latency/--jitter")
+    parser.add_argument("--log-level", default="WARNING", help="Log level during the benchmark, logging is part of the overhead")
+    args = parser.parse_args(argv)
+
+    define_log_level(print_level=args.log_level, logfile_level=args.log_level, event_level=args.log_level)
+
+    if args.server_url:
+        asyncio.run(benchmark(args, args.server_url))
+        return
+
+    with BackgroundServer(MockChatServer(latency=args.latency, jitter=args.jitter)) as server:
+        asyncio.run(benchmark(args, server.url))
+
+if __name__ == "__main__":
+    main()
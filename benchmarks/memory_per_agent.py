@@ -0,0 +1,65 @@
+"""Memory used by the conversation history of an agent.
+
+Compares the validated pydantic representation of messages (MessageModel kept in
+a list) with the compact slotted Message stored in the Memory ring buffer.
+
+Usage:
+    python -m benchmarks.memory_per_agent
+"""
+import gc
+import tracemalloc
+from typing import Callable, List
+
+from app.schema import Memory, Message, MessageModel, Role
+
+AGENTS = 200
+STEPS_PER_AGENT = 50
+
+def conversation(step: int) -> List[dict]:
+    """Messages produced by a typical tool calling step"""
+    call_id = f"call_{step}"
+    return [
+        {"role": "user", "content": f"Question number {step} asked by the user"},
+        {"role": "assistant", "content": "None", "tool_calls": [
+            {"id": call_id, "type": "function", "function": {"name": "multiply", "arguments": '{"a": 2, "b": 3}'}}
+        ]},
+        {"role": "tool", "content": "6", "tool_call_id": call_id},
+        {"role": "assistant", "content": f"The answer for question {step} is 6"},
+    ]
+
+def pydantic_agent_history() -> List[MessageModel]:
+    """History as a list of validated pydantic messages"""
+    history = [MessageModel(role=Role.SYSTEM, content="System instructions"), MessageModel(role=Role.SYSTEM, content="Next step")]
+    for step in range(STEPS_PER_AGENT):
+        history.extend(MessageModel(**message) for message in conversation(step))
+    return history
+
+def compact_agent_history() -> Memory:
+    """History as compact messages in Memory, including its serialized view"""
+    memory = Memory(max_messages=10_000)
+    memory.add_message(Message.system_message("System instructions"))
+    memory.add_message(Message.system_message("Next step"))
+    for step in range(STEPS_PER_AGENT):
+        for message in conversation(step):
+            memory.add_message(Message(**message))
+    return memory
+
+def bytes_per_agent(build: Callable) -> float:
+    """Average bytes allocated and retained by the history of one agent"""
+    gc.collect()
+    tracemalloc.start()
+    histories = [build() for _ in range(AGENTS)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del histories
+    return current / AGENTS
+
+def main():
+    messages = 2 + 4 * STEPS_PER_AGENT
+    print(f"{AGENTS} agents, {messages} messages each")
+    for label, build in [("pydantic", pydantic_agent_history), ("compact", compact_agent_history)]:
+        size = bytes_per_agent(build)
+        print(f"{label:>9}: {size / 1024:8.1f} KiB per agent | {size / messages:6.0f} bytes per message")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Per-step request serialization overhead as the history grows.
+
+Compares re-formatting every message on each step with reusing the
+pre-serialized view kept by Memory.
+
+Usage:
+    python -m benchmarks.memory_serialization
+"""
+import time
+
+from app.schema import Memory, Message
+from app.llm import LLM
+
+HISTORY_SIZES = [10, 100, 1_000, 5_000]
+STEPS = 200
+
+def per_step_overhead(history_size: int, reuse_view: bool) -> float:
+    """Average seconds spent serializing the request of a single step"""
+    memory = Memory(max_messages=history_size + STEPS)
+    for i in range(history_size):
+        memory.add_message(Message.user_message(f"Message number {i} of the conversation"))
+
+    # format_messages is used unbound: the benchmark does not need an API client
+    format_messages = LLM.format_messages
+    elapsed = 0.0
+    for step in range(STEPS):
+        memory.add_message(Message.assistant_message(f"Step {step} result"))
+        started_at = time.perf_counter()
+        format_messages(None, memory if reuse_view else memory.messages)
+        elapsed += time.perf_counter() - started_at
+
+    return elapsed / STEPS
+
+def main():
+    print(f"{'history':>8} | {'re-format (us)':>15} | {'cached view (us)':>17}")
+    for history_size in HISTORY_SIZES:
+        reformat = per_step_overhead(history_size, reuse_view=False) * 1e6
+        cached = per_step_overhead(history_size, reuse_view=True) * 1e6
+        print(f"{history_size:>8} | {reformat:>15.1f} | {cached:>17.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Local stand-in for an OpenAI/Groq compatible chat completions API.
+
+Answers every request with a scripted turn after a configurable latency, so
+agents can run end to end without API keys or network. The server is stateless:
+the turn sent is picked from the number of assistant messages already in the
+request, so concurrent conversations never interfere.
+
+Any POST path ending with `/chat/completions` is served, which covers the Groq
+client (`{base_url}/openai/v1/chat/completions`), the Azure client
+(`{endpoint}/openai/deployments/{model}/chat/completions`) and plain OpenAI
+clients. Streaming (server-sent events) and `/models` (client warm-up) are
+supported too.
+
+Usage:
+    python -m benchmarks.mock_server --port 8765 --latency 0.2 --jitter 0.05
+
+    >>> llm = LLM(LLMSettings(provider="groq", model_name="mock", api_key="mock", base_url="http://127.0.0.1:8765"))
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from uuid import uuid4
+
+# Default script: one step calling two tools in parallel, then the final answer
+DEFAULT_SCRIPT: List[Dict[str, Any]] = [
+    {"tool_calls": [
+        {"name": "multiply", "arguments": {"a": 2, "b": 3}},
+        {"name": "divide", "arguments": {"a": 8, "b": 2}},
+    ]},
+    {"content": "2 * 3 = 6 and 8 / 2 = 4"},
+]
+
+class MockChatServer:
+    """Scripted chat completions server.
+
+    Each turn of the script is either `{"content": "..."}` or
+    `{"tool_calls": [{"name": ..., "arguments": {...}}]}`. The turn answered is
+    the number of assistant messages in the request, the last turn is repeated
+    once the script is exhausted.
+
+    Example:
+        >>> async with MockChatServer(latency=0.1, jitter=0.02) as server:
+        ...     llm = LLM(LLMSettings(provider="groq", model_name="mock", api_key="mock", base_url=server.url))
+    """
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 script: Optional[List[Dict[str, Any]]] = None,
+                 cached_tokens: int = 0):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            latency: Seconds waited before each answer
+            jitter: Extra random delay, uniform between 0 and `jitter` seconds
+            script: (Optional) Turns answered, DEFAULT_SCRIPT when None
+            cached_tokens: Prompt tokens reported as served from the prompt cache
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.script = script or DEFAULT_SCRIPT
+        self.cached_tokens = cached_tokens
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "MockChatServer":
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections): # keep-alive connections would block wait_closed
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def __aenter__(self) -> "MockChatServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    def turn(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Scripted turn answering the request"""
+        answered = sum(1 for message in request.get("messages", []) if message.get("role") == "assistant")
+        return self.script[min(answered, len(self.script) - 1)]
+
+    def delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+
+    def usage(self, request: Dict[str, Any], completion: str) -> Dict[str, Any]:
+        prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+        completion_tokens = max(1, len(completion) // 4)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": min(self.cached_tokens, prompt_tokens)},
+        }
+
+    def message(self, turn: Dict[str, Any]) -> Dict[str, Any]:
+        """Assistant message of a turn, in chat completions format"""
+        if "tool_calls" not in turn:
+            return {"role": "assistant", "content": turn.get("content", "")}
+
+        return {"role": "assistant", "content": None, "tool_calls": [
+            {
+                "id": f"call_{uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))},
+            }
+            for call in turn["tool_calls"]
+        ]}
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        message = self.message(self.turn(request))
+        return {
+            "id": f"chatcmpl-{uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+            "usage": self.usage(request, json.dumps(message)),
+        }
+
+    def chunks(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Streamed chunks of the answer: role, content or one chunk per tool call, finish"""
+        message = self.message(self.turn(request))
+        base = {"id": f"chatcmpl-{uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "mock")}
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+            return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        chunks = [chunk({"role": "assistant", "content": ""})]
+        if message.get("tool_calls"):
+            chunks += [chunk({"tool_calls": [{"index": index, **tool_call}]}) for index, tool_call in enumerate(message["tool_calls"])]
+            chunks.append(chunk({}, "tool_calls"))
+        else:
+            chunks += [chunk({"content": word}) for word in re.findall(r"\S+\s*", message["content"])]
+            chunks.append(chunk({}, "stop"))
+
+        usage = self.usage(request, json.dumps(message))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunks.append({**base, "choices": [], "usage": usage})
+        else:
+            chunks[-1]["x_groq"] = {"usage": usage} # Groq reports usage in the last chunk
+
+        return chunks
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves HTTP/1.1 requests of a keep-alive connection"""
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = path.split("?", 1)[0].rstrip("/")
+                if method == "POST" and path.endswith("/chat/completions"):
+                    self.requests += 1
+                    request = json.loads(body or b"{}")
+                    await asyncio.sleep(self.delay())
+                    if request.get("stream"):
+                        await self._send_stream(writer, self.chunks(request))
+                    else:
+                        await self._send(writer, 200, self.completion(request))
+                elif method == "GET" and path.endswith("/models"):
+                    await self._send(writer, 200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+                else:
+                    await self._send(writer, 404, {"error": {"message": f"Unknown route {method} {path}", "type": "not_found"}})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass # client gone, or server stopped while a request was pending
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        reason = "OK" if status == 200 else "Not Found"
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    async def _send_stream(writer: asyncio.StreamWriter, chunks: List[Dict[str, Any]]) -> None:
+        """Sends server-sent events with chunked transfer encoding"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n")
+        events = [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"]
+        for event in events:
+            data = event.encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+class BackgroundServer:
+    """Runs a MockChatServer in its own thread and event loop.
+
+    Keeps the server off the event loop being measured, so its work is not
+    counted as framework overhead.
+
+    Example:
+        >>> with BackgroundServer(MockChatServer(latency=0.1)) as server:
+        ...     print(server.url)
+    """
+    def __init__(self, server: MockChatServer):
+        self.server = server
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="mock-chat-server", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return self.server.url
+
+    def __enter__(self) -> MockChatServer:
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self._loop).result()
+        return self.server
+
+    def __exit__(self, *exc_info) -> None:
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted OpenAI/Groq compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds waited before each answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay, up to this many seconds")
+    parser.add_argument("--script", help="JSON file holding the list of scripted turns")
+    parser.add_argument("--cached-tokens", type=int, default=0, help="Prompt tokens reported as cached")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as file:
+            script = json.load(file)
+
+    server = MockChatServer(args.host, args.port, args.latency, args.jitter, script, args.cached_tokens)
+    print(f"Mock chat completions server listening on {server.url}")
+    asyncio.run(server.serve_forever())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+from itertools import count
+from types import SimpleNamespace
+from typing import Any, Dict, List, Union
+
+import pytest
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app.llm import LLM
+from app.schema import LLMSettings
+
+_ids = count()
+
+def completion(content: str = None, tool_calls: List[Dict[str, Any]] = (), prompt_tokens: int = 10, completion_tokens: int = 5) -> ChatCompletion:
+    """Chat completion answering `content`, or calling tools given as {"name": ..., "arguments": {...}}"""
+    calls = [
+        {"id": call.get("id") or f"call_{next(_ids)}", "type": "function",
+         "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))}}
+        for call in tool_calls
+    ]
+    return ChatCompletion.model_validate({
+        "id": f"chatcmpl-{next(_ids)}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "model",
+        "choices": [{"index": 0, "finish_reason": "tool_calls" if calls else "stop",
+                     "message": {"role": "assistant", "content": content, "tool_calls": calls or None}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+def chunk(content: str = None, tool_calls: List[Dict[str, Any]] = None, finish_reason: str = None, usage: Dict[str, int] = None) -> ChatCompletionChunk:
+    """Streamed chunk with a text delta or tool call fragments given as {"index": ..., "id": ..., "name": ..., "arguments": ...}"""
+    fragments = [
+        {"index": fragment["index"], "id": fragment.get("id"), "type": "function" if fragment.get("id") else None,
+         "function": {"name": fragment.get("name"), "arguments": fragment.get("arguments")}}
+        for fragment in tool_calls or []
+    ]
+    choices = [] if usage else [{"index": 0, "finish_reason": finish_reason, "delta": {"content": content, "tool_calls": fragments or None}}]
+    return ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": 0, "model": "model",
+        "choices": choices, "usage": {**usage, "total_tokens": sum(usage.values())} if usage else None,
+    })
+
+async def stream_of(chunks: List[ChatCompletionChunk]):
+    """Async iterator over the chunks, as returned by the provider for streamed requests"""
+    for item in chunks:
+        yield item
+
+def scripted_client(create) -> SimpleNamespace:
+    """Provider client whose chat completions are answered by `create`"""
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+@pytest.fixture
+def scripted_llm():
+    """Builds LLMs answering from a script instead of a provider.
+
+    The script is a list of completions (lists of chunks for streamed requests),
+    or a callable receiving the request; the requests sent are kept in `llm.requests`.
+    """
+    def build(script: Union[List[ChatCompletion], Any], **settings) -> LLM:
+        llm = LLM(LLMSettings(**{"model_name": "model", "api_key": "test", "provider": "groq", **settings}))
+        llm.requests = []
+        responses = iter(script) if isinstance(script, list) else None
+
+        async def create(**request):
+            llm.requests.append({**request, "messages": list(request["messages"])}) # the memory view keeps changing
+            response = next(responses) if responses is not None else script(request)
+            return stream_of(response) if isinstance(response, list) else response
+
+        llm.client = scripted_client(create)
+        return llm
+
+    return build
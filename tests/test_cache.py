@@ -0,0 +1,149 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletionMessage
+
+from app.cache import LRUCache, ResponseCache, make_key
+from app.llm import LLM
+from app.schema import LLMSettings, Message
+
+def test_make_key_is_canonical():
+    assert make_key({"a": 1, "b": 2}) == make_key({"b": 2, "a": 1})
+    assert make_key({"a": 1}) != make_key({"a": 2})
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.evictions == 1
+
+def test_single_flight_computes_once():
+    cache = ResponseCache()
+    calls = []
+
+    async def compute():
+        calls.append(True)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(calls) == 1
+    assert (cache.stats.hits, cache.stats.misses) == (4, 1)
+
+def test_failed_computation_is_not_cached():
+    cache = ResponseCache()
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def compute():
+        return "value"
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute("key", fail)
+        return await cache.get_or_compute("key", compute)
+
+    assert asyncio.run(main()) == "value"
+
+def test_waiters_recompute_after_cancelled_leader():
+    cache = ResponseCache()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def compute():
+        return "value"
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_compute("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "value"
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = ResponseCache(persistent=True, path=path)
+    asyncio.run(cache.get_or_compute("key", lambda: asyncio.sleep(0, result={"answer": 42})))
+    cache.disk.close()
+
+    reopened = ResponseCache(persistent=True, path=path)
+    assert reopened.get("key") == (True, {"answer": 42})
+    reopened.disk.close()
+
+def cached_llm(temperature: float = 0.0) -> LLM:
+    """LLM answering every request with its sampling settings, counting the provider calls"""
+    llm = LLM(LLMSettings(model_name="model", api_key="test", provider="groq", temperature=temperature), cache=ResponseCache())
+    llm.requests = []
+
+    async def create(request, priority=None, size=None):
+        llm.requests.append(request)
+        message = ChatCompletionMessage(role="assistant", content=str(request["temperature"]))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    llm.create = create
+
+    return llm
+
+def test_request_carries_sampling_settings():
+    llm = cached_llm()
+    request = llm.build_request([Message.user_message("Hi")])
+    assert (request["temperature"], request["top_p"], request["max_completion_tokens"]) == (0.0, 1, 4096)
+
+def test_deterministic_completions_are_cached():
+    llm = cached_llm()
+    messages = [Message.user_message("Hi")]
+
+    async def main():
+        return [await llm.invoke(messages) for _ in range(2)]
+
+    assert asyncio.run(main()) == ["0.0", "0.0"]
+    assert len(llm.requests) == 1
+    assert llm.requests[0]["temperature"] == 0.0
+
+def test_random_sampling_bypasses_the_cache():
+    llm = cached_llm(temperature=0.7)
+    messages = [Message.user_message("Hi")]
+
+    async def main():
+        for _ in range(2):
+            await llm.invoke(messages)
+
+    asyncio.run(main())
+    assert len(llm.requests) == 2
+
+def test_disk_tier_is_opened_on_first_lookup(tmp_path):
+    path = tmp_path / "lazy.sqlite"
+    cache = ResponseCache(persistent=True, path=path)
+    assert not path.exists()
+    assert cache.stats.evictions == 0 and not path.exists()
+
+    asyncio.run(cache.get_or_compute("key", lambda: asyncio.sleep(0, result=1)))
+    assert path.exists()
+    cache.disk.close()
+
+def test_cached_tools_open_no_file_until_called():
+    from app.tools.wikipedia import get_wikipedia_summary
+    assert get_wikipedia_summary.cache.persistent
+    assert get_wikipedia_summary.cache._disk is None
+
+def test_wikipedia_clients_are_per_thread_and_language():
+    from concurrent.futures import ThreadPoolExecutor
+    from app.tools.wikipedia import get_wikipedia_client
+
+    assert get_wikipedia_client("en") is get_wikipedia_client("en")
+    assert get_wikipedia_client("en") is not get_wikipedia_client("fr")
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(get_wikipedia_client, "en").result() is not get_wikipedia_client("en")
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from app.agent.toolcall import ToolAgent
+from app.checkpoint import CheckpointStore
+from app.prompts.default import LOOP_WARNING
+from app.schema import AgentState, StopReason
+from app.tools.base import Tool
+
+from tests.conftest import completion
+
+def test_load_folds_steps_and_ignores_a_torn_record(tmp_path):
+    store = CheckpointStore(tmp_path)
+    log = store.create("run", "agent", "question")
+    log.append({"type": "step", "step": 1, "state": "running", "messages": [{"role": "user", "content": "question"}],
+                "results": ["r1"], "tool_calls": [{"id": "1"}], "ledger": {"a": "1"}, "call_history": [["a"]], "stalled_steps": 0})
+    log.append({"type": "step", "step": 2, "state": "finished", "messages": [{"role": "assistant", "content": "answer"}],
+                "results": ["r2"], "tool_calls": [], "ledger": {}, "call_history": [], "stalled_steps": 1, "stop_reason": "loop"})
+    log.close()
+    with store.path("run").open("a") as file:
+        file.write('{"type": "step", "step": 3, "sta')
+
+    checkpoint = store.load("run")
+    assert (checkpoint.agent, checkpoint.request, checkpoint.current_step) == ("agent", "question", 2)
+    assert checkpoint.finished and checkpoint.state == AgentState.FINISHED
+    assert [message["content"] for message in checkpoint.messages] == ["question", "answer"]
+    assert checkpoint.results == ["r1", "r2"]
+    assert checkpoint.tool_calls == []
+    assert (checkpoint.ledger, checkpoint.call_history, checkpoint.stalled_steps) == ({"a": "1"}, [["a"]], 1)
+    assert checkpoint.stop_reason == StopReason.LOOP
+
+def test_load_without_checkpoint_raises(tmp_path):
+    with pytest.raises(ValueError, match="No checkpoint"):
+        CheckpointStore(tmp_path).load("missing")
+
+def test_resume_continues_without_repeating_calls(tmp_path, scripted_llm):
+    executions = []
+
+    @Tool.as_tool
+    def lookup(query: str) -> str:
+        """Looks something up"""
+        executions.append(query)
+        return "42"
+
+    def crashing(request):
+        if len(crashing_llm.requests) == 1:
+            return completion(tool_calls=[{"name": "lookup", "arguments": {"query": "answer"}}])
+        raise ConnectionError("process killed")
+
+    store = CheckpointStore(tmp_path)
+    crashing_llm = scripted_llm(crashing)
+    with pytest.raises(Exception, match="process killed"):
+        asyncio.run(ToolAgent(name="agent", model=crashing_llm, toolbox=[lookup], checkpoints=store).run("What is the answer?"))
+
+    run_id = next(tmp_path.glob("*.jsonl")).stem
+    llm = scripted_llm([completion("The answer is 42")])
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=[lookup], checkpoints=store).resume(run_id))
+
+    assert result.run_id == run_id
+    assert result.answer == "The answer is 42"
+    assert executions == ["answer"]
+    assert len(llm.requests) == 1
+    assert [message["role"] for message in llm.requests[0]["messages"]][-3:] == ["user", "assistant", "tool"]
+    assert store.load(run_id).finished
+
+    # A finished run is returned as is, without any call
+    again = asyncio.run(ToolAgent(name="agent", model=scripted_llm([]), toolbox=[lookup], checkpoints=store).resume(run_id))
+    assert again.answer == "The answer is 42"
+
+def test_resume_restores_the_ledger_and_loop_state(tmp_path, scripted_llm):
+    executions = []
+
+    @Tool.as_tool(reusable=True)
+    def lookup(query: str) -> str:
+        """Looks something up"""
+        executions.append(query)
+        return "42"
+
+    def crashing(request):
+        if len(crashing_llm.requests) == 1:
+            return completion(tool_calls=[{"name": "lookup", "arguments": {"query": "answer"}}])
+        raise ConnectionError("process killed")
+
+    store = CheckpointStore(tmp_path)
+    crashing_llm = scripted_llm(crashing)
+    with pytest.raises(Exception, match="process killed"):
+        asyncio.run(ToolAgent(name="agent", model=crashing_llm, toolbox=[lookup], checkpoints=store).run("What is the answer?"))
+
+    run_id = next(tmp_path.glob("*.jsonl")).stem
+    checkpoint = store.load(run_id)
+    assert list(checkpoint.ledger.values()) == ["42"]
+    assert len(checkpoint.call_history) == 1
+
+    llm = scripted_llm([completion(tool_calls=[{"name": "lookup", "arguments": {"query": "answer"}}]), completion("The answer is 42")])
+    agent = ToolAgent(name="agent", model=llm, toolbox=[lookup], checkpoints=store)
+    result = asyncio.run(agent.resume(run_id))
+
+    assert result.answer == "The answer is 42"
+    assert executions == ["answer"] # the repeated call was answered from the restored ledger
+    tool_message, warning = llm.requests[1]["messages"][-2:]
+    assert tool_message["content"].startswith("42\n(Repeated call")
+    assert warning["content"] == LOOP_WARNING.format(calls='lookup({"query": "answer"})') # the repeated step counts as stalled
+
+def test_resume_of_a_stopped_run_keeps_its_stop_reason(tmp_path, scripted_llm):
+    @Tool.as_tool
+    def lookup(query: str) -> str:
+        """Looks something up"""
+        return "42"
+
+    store = CheckpointStore(tmp_path)
+    llm = scripted_llm([completion(tool_calls=[{"name": "lookup", "arguments": {"query": "answer"}}])])
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=[lookup], checkpoints=store, max_steps=1).run("What is the answer?"))
+    assert result.stop_reason == StopReason.MAX_STEPS
+
+    again = asyncio.run(ToolAgent(name="agent", model=scripted_llm([]), toolbox=[lookup], checkpoints=store).resume(result.run_id))
+
+    assert again.stop_reason == StopReason.MAX_STEPS
+    assert again.answer is None
+    assert again.results == result.results
@@ -0,0 +1,65 @@
+import asyncio
+
+from app.llm import is_complete_json
+from app.schema import Message, StreamEventType
+
+from tests.conftest import chunk
+
+def collect(llm):
+    async def main():
+        return [event async for event in llm.stream([Message.user_message("Hi")])]
+    return asyncio.run(main())
+
+def test_is_complete_json():
+    assert is_complete_json('{"a": {"b": 1}}')
+    assert not is_complete_json('{"a": {"b": 1}')
+    assert not is_complete_json('{"a": "}')
+    assert not is_complete_json("[1]")
+
+def test_interleaved_fragments_are_assembled(scripted_llm):
+    llm = scripted_llm([[
+        chunk("Let me check. "),
+        chunk(tool_calls=[{"index": 0, "id": "a", "name": "lookup", "arguments": '{"query": '}]),
+        chunk(tool_calls=[{"index": 1, "id": "b", "name": "multiply", "arguments": '{"a": 2,'}]),
+        chunk(tool_calls=[{"index": 0, "arguments": '"tower"}'}]), # call 0 completes after call 1 started
+        chunk(tool_calls=[{"index": 1, "arguments": ' "b": 3}'}]),
+        chunk(finish_reason="tool_calls"),
+        chunk(usage={"prompt_tokens": 10, "completion_tokens": 5}),
+    ]])
+
+    events = collect(llm)
+    calls = [event.tool_call for event in events if event.type == StreamEventType.TOOL_CALL]
+
+    assert [(call.id, call.name, call.arguments) for call in calls] == [("a", "lookup", {"query": "tower"}), ("b", "multiply", {"a": 2, "b": 3})]
+    assert events[-1].type == StreamEventType.DONE and events[-1].content == "Let me check. "
+
+def test_calls_are_yielded_as_soon_as_complete(scripted_llm):
+    seen = []
+
+    async def main(llm):
+        async for event in llm.stream([Message.user_message("Hi")]):
+            seen.append(event.type)
+            if event.type == StreamEventType.TOOL_CALL:
+                assert len(llm.requests) == 1 and StreamEventType.DONE not in seen
+
+    llm = scripted_llm([[
+        chunk(tool_calls=[{"index": 0, "id": "a", "name": "lookup", "arguments": '{"query": "x"}'}]),
+        chunk(tool_calls=[{"index": 1, "id": "b", "name": "lookup", "arguments": '{"query"'}]),
+        chunk(tool_calls=[{"index": 1, "arguments": ': "y"}'}]),
+        chunk(finish_reason="tool_calls"),
+    ]])
+    asyncio.run(main(llm))
+    assert seen == [StreamEventType.TOOL_CALL, StreamEventType.TOOL_CALL, StreamEventType.DONE]
+
+def test_incomplete_arguments_are_flushed_on_finish(scripted_llm):
+    llm = scripted_llm([[
+        chunk(tool_calls=[{"index": 0, "id": "a", "name": "lookup", "arguments": '{"query": "x"'}]),
+        chunk(tool_calls=[{"index": 1, "id": "b", "name": "ping"}]), # no arguments at all
+        chunk(finish_reason="length"),
+    ]])
+
+    calls = [event.tool_call for event in collect(llm) if event.type == StreamEventType.TOOL_CALL]
+
+    assert [call.id for call in calls] == ["a", "b"]
+    assert calls[0].error is not None and calls[0].arguments == {}
+    assert calls[1].error is None and calls[1].arguments == {}
@@ -0,0 +1,76 @@
+import pytest
+
+from app import logger as logger_module
+from app.logger import cap, define_log_level, log_event, read_events
+
+@pytest.fixture
+def event_log(tmp_path):
+    """Logs to a temporary directory without background threads, and returns the events file"""
+    def configure(**kwargs):
+        define_log_level(print_level="CRITICAL", name="test", enqueue=False, log_dir=tmp_path, **kwargs)
+        return next(tmp_path.rglob("*.events.jsonl"))
+
+    yield configure
+    define_log_level()
+
+def test_events_are_written_and_read_back(event_log):
+    path = event_log()
+    log_event("tool.result", tool="search", result="found", count=3)
+
+    events = list(read_events(path))
+    assert len(events) == 1
+    assert events[0]["event"] == "tool.result"
+    assert events[0]["level"] == "INFO"
+    assert (events[0]["tool"], events[0]["result"], events[0]["count"]) == ("search", "found", 3)
+
+def test_debug_events_are_skipped_by_default(event_log, monkeypatch):
+    path = event_log()
+    capped = []
+    monkeypatch.setattr(logger_module, "cap", lambda value: capped.append(value) or value)
+
+    log_event("agent.debug", level="DEBUG", payload="expensive")
+    log_event("agent.warning", level="WARNING", payload="kept")
+
+    assert [event["event"] for event in read_events(path)] == ["agent.warning"]
+    assert capped == ["kept"] # the skipped event was never formatted
+
+def test_event_level_is_configurable(event_log):
+    path = event_log(event_level="DEBUG")
+    log_event("agent.debug", level="DEBUG")
+
+    assert [event["event"] for event in read_events(path)] == ["agent.debug"]
+
+def test_events_are_sampled(event_log, monkeypatch):
+    path = event_log(sample_rates={"llm.first_token": 0.5})
+    draws = iter([0.7, 0.2, 0.9])
+    monkeypatch.setattr(logger_module.random, "random", lambda: next(draws))
+
+    log_event("llm.first_token", step=1) # 0.7 >= 0.5, skipped
+    log_event("llm.first_token", step=2) # 0.2 < 0.5, logged
+    log_event("tool.result", step=3) # no configured rate, always logged without a draw
+    log_event("tool.call", sample_rate=0.5, step=4) # 0.9 >= 0.5, skipped
+
+    assert [(event["event"], event["step"]) for event in read_events(path)] == [("llm.first_token", 2), ("tool.result", 3)]
+
+def test_default_sample_rates_apply(event_log, monkeypatch):
+    path = event_log()
+    monkeypatch.setattr(logger_module.random, "random", lambda: 0.99)
+
+    log_event("llm.first_token", time_to_first_token=0.1)
+
+    assert list(read_events(path)) == []
+
+def test_cap_truncates_long_payloads():
+    assert cap("short") == "short"
+    assert cap(None) is None
+    assert cap(42) == 42
+    assert cap("x" * 20, max_chars=5) == "xxxxx... [20 chars]"
+    assert cap(["a", "b"], max_chars=4) == "['a'... [10 chars]"
+
+def test_long_payloads_are_capped_in_the_event_log(event_log):
+    path = event_log()
+    log_event("tool.result", result="x" * 2000, count=2000)
+
+    event = next(read_events(path))
+    assert event["result"] == "x" * logger_module.PAYLOAD_MAX_CHARS + "... [2000 chars]"
+    assert event["count"] == 2000
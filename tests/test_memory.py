@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from app.schema import Memory, Message, Role
+
+def test_messages_compare_by_value_and_are_unhashable():
+    assert Message.user_message("Hi") == Message.user_message("Hi")
+    assert Message.user_message("Hi") != Message.user_message("Bye")
+    with pytest.raises(TypeError):
+        hash(Message.user_message("Hi"))
+
+def test_window_keeps_prompts_and_tool_turns():
+    memory = Memory(max_messages=5)
+    memory.add_message(Message.system_message("prompt"))
+    memory.add_message(Message.user_message("question"))
+    memory.add_message(Message(role=Role.ASSISTANT, content="None", tool_calls=[{"id": "1", "type": "function", "function": {"name": "f", "arguments": "{}"}}]))
+    memory.add_message(Message.tool_message("1", "result"))
+    memory.add_message(Message.assistant_message("answer"))
+    memory.add_message(Message.user_message("thanks"))
+
+    # The question goes first; the tool call and its response stay together
+    assert [message.role for message in memory.messages] == [Role.SYSTEM, Role.ASSISTANT, Role.TOOL, Role.ASSISTANT, Role.USER]
+    assert memory.to_dict_list() == [message.to_dict() for message in memory.messages]
+    assert memory.payload_bytes == sum(len(json.dumps(message.to_dict())) for message in memory.messages)
+
+def test_views_are_maintained_without_copies():
+    memory = Memory(max_messages=4, summarize_evicted=True)
+    assert memory.last is None
+    memory.add_message(Message.system_message("prompt"))
+    for i in range(6):
+        memory.add_message(Message.user_message(f"question {i}"))
+
+    assert memory.to_dict_list() is memory.to_dict_list()
+    assert memory.messages is memory.messages
+    assert memory.to_dict_list() == [message.to_dict() for message in memory.messages]
+    assert memory.messages[1].content.startswith("Summary of the earlier conversation")
+    assert memory.last == Message.user_message("question 5")
+    assert len(memory.messages) == len(memory) == 4
+
+    memory.clear()
+    assert memory.messages == memory.to_dict_list() == []
+
+def tool_turn(call_id: str):
+    """An assistant tool call with its tool response"""
+    call = Message(role=Role.ASSISTANT, content="None", tool_calls=[{"id": call_id, "type": "function", "function": {"name": "lookup", "arguments": "{}"}}])
+    return [call, Message.tool_message(call_id, f"result {call_id}")]
+
+def test_pinned_prompts_are_never_evicted():
+    memory = Memory(max_messages=3)
+    memory.add_message(Message.system_message("instructions"))
+    memory.add_message(Message.system_message("next step"))
+    for i in range(5):
+        memory.add_message(Message.user_message(f"question {i}"))
+
+    assert [message.content for message in memory.messages] == ["instructions", "next step", "question 4"]
+
+def test_tool_call_is_evicted_with_its_responses():
+    memory = Memory(max_tokens=10_000, token_counter=lambda payload: 10)
+    memory.add_message(Message.system_message("prompt"))
+    for message in [*tool_turn("1"), Message.user_message("question")]:
+        memory.add_message(message)
+
+    memory.max_tokens = 30
+    memory.add_message(Message.assistant_message("answer"))
+
+    # Evicting only the call would leave an orphan tool response
+    assert [message.role for message in memory.messages] == [Role.SYSTEM, Role.USER, Role.ASSISTANT]
+    assert memory.total_tokens == 30
+
+def test_evicted_turns_are_summarized():
+    folded = []
+
+    def summarizer(summary, evicted):
+        folded.append([message.content for message in evicted])
+        return "\n".join(filter(None, [summary, *(f"- {message.content}" for message in evicted)]))
+
+    memory = Memory(max_messages=4, summarize_evicted=True, summarizer=summarizer)
+    memory.add_message(Message.system_message("prompt"))
+    for i in range(5):
+        memory.add_message(Message.user_message(f"question {i}"))
+
+    assert memory.summary == "- question 0\n- question 1\n- question 2"
+    assert [message.content for message in memory.messages][2:] == ["question 3", "question 4"]
+    assert folded == [["question 0"], ["question 1"], ["question 2"]]
+
+def test_max_messages_counts_the_summary():
+    memory = Memory(max_messages=5, summarize_evicted=True)
+    memory.add_message(Message.system_message("prompt"))
+    for i in range(20):
+        memory.add_message(Message.user_message(f"question {i}"))
+        assert len(memory) <= 5
+
+    assert memory.messages[1].role == Role.SYSTEM and memory.summary
+    assert memory.last.content == "question 19"
+
+def test_summary_counts_against_the_token_budget():
+    memory = Memory(max_tokens=60, summarize_evicted=True)
+    memory.add_message(Message.system_message("prompt"))
+    for i in range(8):
+        memory.add_message(Message.user_message(f"question number {i} about something long enough"))
+        assert memory.total_tokens <= 60
+
+    # Oldest summary lines are dropped first
+    assert memory.summary == "- user: question number 6 about something long enough"
+    assert memory.total_tokens == sum(memory.token_counter(payload) for payload in memory.to_dict_list())
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from app.agent.dag import cyclic_nodes, run_dag
+from app.agent.orchestrator import OrchestratorAgent
+from app.agent.toolcall import ToolAgent
+from app.schema import ToolCall
+from app.tools.base import Tool
+
+from tests.conftest import completion
+
+def test_cyclic_nodes():
+    dependencies = {"a": ["b"], "b": ["c"], "c": ["a"], "d": ["a"], "e": []}
+    assert cyclic_nodes(dependencies) == {"a", "b", "c", "d"} # d waits on the cycle
+    assert cyclic_nodes({"a": [], "b": ["a"]}) == set()
+
+    with pytest.raises(ValueError, match="Dependency cycle"):
+        asyncio.run(run_dag(dependencies, lambda node: asyncio.sleep(0)))
+
+def test_run_dag_respects_dependencies():
+    order = []
+
+    async def run(node):
+        order.append(node)
+        await asyncio.sleep(0)
+        return node.upper()
+
+    results = asyncio.run(run_dag({"a": [], "b": ["a"], "c": ["b", "a"]}, run, 4))
+    assert results == {"a": "A", "b": "B", "c": "C"}
+    assert order == ["a", "b", "c"]
+
+def delegate(task_id, task="task", depends_on=()):
+    return {"name": "worker", "arguments": {"task": task, "task_id": task_id, "depends_on": list(depends_on)}}
+
+def test_cycles_fail_without_running(scripted_llm):
+    worker = ToolAgent(name="worker", model=scripted_llm([]))
+    mars = OrchestratorAgent(name="mars", model=scripted_llm([]), agents=[worker])
+
+    response = completion(tool_calls=[delegate("a", depends_on=["b"]), delegate("b", depends_on=["a"]), delegate("c", depends_on=["x"])])
+    calls = ToolCall.from_response(response.choices[0].message.tool_calls)
+    dependencies, errors = mars.plan(calls)
+
+    assert errors[calls[0].id] == errors[calls[1].id] == "Error: the task is part of a dependency cycle"
+    assert errors[calls[2].id] == "Error: unknown dependency 'x'"
+
+def test_sub_agent_spend_counts_in_the_orchestrator_run(scripted_llm):
+    worker = ToolAgent(name="worker", model=scripted_llm([completion("42", prompt_tokens=100, completion_tokens=20)]))
+    mars = OrchestratorAgent(name="mars", model=scripted_llm([
+        completion(tool_calls=[delegate("answer")]),
+        completion("The answer is 42"),
+    ]), agents=[worker])
+
+    result = asyncio.run(mars.run("What is the answer?"))
+
+    assert result.answer == "The answer is 42"
+    assert (result.metrics.steps, result.metrics.llm_calls, result.metrics.tool_calls) == (2, 2, 1) # the orchestrator's own work
+    assert (result.metrics.subagent_steps, result.metrics.subagent_llm_calls, result.metrics.subagent_tool_calls) == (1, 1, 0)
+    assert result.metrics.prompt_tokens == 10 + 100 + 10
+    assert result.metrics.completion_tokens == 5 + 20 + 5
+
+def test_stopped_sub_agent_returns_its_stop_reason(scripted_llm):
+    @Tool.as_tool
+    def lookup(query: str) -> str:
+        """Looks something up"""
+        return query
+
+    worker = ToolAgent(name="worker", max_steps=1, toolbox=[lookup], model=scripted_llm([
+        completion(tool_calls=[{"name": "lookup", "arguments": {"query": "answer"}}]),
+    ]))
+    mars = OrchestratorAgent(name="mars", model=scripted_llm([
+        completion(tool_calls=[delegate("answer")]),
+        completion("I could not find it"),
+    ]), agents=[worker])
+
+    result = asyncio.run(mars.run("What is the answer?"))
+
+    assert result.results[0] == "Error: the 'worker' agent stopped before answering (max_steps)"
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from app.agent.planner import PlannerAgent, find_references, resolve_references
+from app.tools.base import Tool
+
+from tests.conftest import completion
+
+def test_whole_value_reference_is_replaced():
+    assert resolve_references({"a": "$s1", "b": [" $s2 "]}, {"s1": "6", "s2": "7"}) == {"a": "6", "b": ["7"]}
+
+def test_embedded_references_need_braces():
+    results = {"1": "spliced", "s1": "6"}
+    assert resolve_references("costs $1, total ${s1}", results) == "costs $1, total 6"
+    assert resolve_references("${unknown} stays", results) == "${unknown} stays"
+
+def test_find_references():
+    assert find_references({"a": "$s1", "b": ["costs $2 and ${s3}"], "c": 4}) == {"s1", "s3"}
+
+@Tool.as_tool
+def multiply(a: float, b: float) -> float:
+    """Multiplies two numbers"""
+    return a * b
+
+@Tool.as_tool
+def echo(text: str) -> str:
+    """Returns the text"""
+    return text
+
+def plan_call(*steps):
+    return {"name": "plan", "arguments": {"steps": [
+        {"id": step_id, "tool": tool, "arguments": json.dumps(arguments), "depends_on": list(depends_on)}
+        for step_id, tool, arguments, depends_on in steps
+    ]}}
+
+def test_plan_runs_in_one_round_trip(scripted_llm):
+    llm = scripted_llm([
+        completion(tool_calls=[plan_call(
+            ("s1", "multiply", {"a": 2, "b": 3}, []),
+            ("s2", "multiply", {"a": "$s1", "b": 4}, []), # dependency found from the reference
+            ("s3", "echo", {"text": "s2 costs $1: ${s2}"}, ["s2"]),
+            ("s4", "echo", {"text": "${s5}"}, ["s5"]),
+            ("s5", "echo", {"text": "${s4}"}, ["s4"]),
+        )]),
+        completion("24"),
+    ])
+    agent = PlannerAgent(name="planner", model=llm, toolbox=[multiply, echo])
+
+    result = asyncio.run(agent.run("What is 2 * 3 * 4?"))
+
+    assert result.answer == "24"
+    assert len(llm.requests) == 2
+    assert result.results[0].splitlines() == [
+        "[s1] multiply: 6.0",
+        "[s2] multiply: 24.0",
+        "[s3] echo: s2 costs $1: 24.0",
+        "[s4] echo: Error: the step is part of a dependency cycle",
+        "[s5] echo: Error: the step is part of a dependency cycle",
+    ]
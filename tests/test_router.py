@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from app.router import BackendHealth, RoutedLLM
+from app.schema import LLMSettings, Message
+from app.tracing import TRACER
+
+from tests.conftest import stream_of, chunk, scripted_client
+
+def routed_llm(latencies, failures=(), **kwargs) -> RoutedLLM:
+    """RoutedLLM whose backends answer their index after the given latencies, or fail"""
+    configs = [LLMSettings(model_name=f"model-{index}", api_key="test", provider="groq") for index in range(len(latencies))]
+    llm = RoutedLLM(configs, **kwargs)
+    llm.calls = []
+
+    for index, backend in enumerate(llm.backends):
+        async def create(request, priority=None, size=None, index=index):
+            llm.calls.append(index)
+            await asyncio.sleep(latencies[index])
+            if index in failures:
+                raise RuntimeError(f"backend {index} failed")
+            return index
+        backend.create = create
+
+    return llm
+
+def call(llm: RoutedLLM):
+    return asyncio.run(llm.create({"messages": []}))
+
+def test_cancelled_call_seeds_unknown_latency():
+    health = BackendHealth()
+    health.record_lower_bound(0.5)
+    assert health.ewma == 0.5
+    assert not health.samples
+
+    health.record_lower_bound(0.1) # never lowered
+    assert health.ewma == 0.5
+
+def test_unknown_latencies_rank_last():
+    llm = routed_llm([0.0, 0.0, 0.0])
+    llm.health[id(llm.backends[1])].record_latency(0.2)
+    llm.health[id(llm.backends[2])].record_latency(0.1)
+    assert llm.ranked_backends() == [llm.backends[2], llm.backends[1], llm.backends[0]]
+
+def test_fails_over_to_next_backend():
+    llm = routed_llm([0.0, 0.0], failures={0})
+    assert call(llm) == 1
+    assert not llm.health[id(llm.backends[0])].healthy
+    assert llm.ranked_backends()[0] is llm.backends[1]
+
+def test_raises_last_error_when_every_backend_fails():
+    llm = routed_llm([0.0, 0.0], failures={0, 1})
+    with pytest.raises(RuntimeError, match="backend 1"):
+        call(llm)
+
+def test_hedge_winner_becomes_primary():
+    llm = routed_llm([0.5, 0.01], hedge=True, default_hedge_delay=0.05)
+    assert call(llm) == 1
+    assert llm.calls == [0, 1]
+
+    # The slow backend lost the hedge: later calls go straight to the fast one
+    llm.calls.clear()
+    assert call(llm) == 1
+    assert llm.calls == [1]
+
+def test_backends_use_their_own_settings():
+    configs = [
+        LLMSettings(model_name="primary", api_key="test", provider="groq", temperature=0.0, max_completion_tokens=100),
+        LLMSettings(model_name="fallback", api_key="test", provider="azure", base_url="https://example.invalid", api_version="v1",
+                    temperature=0.5, top_p=0.9, max_completion_tokens=200, prompt_token_cost=1_000_000),
+    ]
+    llm = RoutedLLM(configs)
+    requests = []
+
+    async def failing(**request):
+        raise RuntimeError("down")
+
+    async def streaming(**request):
+        requests.append(request)
+        return stream_of([chunk("Hi"), chunk(usage={"prompt_tokens": 3, "completion_tokens": 1})])
+
+    llm.backends[0].client = scripted_client(failing)
+    llm.backends[1].client = scripted_client(streaming)
+
+    async def main():
+        return [event async for event in llm.stream([Message.user_message("Hi")])]
+
+    spans = []
+    TRACER.add_hook(spans.append)
+    try:
+        events = asyncio.run(main())
+    finally:
+        TRACER.remove_hook(spans.append)
+
+    assert events[-1].content == "Hi"
+    assert {key: requests[0][key] for key in ("model", "temperature", "top_p", "max_completion_tokens", "stream_options")} == {
+        "model": "fallback", "temperature": 0.5, "top_p": 0.9, "max_completion_tokens": 200, "stream_options": {"include_usage": True},
+    }
+    stream_span = next(span for span in spans if span.name == "llm.stream")
+    assert stream_span.attributes["cost"] == 3 # priced with the fallback prices
+
+def test_hedge_loser_is_cancelled_and_awaited():
+    llm = routed_llm([0.5, 0.01], hedge=True, default_hedge_delay=0.05)
+    finished = []
+    slow = llm.backends[0].create
+
+    async def tracked(request, priority=None, size=None):
+        try:
+            return await slow(request, priority, size)
+        finally:
+            finished.append(asyncio.current_task().cancelling())
+    llm.backends[0].create = tracked
+
+    async def main():
+        result = await llm.create({"messages": []})
+        return result, list(finished) # the loser already finished when create returns
+
+    assert asyncio.run(main()) == (1, [1])
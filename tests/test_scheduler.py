@@ -0,0 +1,104 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.scheduler import RequestScheduler, TokenBucket, get_scheduler, retry_after
+from app.schema import LLMSettings, Priority
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers=None):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers=headers or {})
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(capacity=10, refill_per_second=2)
+
+    bucket.consume(10)
+    assert bucket.wait_time(4) == 2.0
+    now[0] += 1
+    assert bucket.wait_time(4) == 1.0
+    assert bucket.wait_time(100) == 4.0 # amounts above the capacity wait for a full bucket
+
+    bucket.drain()
+    now[0] += 5
+    assert bucket.wait_time(10) == 0.0
+
+def test_retry_after_headers():
+    assert retry_after(RateLimitError({"retry-after-ms": "250"})) == 0.25
+    assert retry_after(RateLimitError({"retry-after": "2"})) == 2.0
+    assert retry_after(RateLimitError({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+    assert retry_after(ValueError()) is None
+
+def test_interactive_calls_go_before_batch_calls():
+    scheduler = RequestScheduler()
+    order = []
+
+    async def call(name):
+        order.append(name)
+
+    async def main():
+        scheduler._paused_until = time.monotonic() + 0.05
+        batch = asyncio.create_task(scheduler.submit(lambda: call("batch"), priority=Priority.BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(scheduler.submit(lambda: call("interactive"), priority=Priority.INTERACTIVE))
+        await asyncio.gather(batch, interactive)
+
+    asyncio.run(main())
+    assert order == ["interactive", "batch"]
+
+def test_tokens_per_minute_delays_calls():
+    scheduler = RequestScheduler(tokens_per_minute=60) # one token per second
+    scheduler.tokens.tokens = 0
+
+    async def main():
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.2):
+                await scheduler.acquire(5)
+        await scheduler.acquire(0)
+
+    asyncio.run(main())
+
+def test_rate_limit_errors_are_retried_after_the_delay():
+    scheduler = RequestScheduler(max_retries=2)
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimitError({"retry-after-ms": "50"})
+        return "ok"
+
+    assert asyncio.run(scheduler.submit(call)) == "ok"
+    assert attempts[1] - attempts[0] >= 0.05
+
+def test_retries_are_bounded_and_other_errors_raise():
+    scheduler = RequestScheduler(max_retries=1, base_backoff=0.001)
+    attempts = []
+
+    async def limited():
+        attempts.append(True)
+        raise RateLimitError()
+
+    async def broken():
+        attempts.append(True)
+        raise ValueError("bad request")
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(scheduler.submit(limited))
+    assert len(attempts) == 2
+
+    attempts.clear()
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.submit(broken))
+    assert len(attempts) == 1
+
+def test_schedulers_are_shared_by_deployment():
+    settings = LLMSettings(model_name="shared-model", api_key="a", provider="groq", requests_per_minute=30)
+    assert get_scheduler(settings) is get_scheduler(settings.model_copy(update={"api_key": "b"}))
+    assert get_scheduler(settings) is not get_scheduler(settings.model_copy(update={"model_name": "other-model"}))
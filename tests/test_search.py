@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.tools import search as search_module
+from app.tools.search import compact_results, duckduckgo_search_tool, normalize_url, shorten
+
+def result(url, title="title", body="body"):
+    return {"title": title, "href": url, "body": body}
+
+def test_shorten_collapses_whitespace_and_truncates():
+    assert shorten("  a \n b\tc ", 10) == "a b c"
+    assert shorten("abcdefghij", 10) == "abcdefghij"
+    assert shorten("abcdefghijk", 10) == "abcdefg..."
+    assert shorten(None, 10) == ""
+
+def test_urls_are_deduplicated_across_queries():
+    assert normalize_url("HTTPS://Example.com/page/#top") == "https://example.com/page"
+
+    text = compact_results({
+        "first": [result("https://example.com/page", title="kept")],
+        "second": [result("https://EXAMPLE.com/page/#intro", title="duplicate"), result("https://other.com", title="other")],
+    }, max_chars=1000, snippet_chars=50)
+
+    assert "kept" in text and "other" in text
+    assert "duplicate" not in text
+
+def test_results_are_picked_round_robin_and_rendered_by_query():
+    results = {
+        "first": [result(f"https://first.com/{rank}", title=f"first {rank}") for rank in range(3)],
+        "second": [result(f"https://second.com/{rank}", title=f"second {rank}") for rank in range(3)],
+    }
+    lines = ["- first 0 (https://first.com/0): body", "- second 0 (https://second.com/0): body", "- first 1 (https://first.com/1): body"]
+    headers = len('Results for "first":\n') + len('Results for "second":\n')
+
+    text = compact_results(results, max_chars=headers + sum(len(line) + 1 for line in lines), snippet_chars=50)
+
+    # the budget fits three results: both top results first, then the next one of the first query
+    assert text == ('Results for "first":\n'
+                    "- first 0 (https://first.com/0): body\n"
+                    "- first 1 (https://first.com/1): body\n"
+                    'Results for "second":\n'
+                    "- second 0 (https://second.com/0): body")
+
+def test_queries_dropped_by_the_budget_say_so():
+    text = compact_results({
+        "short": [result("https://a.com", body="tiny")],
+        "long": [result("https://b.com", body="x" * 200)],
+        "empty": [],
+    }, max_chars=120, snippet_chars=200)
+
+    blocks = text.split("Results for ")
+    assert "https://a.com" in blocks[1]
+    assert blocks[2] == '"long":\n(omitted: character budget)\n'
+    assert blocks[3] == '"empty":\n- no results'
+
+def test_snippets_are_shortened():
+    text = compact_results({"query": [result("https://a.com", body="word " * 100)]}, max_chars=1000, snippet_chars=20)
+    assert text.endswith(": word word word wo...")
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    """Replaces DuckDuckGo with canned results, failing for queries containing "fail" """
+    searched = []
+
+    def text(query, max_results):
+        searched.append(query)
+        if "fail" in query:
+            raise ConnectionError("rate limited")
+        return [result(f"https://{query}.com/{rank}", title=f"{query} {rank}") for rank in range(max_results)]
+
+    monkeypatch.setattr(search_module, "get_ddgs_session", lambda: SimpleNamespace(text=text))
+    return searched
+
+def test_partial_failure_keeps_the_other_results(fake_search):
+    tool = duckduckgo_search_tool()
+
+    text = asyncio.run(tool.invoke(queries=["cats", "fail", "cats "], num_results=2))
+
+    assert sorted(fake_search) == ["cats", "fail"] # duplicated queries are searched once
+    assert "cats 0" in text and "cats 1" in text
+    assert text.endswith('Results for "fail":\n- search failed (ConnectionError), try again later or rephrase')
+
+def test_every_query_failing_raises(fake_search):
+    tool = duckduckgo_search_tool()
+
+    with pytest.raises(RuntimeError, match="Every search failed"):
+        asyncio.run(tool.invoke(queries=["fail"]))
+
+def test_single_query_string_is_accepted(fake_search):
+    tool = duckduckgo_search_tool()
+
+    text = asyncio.run(tool.invoke(queries="dogs", num_results=1))
+
+    assert fake_search == ["dogs"]
+    assert text == 'Results for "dogs":\n- dogs 0 (https://dogs.com/0): body'
+
+def test_results_are_cached_across_calls(fake_search):
+    tool = duckduckgo_search_tool()
+
+    async def main():
+        await tool.invoke(queries=["cats"])
+        return await tool.invoke(queries=["cats", "dogs"])
+
+    asyncio.run(main())
+
+    assert fake_search == ["cats", "dogs"]
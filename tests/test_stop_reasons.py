@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from app.agent.toolcall import ToolAgent
+from app.prompts.default import LOOP_WARNING
+from app.schema import RunBudget, StopReason
+from app.tools.base import Tool
+
+from tests.conftest import completion, scripted_client
+
+def lookup_calls(*queries):
+    """Completions calling `lookup` once per query, then answering"""
+    return [completion(tool_calls=[{"name": "lookup", "arguments": {"query": query}}]) for query in queries] + [completion("done")]
+
+@Tool.as_tool(reusable=True)
+def lookup(query: str) -> str:
+    """Looks something up"""
+    return f"found {query}"
+
+def hanging_tool(started: asyncio.Event = None, cancelled: list = None) -> Tool:
+    """Tool that never answers, setting `started` when called and recording its cancellation"""
+    @Tool.as_tool
+    async def wait(query: str) -> str:
+        """Waits for something"""
+        if started is not None:
+            started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(query)
+            raise
+        return query
+
+    return wait
+
+def test_deadline_stops_the_run_with_its_partial_result(scripted_llm):
+    llm = scripted_llm([completion(tool_calls=[{"name": "wait", "arguments": {"query": "x"}}])])
+    agent = ToolAgent(name="agent", model=llm, toolbox=[hanging_tool()])
+
+    result = asyncio.run(asyncio.wait_for(agent.run("Wait", RunBudget(timeout=0.05)), 5))
+
+    assert result.stop_reason == StopReason.DEADLINE
+    assert result.answer is None
+
+def test_cancel_stops_one_run(scripted_llm):
+    llm = scripted_llm([completion(tool_calls=[{"name": "wait", "arguments": {"query": "x"}}])])
+    started, cancelled = asyncio.Event(), []
+    agent = ToolAgent(name="agent", model=llm, toolbox=[hanging_tool(started, cancelled)])
+
+    async def main():
+        run = asyncio.ensure_future(agent.run("Wait"))
+        await started.wait()
+        (run_id,) = agent._running
+        assert agent.cancel("unknown") == 0
+        assert agent.cancel(run_id) == 1
+        return await run
+
+    result = asyncio.run(asyncio.wait_for(main(), 5))
+
+    assert result.stop_reason == StopReason.CANCELLED
+    assert result.answer is None
+    assert cancelled == ["x"] # the in-flight tool call was cancelled
+    assert agent._running == {}
+
+def test_llm_timeout_stops_the_run_with_its_partial_result(scripted_llm):
+    llm = scripted_llm([])
+    responses = iter(lookup_calls("a"))
+
+    async def create(**request):
+        if len(llm.requests) == 1:
+            await asyncio.sleep(60) # the second reflection never answers
+        llm.requests.append(request)
+        return next(responses)
+
+    llm.client = scripted_client(create)
+    agent = ToolAgent(name="agent", model=llm, toolbox=[lookup])
+
+    result = asyncio.run(asyncio.wait_for(agent.run("Look it up", RunBudget(llm_timeout=0.05)), 5))
+
+    assert result.stop_reason == StopReason.LLM_TIMEOUT
+    assert result.answer is None
+    assert result.results == ["found a"] # the steps completed before the timeout are kept
+
+def test_tool_timeout_is_reported_to_the_model(scripted_llm):
+    llm = scripted_llm([completion(tool_calls=[{"id": "slow", "name": "wait", "arguments": {"query": "x"}}]), completion("gave up")])
+    agent = ToolAgent(name="agent", model=llm, toolbox=[hanging_tool()])
+
+    result = asyncio.run(asyncio.wait_for(agent.run("Wait", RunBudget(tool_timeout=0.02)), 5))
+
+    assert result.stop_reason is None
+    assert result.answer == "gave up"
+    tool_message = next(message for message in llm.requests[1]["messages"] if message["role"] == "tool")
+    assert (tool_message["tool_call_id"], tool_message["content"]) == ("slow", "Error: tool 'wait' did not answer within 0.02s")
+
+def test_token_budget_stops_between_steps(scripted_llm):
+    llm = scripted_llm(lookup_calls("a", "b", "c")) # 15 tokens per completion
+    agent = ToolAgent(name="agent", model=llm, toolbox=[lookup])
+
+    result = asyncio.run(agent.run("Look it up", RunBudget(max_tokens=20)))
+
+    assert result.stop_reason == StopReason.TOKEN_BUDGET
+    assert result.answer is None
+    assert len(llm.requests) == 2 # the step exceeding the budget completes
+    assert result.metrics.total_tokens == 30
+
+def test_cost_budget_stops_between_steps(scripted_llm):
+    llm = scripted_llm(lookup_calls("a", "b", "c"), prompt_token_cost=1_000, completion_token_cost=2_000) # 0.02 per completion
+    agent = ToolAgent(name="agent", model=llm, toolbox=[lookup])
+
+    result = asyncio.run(agent.run("Look it up", RunBudget(max_cost=0.03)))
+
+    assert result.stop_reason == StopReason.COST_BUDGET
+    assert result.answer is None
+    assert len(llm.requests) == 2
+    assert result.metrics.cost == pytest.approx(0.04)
+
+def test_max_steps_stops_the_run(scripted_llm):
+    llm = scripted_llm(lookup_calls("a", "b", "c"))
+    agent = ToolAgent(name="agent", model=llm, toolbox=[lookup], max_steps=2)
+
+    result = asyncio.run(agent.run("Look it up"))
+
+    assert result.stop_reason == StopReason.MAX_STEPS
+    assert result.answer is None
+    assert result.results == ["found a", "found b"]
+
+def test_repeating_the_same_call_stops_the_run_as_a_loop(scripted_llm):
+    llm = scripted_llm(lookup_calls("a", "a", "a", "a"))
+    agent = ToolAgent(name="agent", model=llm, toolbox=[lookup], max_stalled_steps=1)
+
+    result = asyncio.run(agent.run("Look it up"))
+
+    assert result.stop_reason == StopReason.LOOP
+    assert result.answer is None
+    assert len(llm.requests) == 3
+    warning = LOOP_WARNING.format(calls='lookup({"query": "a"})')
+    assert [message["content"] for message in llm.requests[2]["messages"]].count(warning) == 1
+
+def test_cancelling_the_caller_propagates(scripted_llm):
+    llm = scripted_llm([completion(tool_calls=[{"name": "wait", "arguments": {"query": "x"}}])])
+    started, cancelled = asyncio.Event(), []
+    agent = ToolAgent(name="agent", model=llm, toolbox=[hanging_tool(started, cancelled)])
+
+    async def main():
+        run = asyncio.ensure_future(agent.run("Wait"))
+        await started.wait()
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+
+    asyncio.run(asyncio.wait_for(main(), 5))
+
+    assert cancelled == ["x"]
+    assert agent.context.stop_reason is None # cancelled by its caller, not stopped
+    assert agent._running == {}
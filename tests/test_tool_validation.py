@@ -0,0 +1,73 @@
+import asyncio
+from typing import List, Literal, Optional
+
+import pytest
+from pydantic import BaseModel
+
+from app.tools.base import Tool, ToolArgumentError, parse_docstring
+
+class Point(BaseModel):
+    x: int
+    y: int = 0
+
+@Tool.as_tool
+def move(p: Point, steps: int = 1, mode: Literal["walk", "run"] = "walk", tags: Optional[List[str]] = None) -> str:
+    """Moves to a point.
+
+    Args:
+        p: Destination
+        steps: Number of steps,
+            at least one
+    """
+    return f"{p.x},{p.y} {steps} {mode} {tags}"
+
+def parameters(tool: Tool):
+    return tool.tool_metadata["function"]["parameters"]
+
+def test_docstring_descriptions():
+    summary, params = parse_docstring(move.__doc__)
+    assert summary == "Moves to a point."
+    assert params == {"p": "Destination", "steps": "Number of steps, at least one"}
+    assert parameters(move)["properties"]["steps"]["description"] == "Number of steps, at least one (default: 1)"
+
+def test_strict_schema_requires_every_parameter():
+    schema = parameters(move)
+    assert schema["required"] == ["p", "steps", "mode", "tags"]
+    assert schema["additionalProperties"] is False
+    assert {"type": "null"} in schema["properties"]["steps"]["anyOf"]
+
+def test_nested_defaulted_fields_are_not_nullable():
+    point = parameters(move)["$defs"]["Point"]
+    assert point["required"] == ["x", "y"]
+    assert point["properties"]["y"] == {"type": "integer", "description": "(default: 0)"}
+
+def test_nulls_take_the_defaults():
+    kwargs = move.validate({"p": {"x": 1, "y": 2}, "steps": None, "mode": None, "tags": None})
+    assert kwargs == {"p": Point(x=1, y=2), "steps": 1, "mode": "walk", "tags": None}
+
+def test_arguments_are_converted():
+    assert move.validate({"p": {"x": "3"}, "steps": "2"})["steps"] == 2
+
+@pytest.mark.parametrize("arguments, problem", [
+    ({}, "p: Field required"),
+    ({"p": {"x": 1, "y": None}}, "p.y: Input should be a valid integer"),
+    ({"p": {"x": 1}, "mode": "fly"}, "mode: Input should be 'walk' or 'run'"),
+    ({"p": {"x": 1}, "speed": 2}, "speed: Extra inputs are not permitted"),
+])
+def test_invalid_arguments(arguments, problem):
+    with pytest.raises(ToolArgumentError, match=problem):
+        move.validate(arguments)
+
+def test_invoke_validates_before_executing():
+    assert asyncio.run(move.invoke(p={"x": 1})) == "1,0 1 walk None"
+    with pytest.raises(ToolArgumentError):
+        asyncio.run(move.invoke(p="here"))
+
+def test_non_strict_schema_keeps_defaults():
+    @Tool.as_tool(strict=False)
+    def greet(name: str, polite: bool = True) -> str:
+        return name
+
+    schema = parameters(greet)
+    assert schema["required"] == ["name"]
+    assert schema["properties"]["polite"] == {"type": "boolean", "default": True}
@@ -0,0 +1,112 @@
+import asyncio
+
+from app.agent.toolcall import ToolAgent
+from app.prompts.default import LOOP_WARNING
+from app.schema import StopReason
+from app.tools.base import Tool
+
+from tests.conftest import completion
+
+@Tool.as_tool
+async def slow_lookup(query: str) -> str:
+    """Looks something up, slowly"""
+    await asyncio.sleep(0.02)
+    return f"found {query}"
+
+@Tool.as_tool
+def broken(query: str) -> str:
+    """Always fails"""
+    raise RuntimeError("service down")
+
+def tool_messages(request):
+    return {message["tool_call_id"]: message["content"] for message in request["messages"] if message["role"] == "tool"}
+
+def test_failing_call_does_not_orphan_its_siblings(scripted_llm):
+    llm = scripted_llm([
+        completion(tool_calls=[{"id": "a", "name": "broken", "arguments": {"query": "x"}},
+                               {"id": "b", "name": "slow_lookup", "arguments": {"query": "y"}}]),
+        completion("done"),
+    ])
+    agent = ToolAgent(name="agent", model=llm, toolbox=[broken, slow_lookup])
+
+    result = asyncio.run(agent.run("Look it up"))
+
+    assert result.answer == "done"
+    assert tool_messages(llm.requests[1]) == {"a": "Error: Failed to execute 'broken'", "b": "found y"}
+
+def lookup_tools():
+    """A reusable and a non reusable tool, recording their executions"""
+    executions = []
+
+    @Tool.as_tool(reusable=True)
+    def lookup(query: str) -> str:
+        """Looks something up"""
+        executions.append(("lookup", query))
+        return f"found {query}"
+
+    @Tool.as_tool
+    def fetch(url: str) -> str:
+        """Fetches a page, which may change between calls"""
+        executions.append(("fetch", url))
+        return f"page {len(executions)}"
+
+    return [lookup, fetch], executions
+
+def calls(*steps):
+    """Completions making one tool call per step, given as (tool, argument), then answering"""
+    arguments = {"lookup": "query", "fetch": "url"}
+    return [completion(tool_calls=[{"name": tool, "arguments": {arguments[tool]: value}}]) for tool, value in steps] + [completion("done")]
+
+def test_repeated_reusable_call_is_answered_from_the_ledger(scripted_llm):
+    llm = scripted_llm(calls(("lookup", "a"), ("lookup", "a")))
+    toolbox, executions = lookup_tools()
+
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=toolbox).run("Look it up"))
+
+    assert result.answer == "done"
+    assert executions == [("lookup", "a")]
+    repeated = [message["content"] for message in llm.requests[2]["messages"] if message["role"] == "tool"][-1]
+    assert repeated.startswith("found a\n(Repeated call")
+
+def test_non_reusable_tools_are_executed_again(scripted_llm, monkeypatch):
+    from app.tools.askuser import ask_user
+
+    answers = iter(["yes", "no"])
+    monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+    llm = scripted_llm([completion(tool_calls=[{"name": "ask_user", "arguments": {"question": "Sure?"}}])] * 2 + [completion("done")])
+
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=[ask_user]).run("Ask me"))
+
+    assert result.answer == "done"
+    assert [message["content"] for message in llm.requests[2]["messages"] if message["role"] == "tool"] == ["yes", "no"]
+
+def test_a_b_a_cycle_adds_a_corrective_message(scripted_llm):
+    llm = scripted_llm(calls(("fetch", "a"), ("fetch", "b"), ("fetch", "a")))
+    toolbox, executions = lookup_tools()
+
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=toolbox, max_stalled_steps=1).run("Fetch it"))
+
+    assert result.answer == "done"
+    assert len(executions) == 3 # fetch is not reusable, the cycle is spotted from the call history
+    warning = LOOP_WARNING.format(calls='fetch({"url": "a"})')
+    assert [message["content"] for message in llm.requests[2]["messages"]].count(warning) == 0
+    assert [message["content"] for message in llm.requests[3]["messages"]].count(warning) == 1
+
+def test_cycle_stops_the_run_after_max_stalled_steps(scripted_llm):
+    llm = scripted_llm(calls(("fetch", "a"), ("fetch", "b"), ("fetch", "a"), ("fetch", "b"), ("fetch", "a")))
+    toolbox, _ = lookup_tools()
+
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=toolbox, max_stalled_steps=1).run("Fetch it"))
+
+    assert result.stop_reason == StopReason.LOOP
+    assert result.answer is None
+    assert len(llm.requests) == 4 # the second stalled step in a row stops the run
+
+def test_progress_resets_the_stalled_steps(scripted_llm):
+    llm = scripted_llm(calls(("fetch", "a"), ("fetch", "b"), ("fetch", "a"), ("fetch", "c"), ("fetch", "d"), ("fetch", "c")))
+    toolbox, _ = lookup_tools()
+
+    result = asyncio.run(ToolAgent(name="agent", model=llm, toolbox=toolbox, max_stalled_steps=1).run("Fetch it"))
+
+    assert result.stop_reason is None
+    assert result.answer == "done"